@@ -0,0 +1,95 @@
+import time
+
+import config
+
+
+class AimdController(object):
+
+    """
+    Additive increase / multiplicative decrease of the request rate (and concurrency) of a single collector.
+    Rate goes up while latency and error rate in StatsClass stay healthy and is cut at once on
+    OVER_QUERY_LIMIT, timeouts and 5xx responses. Works below the hard caps of the shared limiter.
+    """
+
+    rate: float             # target requests per second
+    concurrency: int        # target requests in flight, only used by the asyncio engine
+
+    def __init__(self,
+                 initial_rate: float = config.AIMD_INITIAL_RATE,
+                 min_rate: float = config.AIMD_MIN_RATE,
+                 max_rate: float = config.AIMD_MAX_RATE,
+                 initial_concurrency: int = 1,
+                 max_concurrency: int = 1):
+
+        assert 0 < min_rate <= initial_rate <= max_rate, \
+            f"invalid rates: min = {min_rate}, initial = {initial_rate}, max = {max_rate}"
+        assert 1 <= initial_concurrency <= max_concurrency, \
+            f"invalid concurrency: initial = {initial_concurrency}, max = {max_concurrency}"
+
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+
+        self.concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+
+        self.__next_start = 0
+        self.__last_decrease = 0
+
+        # StatsClass counters at the start of the current window
+        self.__window_started = time.time()
+        self.__window_requests = 0
+        self.__window_errors = 0
+        self.__window_request_time = 0
+
+    def __decrease(self):
+        self.rate = max(self.min_rate, self.rate * config.AIMD_DECREASE)
+        self.concurrency = max(1, int(self.concurrency * config.AIMD_DECREASE))
+        self.__last_decrease = time.time()
+
+    def __increase(self):
+        self.rate = min(self.max_rate, self.rate + config.AIMD_INCREASE)
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+    def backoff(self):
+
+        """ Call on throttling signals. Requests already in flight fail together, so cut once per cooldown. """
+
+        if time.time() - self.__last_decrease >= config.AIMD_COOLDOWN:
+            self.__decrease()
+
+    def update(self, stats):
+
+        """ Call after each request. Once per window, raises the rate if the window was healthy. """
+
+        now = time.time()
+        if now - self.__window_started < config.AIMD_WINDOW:
+            return
+
+        requests = stats.requests - self.__window_requests
+        errors = stats.critical_errors + stats.request_errors - self.__window_errors
+        request_time = stats.total_request_time - self.__window_request_time
+
+        if requests > 0:
+            error_rate = errors / requests
+            latency = request_time / requests
+
+            if error_rate > config.AIMD_MAX_ERROR_RATE or latency > config.AIMD_LATENCY_TARGET:
+                self.backoff()
+            elif now - self.__last_decrease >= config.AIMD_WINDOW:
+                self.__increase()
+
+        self.__window_started = now
+        self.__window_requests = stats.requests
+        self.__window_errors = stats.critical_errors + stats.request_errors
+        self.__window_request_time = stats.total_request_time
+
+    def reserve(self) -> float:
+
+        """ Reserves the next request start at the target rate. Returns seconds to wait before it. """
+
+        now = time.time()
+        wait = self.__next_start - now
+        self.__next_start = max(now, self.__next_start) + 1 / self.rate
+
+        return max(0.0, wait)
@@ -1,3 +1,7 @@
+import json
+import os
+from typing import Dict
+
 import config
 
 
@@ -8,3 +12,31 @@ def get_api_keys():
 
     keys = [x.strip() for x in data.split('\n') if x]
     return keys
+
+
+def load_tracker(lock) -> dict:
+
+    """ Reads requests count per API key from previous sessions. """
+
+    if not os.path.isfile(config.TRACKER_JSON):
+        return {}
+
+    with lock, open(config.TRACKER_JSON, encoding='utf-8-sig') as f:
+        return json.loads(f.read())
+
+
+def update_tracker(counts: Dict[str, int], lock):
+
+    """ Writes overall requests count for the given API keys, keeps counts of other keys as is. """
+
+    with lock:
+        if os.path.isfile(config.TRACKER_JSON):
+            with open(config.TRACKER_JSON, encoding='utf-8-sig') as f:
+                trackerdict = json.loads(f.read())
+        else:
+            trackerdict = {}
+
+        trackerdict.update(counts)
+
+        with open(config.TRACKER_JSON, 'w', encoding='utf-8-sig') as f:
+            json.dump(trackerdict, f)
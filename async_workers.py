@@ -0,0 +1,388 @@
+import asyncio
+import functools
+import multiprocessing as mp
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from typing import List
+
+import config
+from adaptive import AimdController
+from coverage import CoverageIndex
+from dedup import DuplicateIndex
+from dataclass import PoiData
+from exceptions import *
+from geometries.backend import make_densifier
+from geometries.vectorized import PreparedPolygon
+from keypool import KeyPool
+from retry import RetryPolicy
+from tasks import TaskDefinition, PageContinuation
+from transport import PlacesTransport, make_transport
+from workers import CollectorBase
+
+
+class AsyncGoogleCollector(CollectorBase):
+
+    """
+    Single collector process for the whole key pool.
+    Many Nearby Search requests are kept in flight at once, blocking HTTP calls run in a thread pool.
+    """
+
+    __info_each: int = 25
+
+    def __init__(self,
+                 key_pool: KeyPool,
+                 tasks_q: mp.Queue,
+                 database_q: mp.Queue,
+                 rawfile_q: mp.Queue,
+                 printlock: mp.Lock,
+                 writelock: mp.Lock,
+                 coverage: CoverageIndex = None,
+                 aoi: PreparedPolygon = None,
+                 pruned: mp.Value = None,
+                 duplicates: DuplicateIndex = None,
+                 max_in_flight: int = config.ASYNC_MAX_IN_FLIGHT
+                 ):
+
+        assert max_in_flight > 0, f"invalid number of in-flight requests {max_in_flight}"
+
+        self.max_in_flight = max_in_flight
+        self.transport: PlacesTransport = None      # initialize in a separate process
+        self.in_flight = 0
+        self.__slot_freed: asyncio.Condition = None     # notified whenever a task ends, made in the event loop
+
+        self.__loop: asyncio.AbstractEventLoop = None
+        self.__executor: ThreadPoolExecutor = None
+        self.__queue_reader: ThreadPoolExecutor = None
+        self.__disk_io: ThreadPoolExecutor = None     # the cache connection is made and used in its only thread
+        self.__started: float = None
+
+        super().__init__(key_pool=key_pool, tasks_q=tasks_q,
+                         database_q=database_q, rawfile_q=rawfile_q,
+                         printlock=printlock, writelock=writelock, coverage=coverage, aoi=aoi,
+                         pruned=pruned, duplicates=duplicates, name="AsyncCollector")
+
+        # rates are for the whole process, i.e. for all keys
+        n_keys = len(key_pool.keys)
+        self.controller = AimdController(initial_rate=config.AIMD_INITIAL_RATE * n_keys,
+                                         min_rate=config.AIMD_MIN_RATE,
+                                         max_rate=config.AIMD_MAX_RATE * n_keys,
+                                         initial_concurrency=min(max_in_flight, 2 * n_keys),
+                                         max_concurrency=max_in_flight)
+
+    def print_info(self):
+
+        elapsed_min = (time.time() - self.__started) / 60
+        avg_request_ms = int(self.stats.avg_request_time * 1000)
+        errors_cnt = self.stats.critical_errors + self.stats.request_errors
+        avg_pois = self.stats.pois / self.stats.tasks
+        active_keys = self.key_pool.active_count()
+
+        self.print(f"{self.name}: {self.stats.tasks} tasks | {self.stats.requests} requests | "
+                   f"{self.stats.pois} POIs | {avg_pois:.1f} POIs per task avg | "
+                   f"{errors_cnt} errors | {self.stats.retries} retries | {self.stats.hedges} hedges | "
+                   f"{self.stats.cache_hits} cache hits, {self.stats.cache_misses} misses | "
+                   f"{self.stats.covered} covered tasks skipped | {self.stats.pruned} outside AOI | "
+                   f"{self.stats.duplicates} duplicates | "
+                   f"{self.stats.requests / elapsed_min:.1f} req per min "
+                   f"(target {self.controller.rate * 60:.1f}) | {avg_request_ms} ms per request | "
+                   f"{self.in_flight} in flight (target {self.controller.concurrency}) | {active_keys} keys active")
+
+    def _prepare(self):
+
+        self.densifier = make_densifier()
+        self.transport = make_transport(pool_size=self.max_in_flight, limiter=self.limiter,
+                                        on_extra_request=self._on_extra_request)
+        self.__disk_io.submit(self._open_cache).result()
+
+        self.print(f'{self.name} ready. {self.key_pool.active_count()} out of {len(self.key_pool.keys)} API keys '
+                   f'can be used, up to {self.max_in_flight} requests in flight')
+
+    def _on_extra_request(self, key: str, kind: str):
+
+        """ Called from transport threads, stats are only changed in the event loop. """
+
+        self.__loop.call_soon_threadsafe(super()._on_extra_request, key, kind)
+
+    def _reschedule(self, task: TaskDefinition):
+
+        """ Puts the task back in queue, it will start over from the first page. """
+
+        task.page_token, task.got_before = None, 0
+        if task.tries < config.MAX_TRIES_WITH_TASK:
+            self.tasks_q.put(task)
+
+    async def _places_nearby(self, key: str, task: TaskDefinition, page_token: str = None) -> dict:
+
+        if not page_token:
+            call = functools.partial(self.transport.places_nearby,
+                                     key=key,
+                                     location=(task.lat, task.lon),
+                                     radius=task.radius,
+                                     place_type=task.place_type,
+                                     rank_by=self.rank_by)
+        else:
+            call = functools.partial(self.transport.places_nearby, key=key, page_token=page_token)
+
+        return await asyncio.get_event_loop().run_in_executor(self.__executor, call)
+
+    async def _in_disk_io(self, func, **kwargs):
+
+        """ Cache and tracker calls may block for a while (busy sqlite, eviction, file lock), not in the event loop. """
+
+        return await asyncio.get_event_loop().run_in_executor(self.__disk_io, functools.partial(func, **kwargs))
+
+    async def search_task(self, task: TaskDefinition) -> bool:
+
+        """
+        Requests all result pages of a task, POIs of each page are sent to the writers right away,
+        those of the last one together with the completed task. Returns False if the task was put
+        back in queue instead.
+        """
+
+        # restored tasks may continue from the last recorded page
+        page_token = task.page_token
+        got_for_the_task = task.got_before
+        if not page_token:
+            task.tries += 1
+
+        key = None
+        page: List[PoiData] = []
+
+        while True:
+
+            cached = await self._in_disk_io(self._from_cache, task=task, page_token=page_token)
+            if cached is None and self.cache is not None and self.cache.offline:
+                self.submit_complete(task=task)
+                return True     # replaying offline, nothing is known about the rest of the task
+
+            if cached is None and page_token and key is None and page_token != task.page_token:
+                # token came from the cache, but its page did not
+                await self._in_disk_io(self._drop_cached_chain, task=task)
+                self._reschedule(task)
+                return False
+
+            if cached is not None:
+                # no key and no quota spent, the next page is looked up in the cache too
+                try:
+                    page: List[PoiData] = PoiData.from_response(resp=cached)
+                except ZeroResultsException:
+                    self.stats.zero_results += 1
+                    page = []
+                    break
+                resp, key = cached, None
+
+            else:
+                if page_token and key and not self.key_pool.is_active(key):
+                    # key that issued the token was rotated away, start over from the first page
+                    self._reschedule(task)
+                    return False
+
+                await asyncio.sleep(self.controller.reserve())     # adaptive rate
+                key = self.key_pool.lease(preferred=key)    # next pages are requested with the same key
+                await self.limiter.acquire_async(key)
+                _started = time.time()
+                self.stats.requests += 1
+                failed = False
+
+                try:
+                    resp = await self._places_nearby(key=key, task=task, page_token=page_token)
+
+                    _elapsed = time.time() - _started
+                    self.stats.avg_request_time = \
+                        (_elapsed + self.stats.avg_request_time * self.stats.requests) / (self.stats.requests + 1)
+                    self.stats.total_request_time += _elapsed
+
+                    await self._in_disk_io(self._to_cache, task=task, resp=resp, page_token=page_token)
+                    page: List[PoiData] = PoiData.from_response(resp=resp)
+
+                except ZeroResultsException:
+                    self.stats.zero_results += 1
+                    page = []
+                    break
+
+                except (WastedQuotaException, RequestDeniedException) as e:
+                    failed = True
+                    self.write_traceback(e)
+                    if isinstance(e, WastedQuotaException):
+                        self.controller.backoff()
+                        self.key_pool.mark_exhausted(key)
+                    else:
+                        self.key_pool.mark_denied(key)
+                    self.print(f'{self.name}: API key {key} will not be used anymore ({type(e).__name__})')
+                    self._reschedule(task)
+                    return False
+
+                except InvalidRequestException as e:
+                    failed = True
+                    if page_token and page_token == task.page_token:
+                        # token restored from previous session expired, start over from the first page
+                        self._reschedule(task)
+                        return False
+
+                    self.write_traceback(e)
+                    self.stats.critical_errors += 1
+                    self.print(
+                        f"ERROR: {type(e).__name__} in {self.name}. API key: {key}\n"
+                        f"Params: location = {(task.lat, task.lon)}, radius={task.radius}, "
+                        f"type={task.place_type}, page_token={page_token}, got_before = {got_for_the_task} "
+                    )
+                    self.submit_complete(task=task)
+                    return True
+
+                except TransportError as e:
+                    failed = True
+                    self.write_traceback(e)
+                    if RetryPolicy.is_transient(e):
+                        # retries ran out or UNKNOWN_ERROR, the task will be tried again later
+                        self.controller.backoff()
+                        self.stats.request_errors += 1
+                        self._reschedule(task)
+                        return False
+
+                    self.stats.critical_errors += 1
+                    self.print(
+                        f"ERROR: {type(e).__name__} in {self.name}. API key: {key}\n"
+                        f"Params: location = {(task.lat, task.lon)}, radius={task.radius}, "
+                        f"type={task.place_type}, page_token={page_token}, got_before = {got_for_the_task} "
+                    )
+                    self.submit_complete(task=task)
+                    return True
+
+                finally:
+                    self.key_pool.release(key, latency=time.time() - _started, error=failed)
+                    self.controller.update(self.stats)
+
+            got_for_the_task += len(page)
+            self.stats.pois += len(page)
+
+            page_token = resp.get("next_page_token")
+            if page_token is None:
+                break   # the last page goes with the completed task
+
+            self.submit_page(pois=page, ack=PageContinuation(task=task, page_token=page_token,
+                                                             got_before=got_for_the_task, key=key))
+
+            # next page token is not valid right away, other requests go on meanwhile
+            if key is not None:
+                await asyncio.sleep(config.NEXT_PAGE_DELAY)
+
+        self.complete_search(task=task, got=got_for_the_task, last_page=page)
+        self.submit_page(pois=page, ack=task)
+        return True
+
+    async def _do_task(self, task: TaskDefinition, in_flight: asyncio.Semaphore):
+
+        try:
+            if await self.search_task(task=task):
+                self.stats.tasks += 1
+
+                if self.stats.tasks % self.__info_each == 0:
+                    self.print_info()
+
+        except NoKeysLeftException:
+            self.tasks_q.put(task)      # recorded as a job, the writer keeps it for RESUME if nobody completes it
+
+        except Exception as e:
+            self.write_traceback(e)
+            self.stats.critical_errors += 1
+            self._reschedule(task)      # tries are limited, a task failing this way is not retried forever
+
+        finally:
+            in_flight.release()
+            async with self.__slot_freed:
+                self.in_flight -= 1
+                self.__slot_freed.notify()
+
+    async def _get_task(self) -> TaskDefinition:
+
+        """ Will wait for 1 sec and throw Empty exception if nothing found. """
+
+        get = functools.partial(self.tasks_q.get, timeout=1)
+        return await asyncio.get_event_loop().run_in_executor(self.__queue_reader, get)
+
+    async def _main(self):
+
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.__slot_freed = asyncio.Condition()
+        pending = set()
+        last_task = time.time()   # time waiting for a new task, will exit if waiting for too long
+
+        while not self.finished:
+
+            if self.stats.critical_errors > self.critical_errors_threshold:
+                raise Exception(
+                    f"Too many critical errors encountered ({self.stats.critical_errors}). Terminating..."
+                )
+
+            if self.key_pool.active_count() == 0:
+                self.print(f"{self.name}: no usable API keys left")
+                break
+
+            # adaptive concurrency below the hard in-flight limit
+            async with self.__slot_freed:
+                await self.__slot_freed.wait_for(lambda: self.in_flight < self.controller.concurrency)
+
+            await in_flight.acquire()
+            try:
+                task = await self._get_task()
+            except Empty:
+                in_flight.release()
+
+                # running tasks may still produce new ones via recursion
+                if pending:
+                    last_task = time.time()
+                elif time.time() - last_task >= config.MAX_WAITING_UNINTERRUPTED:
+                    break
+                continue
+
+            if not isinstance(task, TaskDefinition):
+                in_flight.release()
+                self.print(f"{self.name}: received poison pill")
+                self.finished = True
+                break
+
+            elif task.tries >= config.MAX_TRIES_WITH_TASK or self.skip_if_covered(task=task):
+                in_flight.release()     # discard or already covered
+                continue
+
+            last_task = time.time()
+            self.in_flight += 1
+            job = asyncio.ensure_future(self._do_task(task=task, in_flight=in_flight))
+            pending.add(job)
+            job.add_done_callback(pending.discard)
+
+            if self.stats.requests % 4 == 0:    # update tracker every N
+                await self._in_disk_io(self._update_tracker)
+
+        if pending:
+            await asyncio.gather(*pending)
+
+    def run(self):
+
+        self.print(f"{self.name} started")
+        self.__executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        self.__queue_reader = ThreadPoolExecutor(max_workers=1)
+        self.__disk_io = ThreadPoolExecutor(max_workers=1)
+
+        self._prepare()
+        self.__started = time.time()
+
+        loop = self.__loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._main())
+        finally:
+            loop.close()
+            self.__executor.shutdown(wait=False)
+            self.__queue_reader.shutdown(wait=False)
+            self.transport.close()
+            if self.cache is not None:
+                self.__disk_io.submit(self.cache.close).result()
+            self.__disk_io.shutdown(wait=True)
+
+            # before process can be joined
+            self.finished = True
+            self._update_tracker()
+
+        # join process in main
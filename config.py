@@ -9,7 +9,12 @@ VALID_TYPES_FILE = "valid_types.txt"
 POI_TABLE = "poi"      # valid sqlite table name, will be placed in public schema by default
 JOBS_TABLE = "jobs"
 SUCCESS_TABLE = "success"
-COMMIT_EACH = 12    # will commit each N new inserts (single insert batch size can be adjusted in db.writer)
+PROGRESS_TABLE = "progress"     # page token checkpoints of partially paged tasks
+# the database writer commits all waiting rows in one transaction as soon as its queue runs dry, under constant
+# load once there are this many or the oldest is this old. The database is in WAL mode, it can be read meanwhile
+WRITER_FLUSH_ROWS = 2000
+WRITER_FLUSH_INTERVAL = 1.0     # seconds
+DB_SYNCHRONOUS = "NORMAL"   # "FULL" also survives power loss, "NORMAL" may lose the last commits then, "OFF" fastest
 
 RESUME = False      # if True, will pick up where it stopped in the last session
 
@@ -20,14 +25,84 @@ RESPONSE_JSON_EXTENSION = ".json"
 AOI_LAYER_URI = "D:/gis_works2/buildingsOSM.gpkg|layername=border_wgs84"        # simply put, city boundaries
 
 MAX_TRIES_WITH_TASK = 3
-MAX_REQUESTS_PER_MIN = 20
+MAX_REQUESTS_PER_MIN = 20      # per API key
+MAX_REQUESTS_PER_KEY = 0       # overall budget per API key as counted in tracker.json, 0 - unlimited
+KEY_BURST = 3                  # requests a key may make back to back after being idle
+GLOBAL_MAX_REQUESTS_PER_SEC = 10    # all keys and workers together, 0 disables the global cap
+GLOBAL_BURST = 10
+
+# adaptive rate control below the hard caps above, see adaptive.py
+AIMD_INITIAL_RATE = MAX_REQUESTS_PER_MIN / 60   # requests per second per collector process (per key for asyncio)
+AIMD_MIN_RATE = 0.05
+AIMD_MAX_RATE = 5
+AIMD_INCREASE = 0.05        # requests per second added after each healthy window
+AIMD_DECREASE = 0.5         # rate and concurrency multiplier on backoff
+AIMD_WINDOW = 10            # seconds
+AIMD_COOLDOWN = 2           # seconds | min time between two decreases
+AIMD_LATENCY_TARGET = 2.0   # seconds | average request time above that is unhealthy
+AIMD_MAX_ERROR_RATE = 0.05  # share of failed requests above that is unhealthy
+# "densify" - grid of INITIAL_RADIUS seeds, a saturated search is split into 6 ring searches and a central one,
+# "quadtree" - a few QUADTREE_ROOT_RADIUS square cells over the AOI, saturated cells are split into 4 quadrants,
+# so sparse areas cost few requests,
+# "frontier" - searches ranked by distance from FRONTIER_SEED_RADIUS seeds, each one covers up to its farthest
+# result and new probes are only placed around it where nothing was searched yet, needs COVERAGE_INDEX
+CRAWL_STRATEGY = "densify"
+QUADTREE_ROOT_RADIUS = 20000   # meters, Nearby Search accepts up to 50000
+FRONTIER_SEED_RADIUS = 5000    # meters, spacing of frontier seeds as for circles of this radius
+FRONTIER_MAX_REACH = 50000     # meters, covered by a distance ranked search with less than 60 results
 INITIAL_RADIUS = 650
+GRID_LATTICE = "square"    # initial seeds: "square" - spacing radius * sqrt(2), "hex" - spacing radius * sqrt(3),
+                           # covers the AOI with ~23% fewer seeds and less overlap
+GRID_PROCESSES = 1         # >1 splits initial grid selection between processes, worth it for country-sized AOIs
 MIN_ALLOWED_RADIUS = 6     # meters    |   avoid infinite search point recursion!
+CLIP_TO_AOI = True         # drop child tasks whose circle misses the AOI, always on for quadtree and frontier
+
+# optional density prior: points or polygons in WGS 84, e.g. OSM buildings or the POI table of an earlier session.
+# seeds start at DENSITY_MAX_RADIUS and are split where more than DENSITY_TARGET results are expected
+DENSITY_LAYER_URI = None
+DENSITY_PRIOR_SCALE = 0.05     # expected search results per feature of the density layer
+DENSITY_TARGET = 40            # expected results per seed search, below the 60 that need recursion
+DENSITY_MAX_RADIUS = 5000      # meters
+DENSITY_MIN_RADIUS = 150       # meters
+
+COVERAGE_INDEX = True      # skip tasks inside circles of completed searches that returned less than 60 places
+COVERAGE_CAPACITY = 500000     # circles kept in shared memory, ~28 bytes each
+DEDUP_INDEX = True         # drop child tasks nearly identical to one queued before, e.g. by an adjacent parent
+DEDUP_TOLERANCE = 0.05     # share of the radius, centres and radii closer than that (up to twice) are the same
+DEDUP_CAPACITY = 2 ** 21   # hash table slots in shared memory, 8 bytes each, 70% can be used
 
 METRIC_CRS_EPSG = 32635     # utm 34N
+GEOMETRY_BACKEND = "auto"   # collectors' densification: "numpy", "pyproj", "qgis" or "auto" - pyproj if installed,
+                            # else numpy | QGIS is only loaded by main to read the AOI and make the initial grid
 DEFAULT_ENCODING = "utf-8"
 LANGUAGE = 'ru'
 
+COLLECTOR_ENGINE = "processes"     # "processes" - GoogleWorker processes, "asyncio" - single process, many requests in flight
+N_WORKERS = 0                      # processes engine only | number of GoogleWorker processes, 0 - one per API key
+ASYNC_MAX_IN_FLIGHT = 200          # asyncio engine only | max number of concurrent Nearby Search requests
+NEXT_PAGE_DELAY = 2.0              # seconds | next_page_token only becomes valid after a short delay
+
+TRANSPORT = "session"      # "session" - pooled keep-alive HTTP with fast JSON decoding, "googlemaps" - googlemaps.Client
+PLACES_NEARBY_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+CONNECT_TIMEOUT = 3.05     # seconds
+READ_TIMEOUT = 5           # seconds
+HTTP_POOL_SIZE = 10        # keep-alive connections per collector process (asyncio engine uses ASYNC_MAX_IN_FLIGHT)
+
+# transient failures (timeouts, connection resets, 5xx) are retried by the transport, see retry.py
+RETRY_MAX_ATTEMPTS = 3     # attempts per request including the first one, 1 disables retries
+RETRY_BASE_DELAY = 0.5     # seconds | backoff before the 2nd attempt, doubles each time, fully jittered
+RETRY_MAX_DELAY = 8        # seconds
+HEDGE_PERCENTILE = 0       # a duplicate request is sent when the first is slower than this percentile
+                           # of recent latencies, e.g. 95 | each hedge is a billed request, 0 disables
+HEDGE_MIN_SAMPLES = 50     # latencies needed before hedging starts
+
+# on-disk cache of Nearby Search responses, see db/cache.py
+CACHE_MODE = "off"         # "on" - reuse cached responses, request and cache the rest,
+                           # "only" - replay cached responses offline, nothing is requested from the API
+CACHE_DATABASE = "cache.sqlite3"
+CACHE_TTL_DAYS = 30        # 0 - responses never expire
+CACHE_MAX_SIZE_MB = 1024   # least recently used responses are evicted above that, 0 - unlimited
+
 MAX_WAITING_UNINTERRUPTED = 60  # seconds   |   max time a thread can wait for new tasks, will exit when reached
 
 DEBUG = False    # will suppress some messages when disabled
@@ -0,0 +1,146 @@
+import math
+import multiprocessing as mp
+from typing import Dict, List, Tuple
+
+import config
+from geometries.local import distance, offset, degrees_of_latitude
+from tasks import TaskDefinition
+
+SATURATED = 60      # results of a search that may have missed some places
+
+# a disc is checked at hex lattice points spaced so that every point of it is within
+# MARGIN * radius of a sample, samples must then be MARGIN * radius inside a covering circle
+MARGIN = 1 / 6
+
+
+def _unit_samples() -> List[Tuple[float, float]]:
+
+    """ Hex lattice points within 1 + MARGIN of the origin, covering radius of the lattice is MARGIN. """
+
+    spacing = MARGIN * math.sqrt(3)
+    n = int((1 + MARGIN) / spacing) + 2
+    samples = []
+    for row in range(-n, n + 1):
+        y = row * spacing * math.sqrt(3) / 2
+        for col in range(-n, n + 1):
+            x = (col + (row % 2) / 2) * spacing
+            if math.hypot(x, y) <= 1 + MARGIN:
+                samples.append((x, y))
+    return samples
+
+
+UNIT_SAMPLES = _unit_samples()
+
+
+class CoverageIndex(object):
+
+    """
+    Circles of completed searches that returned fewer than 60 results, so everything of the type inside
+    them was found. A task whose circle is fully inside their union needs no request. Circles live in
+    shared memory like the key pool and are appended by any collector; each process keeps its own grid
+    buckets of them and syncs new circles on lookup. Full coverage is checked conservatively.
+    """
+
+    __cell: float = 0.01     # degrees, bucket size
+
+    def __init__(self, place_types: List[str], capacity: int = config.COVERAGE_CAPACITY):
+
+        assert capacity > 0, f"invalid coverage index capacity {capacity}"
+
+        self.place_types = sorted(set(place_types))
+        self.__type_index = {t: i for i, t in enumerate(self.place_types)}
+        self.capacity = capacity
+
+        # all arrays are guarded by the same lock
+        self.__lock = mp.Lock()
+        self.__size = mp.Value('l', 0, lock=False)
+        self.__types = mp.Array('i', capacity, lock=False)
+        self.__lons = mp.Array('d', capacity, lock=False)
+        self.__lats = mp.Array('d', capacity, lock=False)
+        self.__radii = mp.Array('d', capacity, lock=False)
+
+        self.skipped = mp.Value('l', 0)     # tasks not requested as covered
+
+        # per process, filled by __sync()
+        self.__synced = 0
+        self.__buckets: Dict[Tuple[int, int, int], List[Tuple[float, float, float]]] = {}
+
+    def __cells(self, lon: float, lat: float, radius: float) -> List[Tuple[int, int]]:
+
+        d_lat = degrees_of_latitude(radius)
+        d_lon = d_lat / max(0.01, math.cos(math.radians(lat)))
+        lon0, lon1 = math.floor((lon - d_lon) / self.__cell), math.floor((lon + d_lon) / self.__cell)
+        lat0, lat1 = math.floor((lat - d_lat) / self.__cell), math.floor((lat + d_lat) / self.__cell)
+
+        return [(i, j) for i in range(lon0, lon1 + 1) for j in range(lat0, lat1 + 1)]
+
+    def __sync(self):
+
+        """ Buckets circles appended since the last sync, by any process. """
+
+        size = self.__size.value
+        if size == self.__synced:
+            return
+
+        with self.__lock:
+            new = [(self.__types[i], self.__lons[i], self.__lats[i], self.__radii[i])
+                   for i in range(self.__synced, size)]
+
+        for t, lon, lat, radius in new:
+            for i, j in self.__cells(lon, lat, radius):
+                self.__buckets.setdefault((t, i, j), []).append((lon, lat, radius))
+
+        self.__synced = size
+
+    def add(self, task: TaskDefinition):
+
+        """ Records the circle of a task completed with fewer than 60 results. Ignored once full. """
+
+        t = self.__type_index.get(task.place_type)
+        if t is None:
+            return
+
+        with self.__lock:
+            i = self.__size.value
+            if i >= self.capacity:
+                return
+            self.__types[i] = t
+            self.__lons[i] = task.lon
+            self.__lats[i] = task.lat
+            self.__radii[i] = task.radius
+            self.__size.value = i + 1
+
+    def is_covered(self, task: TaskDefinition) -> bool:
+
+        t = self.__type_index.get(task.place_type)
+        if t is None:
+            return False
+
+        self.__sync()
+
+        margin = task.radius * MARGIN
+        candidates = {c for i, j in self.__cells(task.lon, task.lat, task.radius)
+                      for c in self.__buckets.get((t, i, j), ())}
+        candidates = [c for c in candidates if c[2] > margin]
+        if not candidates:
+            return False
+
+        # inside a single circle
+        for lon, lat, radius in candidates:
+            if distance(task.lon, task.lat, lon, lat) + task.radius <= radius:
+                return True
+
+        # inside the union: every sample point well inside some circle
+        for x, y in UNIT_SAMPLES:
+            s_lon, s_lat = offset(task.lon, task.lat, x * task.radius, y * task.radius)
+            if not any(distance(s_lon, s_lat, lon, lat) <= radius - margin for lon, lat, radius in candidates):
+                return False
+
+        return True
+
+    def mark_skipped(self):
+        with self.skipped.get_lock():
+            self.skipped.value += 1
+
+    def __len__(self):
+        return self.__size.value
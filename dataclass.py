@@ -1,4 +1,5 @@
 # For better understanding, refer to expressions.py and see CREATE TABLE ... expression
+import json
 from typing import List
 
 from exceptions import *
@@ -8,6 +9,14 @@ NONE_TYPE = type(None)
 
 class PoiData(object):
 
+    """
+    Parsed result item. The item itself is kept as compact JSON bytes in raw, for the raw JSON writer only:
+    collectors hand it over separately and send the rest to the database writer, see submit_page().
+    """
+
+    __slots__ = ("place_id", "id", "lon", "lat", "name", "rating", "business_status", "scope",
+                 "user_ratings_total", "vicinity", "types", "price", "raw", "is_valid")
+
     place_id: str
     id: str
     lon: float
@@ -20,8 +29,9 @@ class PoiData(object):
     vicinity: str
     types: str
     price: int
+    raw: bytes
 
-    is_valid: bool = False
+    is_valid: bool
 
     # timestamp is redundant, will be set default by the DB
 
@@ -29,7 +39,7 @@ class PoiData(object):
                  place_id, id, lon, lat,
                  name, rating, business_status, scope,
                  user_ratings_total, vicinity, types, price,
-                 json: dict):
+                 raw: bytes = None):
 
         self.place_id = place_id
         self.id = id
@@ -43,12 +53,20 @@ class PoiData(object):
         self.vicinity = vicinity
         self.types = types
         self.price = price
-        self.json = json
+        self.raw = raw
 
+        self.is_valid = False
         self.validate()
 
         self.is_valid = True    # only set after validated
 
+    def __getstate__(self):
+        return tuple(getattr(self, s) for s in self.__slots__)     # values only, pickled for every queue put
+
+    def __setstate__(self, state):
+        for s, value in zip(self.__slots__, state):
+            setattr(self, s, value)
+
     def validate(self) -> None:
 
         """ Raises InvalidPoiDataError if validation fails"""
@@ -151,7 +169,7 @@ class PoiData(object):
             vicinity=vicinity,
             types=", ".join(types),
             price=price,
-            json=poi
+            raw=json.dumps(poi, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
         )
 
     @classmethod
@@ -176,7 +194,7 @@ class PoiData(object):
         elif status == 'INVALID_REQUEST':
             raise InvalidRequestException
         else:
-            raise Exception(f"unexpected response status {status}")
+            raise UnknownStatusException(f"unexpected response status {status}")
 
         try:
             results = resp["results"]
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+from typing import Optional, Tuple
+
+import config
+from db.expressions import CREATE_CACHE_RESPONSES_TABLE, CREATE_CACHE_TOKENS_TABLE, CREATE_CACHE_ACCESSED_INDEX, \
+    GET_CACHED_RESPONSE, GET_CACHED_TOKEN, TOUCH_CACHED_RESPONSE, PUT_CACHED_RESPONSE, PUT_CACHED_TOKEN, \
+    DELETE_CACHED_RESPONSE, DELETE_EXPIRED_RESPONSES, DELETE_EXPIRED_TOKENS, GET_CACHE_SIZE, DELETE_LEAST_RECENTLY_USED
+from jsonlib import json_loads
+
+CACHEABLE_STATUSES = ("OK", "ZERO_RESULTS")
+
+
+def cache_key(lat: float, lon: float, radius: float, place_type: str, language: str, page: int) -> str:
+
+    """ Same request, same key: coordinates are rounded to ~1 cm, radius to 1 cm. """
+
+    normalized = f"{lat:.7f},{lon:.7f}|{radius:.2f}|{place_type}|{language}|{page}"
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(object):
+
+    """
+    Nearby Search responses on disk, keyed by request parameters and page number. Pages after the first
+    are found through the next_page_token of the cached page before them, so replayed crawls follow
+    the same pages. Each process opens its own connection; the database runs in WAL mode so collectors
+    can read and write at once. Old entries expire after ttl, least recently used ones go when the
+    file grows past max_size.
+    """
+
+    __evict_each: int = 500     # puts
+
+    def __init__(self,
+                 db_file: str = config.CACHE_DATABASE,
+                 ttl: float = config.CACHE_TTL_DAYS * 86400,
+                 max_size: int = config.CACHE_MAX_SIZE_MB * 1024 * 1024,
+                 offline: bool = config.CACHE_MODE == "only",
+                 language: str = config.LANGUAGE):
+
+        self.db_file = db_file
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline      # cache-only replay, misses are never requested from the API
+        self.language = language
+
+        self.__conn: sqlite3.Connection = None    # connect in the process that uses the cache
+        self.__puts = 0
+
+    def connect(self):
+
+        self.__conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)     # autocommit
+        self.__conn.execute("PRAGMA journal_mode=WAL;")
+        self.__conn.execute("PRAGMA synchronous=NORMAL;")
+        self.__conn.execute(CREATE_CACHE_RESPONSES_TABLE)
+        self.__conn.execute(CREATE_CACHE_TOKENS_TABLE)
+        self.__conn.execute(CREATE_CACHE_ACCESSED_INDEX)
+
+    def close(self):
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
+
+    def __locate(self, lat: float, lon: float, radius: float, place_type: str, page_token: str = None) \
+            -> Tuple[Optional[str], int]:
+
+        """ Key and page number of a request. Pages reached by a token unknown to the cache have no key. """
+
+        if not page_token:
+            return cache_key(lat, lon, radius, place_type, self.language, 0), 0
+
+        row = self.__conn.execute(GET_CACHED_TOKEN, (page_token,)).fetchone()
+        return (row[0], row[1]) if row else (None, 0)
+
+    def get(self, lat: float, lon: float, radius: float, place_type: str, page_token: str = None) -> Optional[dict]:
+
+        """ Cached response JSON, or None. """
+
+        key, _ = self.__locate(lat, lon, radius, place_type, page_token)
+        if key is None:
+            return None
+
+        row = self.__conn.execute(GET_CACHED_RESPONSE, (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl > 0 and now - row[1] > self.ttl):
+            return None
+
+        self.__conn.execute(TOUCH_CACHED_RESPONSE, (now, key))
+        return json_loads(zlib.decompress(row[0]))
+
+    def put(self, lat: float, lon: float, radius: float, place_type: str, resp: dict, page_token: str = None):
+
+        """ Stores a successful response and remembers where its next_page_token leads. """
+
+        if resp.get("status") not in CACHEABLE_STATUSES:
+            return
+
+        key, page = self.__locate(lat, lon, radius, place_type, page_token)
+        if key is None:
+            return      # e.g. a token restored from a previous session, the page before it was not cached
+
+        body = zlib.compress(json.dumps(resp, ensure_ascii=False).encode(config.DEFAULT_ENCODING))
+        now = time.time()
+
+        self.__conn.execute(PUT_CACHED_RESPONSE, (key, page, body, len(body), now, now))
+
+        next_page_token = resp.get("next_page_token")
+        if next_page_token:
+            next_key = cache_key(lat, lon, radius, place_type, self.language, page + 1)
+            self.__conn.execute(PUT_CACHED_TOKEN, (next_page_token, next_key, page + 1, now))
+
+        self.__puts += 1
+        if self.__puts % self.__evict_each == 0:
+            self.evict()
+
+    def invalidate(self, lat: float, lon: float, radius: float, place_type: str):
+
+        """ Drops the cached first page of a request, so that it is requested live next time with all its pages. """
+
+        self.__conn.execute(DELETE_CACHED_RESPONSE, (cache_key(lat, lon, radius, place_type, self.language, 0), ))
+
+    def evict(self):
+
+        """ Drops expired entries, then least recently used ones until the cache is 10% below max_size. """
+
+        if self.ttl > 0:
+            expired_before = time.time() - self.ttl
+            self.__conn.execute(DELETE_EXPIRED_RESPONSES, (expired_before,))
+            self.__conn.execute(DELETE_EXPIRED_TOKENS, (expired_before,))
+
+        if self.max_size <= 0:
+            return
+
+        size, count = self.__conn.execute(GET_CACHE_SIZE).fetchone()
+        if size <= self.max_size:
+            return
+
+        while size > self.max_size * 0.9:
+            self.__conn.execute(DELETE_LEAST_RECENTLY_USED, (max(1, count // 50),))
+            size, count = self.__conn.execute(GET_CACHE_SIZE).fetchone()
+
+
+def make_cache() -> Optional[ResponseCache]:
+
+    """ Response cache selected in config, None if disabled. Connect in the process that will use it. """
+
+    if config.CACHE_MODE == "off":
+        return None
+    elif config.CACHE_MODE in ("on", "only"):
+        return ResponseCache()
+    else:
+        raise Exception(f"unknown cache mode \"{config.CACHE_MODE}\", see config to fix")
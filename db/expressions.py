@@ -1,4 +1,4 @@
-from config import POI_TABLE, JOBS_TABLE, SUCCESS_TABLE
+from config import POI_TABLE, JOBS_TABLE, SUCCESS_TABLE, PROGRESS_TABLE
 
 
 #   fields:
@@ -25,7 +25,7 @@ CREATE TABLE {POI_TABLE} (
 
 CREATE_JOBS_TABLE = f"""
 CREATE TABLE {JOBS_TABLE} (
-                    id TEXT PRIMARY KEY,        -- random token
+                    id TEXT PRIMARY KEY,        -- task id, see tasks.make_task_id
                     lon FLOAT,
                     lat FLOAT,
                     radius FLOAT,
@@ -35,7 +35,7 @@ CREATE TABLE {JOBS_TABLE} (
 
 CREATE_SUCCESS_TABLE = f"""
 CREATE TABLE {SUCCESS_TABLE} (
-                        id TEXT PRIMARY KEY,    -- random token
+                        id TEXT PRIMARY KEY,    -- task id
                         lon FLOAT,
                         lat FLOAT,
                         radius FLOAT,
@@ -43,9 +43,27 @@ CREATE TABLE {SUCCESS_TABLE} (
                     );
 """
 
+CREATE_PROGRESS_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+                        id TEXT PRIMARY KEY,    -- task id
+                        page_token TEXT,        -- token of the next page to request
+                        got_before INTEGER      -- POIs received for the task before that page
+                    );
+"""
+
 GET_UNFINISHED_FROM_PREVIOUS_SESSION = f"""
-SELECT id, lon, lat, radius, place_type 
-FROM {JOBS_TABLE} 
+SELECT j.id, j.lon, j.lat, j.radius, j.place_type, p.page_token, p.got_before
+FROM {JOBS_TABLE} j
+LEFT JOIN {PROGRESS_TABLE} p ON p.id = j.id
+WHERE j.id NOT IN (
+    SELECT id
+    FROM {SUCCESS_TABLE}
+);
+"""
+
+COUNT_UNFINISHED = f"""
+SELECT COUNT(*)
+FROM {JOBS_TABLE}
 WHERE id NOT IN (
     SELECT id
     FROM {SUCCESS_TABLE}
@@ -64,3 +82,76 @@ DROP TABLE IF EXISTS {JOBS_TABLE};
 DROP_SUCCESS = f"""
 DROP TABLE IF EXISTS {SUCCESS_TABLE};
 """
+
+DROP_PROGRESS = f"""
+DROP TABLE IF EXISTS {PROGRESS_TABLE};
+"""
+
+
+# response cache, see db/cache.py | separate database file shared by all collector processes
+
+CREATE_CACHE_RESPONSES_TABLE = """
+CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,   -- sha256 of normalized request parameters and page number
+                        page INTEGER,
+                        body BLOB,              -- zlib compressed response JSON
+                        size INTEGER,
+                        created REAL,           -- unix time
+                        accessed REAL
+                    );
+"""
+
+CREATE_CACHE_TOKENS_TABLE = """
+CREATE TABLE IF NOT EXISTS tokens (
+                        token TEXT PRIMARY KEY, -- next_page_token found in a cached response
+                        key TEXT,               -- key of the page it leads to
+                        page INTEGER,
+                        created REAL
+                    );
+"""
+
+CREATE_CACHE_ACCESSED_INDEX = """
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+GET_CACHED_RESPONSE = """
+SELECT body, created FROM responses WHERE key = ?;
+"""
+
+GET_CACHED_TOKEN = """
+SELECT key, page FROM tokens WHERE token = ?;
+"""
+
+TOUCH_CACHED_RESPONSE = """
+UPDATE responses SET accessed = ? WHERE key = ?;
+"""
+
+PUT_CACHED_RESPONSE = """
+INSERT OR REPLACE INTO responses (key, page, body, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?);
+"""
+
+PUT_CACHED_TOKEN = """
+INSERT OR REPLACE INTO tokens (token, key, page, created) VALUES (?, ?, ?, ?);
+"""
+
+DELETE_CACHED_RESPONSE = """
+DELETE FROM responses WHERE key = ?;
+"""
+
+DELETE_EXPIRED_RESPONSES = """
+DELETE FROM responses WHERE created < ?;
+"""
+
+DELETE_EXPIRED_TOKENS = """
+DELETE FROM tokens WHERE created < ?;
+"""
+
+GET_CACHE_SIZE = """
+SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses;
+"""
+
+DELETE_LEAST_RECENTLY_USED = """
+DELETE FROM responses WHERE key IN (
+    SELECT key FROM responses ORDER BY accessed LIMIT ?
+);
+"""
@@ -7,12 +7,14 @@ from typing import List, Set
 
 import config
 from dataclass import PoiData
-from db.expressions import CREATE_POI_TABLE, CREATE_SUCCESS_TABLE, CREATE_JOBS_TABLE, DROP_JOBS, DROP_SUCCESS
+from db.expressions import CREATE_POI_TABLE, CREATE_SUCCESS_TABLE, CREATE_JOBS_TABLE, DROP_JOBS, DROP_SUCCESS, \
+    DROP_PROGRESS, COUNT_UNFINISHED
 from exceptions import InvalidPoiDataError, FinishException
-from tasks import TaskDefinition
+from tasks import TaskDefinition, PageContinuation, PageBatch
 
 SUCCESS_COLUMN_NAMES = ["id", "lon", "lat", "radius", "place_type"]
 JOBS_COLUMN_NAMES = ["id", "lon", "lat", "radius", "place_type"]
+PROGRESS_COLUMN_NAMES = ["id", "page_token", "got_before"]
 
 POI_WRITEABLE_COLUMNS = ['place_id',
                          'id',
@@ -35,6 +37,8 @@ class WriterStatsClass(object):
     tasks: int
     inserts: int
     commits: int
+    rows: int               # written to any table
+    flush_time: float       # seconds spent writing and committing
 
     def __init__(self):
 
@@ -43,6 +47,8 @@ class WriterStatsClass(object):
         self.tasks = 0
         self.inserts = 0
         self.commits = 0
+        self.rows = 0
+        self.flush_time = 0
 
 
 class DatabaseWriter(mp.Process):
@@ -54,17 +60,17 @@ class DatabaseWriter(mp.Process):
     # __initial_jobs: List[TaskDefinition]
     __jobs_batch: List[TaskDefinition]
     __success_batch: List[TaskDefinition]
-    __success_ids: Set[str]      # will hold until the end of session
+    __progress_batch: List[PageContinuation]
     __place_ids: Set[str]       # will hold until the end of session - helps avoid repeating POIs
 
     finished: bool = None
     __printlock: mp.Lock
 
-    __write_each: int = 1     # only applies to POIs (PoiData class instances). using 1 will insert each row separately
-    __commit_each: int = config.COMMIT_EACH     # make commit each N inserts
+    __flush_rows: int = config.WRITER_FLUSH_ROWS     # rows waiting in all batches
+    __flush_interval: float = config.WRITER_FLUSH_INTERVAL
+    __info_each: int = 50     # commits
 
-
-    def __init__(self, db_file: str, poi_q: mp.Queue, tasks_q: mp.Queue, complete_tasks_q: mp.Queue, printlock: mp.Lock):
+    def __init__(self, db_file: str, poi_q: mp.Queue, printlock: mp.Lock):
 
         self.conn = None
         self.db_file = db_file
@@ -79,16 +85,16 @@ class DatabaseWriter(mp.Process):
         # self.make_db_connection()
         # self.cursor = self.conn.cursor()
 
-        self.poi_q = poi_q
-        self.pending_tasks_q = tasks_q
-        self.complete_tasks_q = complete_tasks_q
+        self.poi_q = poi_q      # PageBatch messages: POIs and the task or checkpoint they complete, new tasks
         self.__printlock = printlock
 
         self.__poi_batch = []
         self.__jobs_batch = []
         self.__success_batch = []
-        self.__success_ids = set()
+        self.__progress_batch = []
         self.__place_ids = set()
+        self.__statements = {}      # INSERT expressions, reused so that sqlite3 reuses the prepared statements
+        self.__last_flush = time.time()
 
         self.finished = False
         self.stats = WriterStatsClass()
@@ -101,23 +107,19 @@ class DatabaseWriter(mp.Process):
 
     def print_info(self):
 
-        percent_unique = self.stats.unique_pois - self.stats.total_pois * 100
+        percent_unique = self.stats.unique_pois / max(1, self.stats.total_pois) * 100
+        rows_per_second = self.stats.rows / max(1e-9, self.stats.flush_time)
         self.print(
             f"Total {self.stats.total_pois} places collected, "
             f"{self.stats.unique_pois} ({percent_unique:.1f}%) of them unique.\n"
-            f"{self.stats.tasks} tasks completed in this session"
+            f"{self.stats.tasks} tasks completed in this session\n"
+            f"{self.stats.rows} rows written in {self.stats.commits} commits, {rows_per_second:.0f} rows per second "
+            f"of writing"
         )
 
     def set_initial_jobs(self, jobs: List[TaskDefinition]):
         self.__jobs_batch.extend(jobs)
 
-    def set_success_ids(self, task_ids: List[str]):
-
-        """ When resuming, set success IDs to avoid writing duplicates. """
-
-        for i in task_ids:
-            self.__success_ids.add(i)
-
     def make_db_connection(self):
 
         """ Creates a database connection to a SQLite database. Raises error when fails to connect. """
@@ -130,8 +132,14 @@ class DatabaseWriter(mp.Process):
         else:
             self.print(f'INFO: file "{self.__db_basename}" does not exists, new database will be created')
 
+        assert config.DB_SYNCHRONOUS in ("OFF", "NORMAL", "FULL", "EXTRA"), \
+            f"invalid value {config.DB_SYNCHRONOUS} for synchronous pragma, see config to fix"
+
         try:
-            conn = sqlite3.connect(self.db_file)
+            # transactions are opened explicitly, one per flush
+            conn = sqlite3.connect(self.db_file, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")    # readers don't block the writer and vice versa
+            conn.execute(f"PRAGMA synchronous={config.DB_SYNCHRONOUS};")
             self.print(f"INFO: database connection established successfully!")
         except sqlite3.Error as e:
             self.print(f"CRITICAL: failed to establish database connecting to {self.db_file}")
@@ -141,11 +149,17 @@ class DatabaseWriter(mp.Process):
         finally:
             self.conn = conn
 
-    def __insert_rows(self, table: str,  rows: List[tuple], column_names: List[str]):
+    def __insert_rows(self, table: str,  rows: List[tuple], column_names: List[str], on_conflict: str = None):
 
-        question_marks = ",".join("?" * len(column_names))
-        columns = ",".join(column_names)
-        sql = f"""INSERT INTO {table}({columns}) VALUES ({question_marks});"""
+        """ on_conflict: "REPLACE" keeps the new row, "IGNORE" the recorded one, e.g. for tasks recorded twice. """
+
+        sql = self.__statements.get((table, on_conflict))
+        if sql is None:
+            question_marks = ",".join("?" * len(column_names))
+            columns = ",".join(column_names)
+            verb = f"INSERT OR {on_conflict}" if on_conflict else "INSERT"
+            sql = f"""{verb} INTO {table}({columns}) VALUES ({question_marks});"""
+            self.__statements[(table, on_conflict)] = sql
 
         # TODO remove debug
         if config.DEBUG:
@@ -156,15 +170,50 @@ class DatabaseWriter(mp.Process):
         self.cursor.executemany(sql, rows)
 
         self.stats.inserts += 1     # keep track of inserts here, regardless of target table
+        self.stats.rows += len(rows)
 
-        if config.DEBUG:
-            self.conn.commit()  # commit every insert when debugging
+    def __pending_rows(self) -> int:
+        return len(self.__poi_batch) + len(self.__jobs_batch) + len(self.__success_batch) + \
+            len(self.__progress_batch)
+
+    def flush(self):
+
+        """
+        Writes all batches in a single transaction, readers see all of them or none. POIs go before the
+        tasks they complete.
+        """
+
+        self.__last_flush = time.time()
+        if not self.__pending_rows():
+            return
+
+        self.cursor.execute("BEGIN;")
+
+        if self.__jobs_batch:
+            self.__write_jobs_batch()
+
+        if self.__poi_batch:
+            self.__write_poi_batch()
+
+        if self.__success_batch:
+            self.__write_success_batch()
 
-        # number of inserts is non-zero at this point in any case
-        elif self.stats.inserts % self.__commit_each == 0:
-            self.conn.commit()
-            self.stats.commits += 1
-            self.print(f"{self.name}: database commit ({self.stats.commits} total)")
+        if self.__progress_batch:
+            self.__write_progress_batch()
+
+        self.cursor.execute("COMMIT;")
+
+        self.stats.commits += 1
+        self.stats.flush_time += time.time() - self.__last_flush
+        if config.DEBUG or self.stats.commits % self.__info_each == 0:
+            self.print(f"{self.name}: database commit ({self.stats.commits} total, {self.stats.rows} rows)")
+
+    def __flush_if_due(self):
+
+        """ Flushes once enough rows are waiting or the oldest of them waited long enough. """
+
+        if self.__pending_rows() >= self.__flush_rows or time.time() - self.__last_flush >= self.__flush_interval:
+            self.flush()
 
     def __write_poi_batch(self):
 
@@ -201,7 +250,9 @@ class DatabaseWriter(mp.Process):
             self.stats.tasks += len(rows)  # include number of poi in stats
 
             # column_names = ["id", "lon", "lat", "radius", "place_type"]
-            self.__insert_rows(table=config.JOBS_TABLE, rows=rows, column_names=JOBS_COLUMN_NAMES)
+            # task IDs are deterministic, restored and repeated tasks are recorded already
+            self.__insert_rows(table=config.JOBS_TABLE, rows=rows, column_names=JOBS_COLUMN_NAMES,
+                               on_conflict="IGNORE")
 
             self.__jobs_batch = []      # clean the batch
             if config.DEBUG:
@@ -218,7 +269,9 @@ class DatabaseWriter(mp.Process):
                 (task.task_id, task.lon, task.lat, task.radius, task.place_type) for task in self.__success_batch
             ]
 
-            self.__insert_rows(table=config.SUCCESS_TABLE, rows=rows, column_names=SUCCESS_COLUMN_NAMES)
+            # tasks may be acknowledged twice, e.g. replayed or retried after the first ack
+            self.__insert_rows(table=config.SUCCESS_TABLE, rows=rows, column_names=SUCCESS_COLUMN_NAMES,
+                               on_conflict="IGNORE")
 
             self.__success_batch = []
             if config.DEBUG:
@@ -227,6 +280,25 @@ class DatabaseWriter(mp.Process):
         else:
             self.print(f"ERROR: success batch is empty at the moment, cannot write any data!")
 
+    def __write_progress_batch(self):
+
+        if self.__progress_batch:
+
+            rows = [
+                (c.task.task_id, c.page_token, c.got_before) for c in self.__progress_batch
+            ]
+
+            # only the last checkpoint of a task is kept
+            self.__insert_rows(table=config.PROGRESS_TABLE, rows=rows, column_names=PROGRESS_COLUMN_NAMES,
+                               on_conflict="REPLACE")
+
+            self.__progress_batch = []
+            if config.DEBUG:
+                self.print(f"{self.name}: recorded page progress for {len(rows)} tasks")
+
+        else:
+            self.print(f"ERROR: progress batch is empty at the moment, cannot write any data!")
+
     def __include_single_poi_data(self, data: PoiData):
 
         """ Make sure that place ID is not duplicate, before calling the function. """
@@ -237,24 +309,15 @@ class DatabaseWriter(mp.Process):
         self.__place_ids.add(data.place_id)     # avoid writing duplicates
         self.__poi_batch.append(data)
 
-        if len(self.__poi_batch) >= self.__write_each:
-            self.__write_poi_batch()
-
     def __include_successful_task(self, task: TaskDefinition):
-
-        self.__success_ids.add(task.task_id)
         self.__success_batch.append(task)
 
-        if len(self.__success_batch) >= self.__write_each:
-            self.__write_success_batch()
+    def __include_page_progress(self, continuation: PageContinuation):
+        self.__progress_batch.append(continuation)
 
     def __include_pending_task(self, task: TaskDefinition):
-
         self.__jobs_batch.append(task)
 
-        if len(self.__jobs_batch) >= self.__write_each:
-            self.__write_jobs_batch()
-
     def set_place_ids(self, place_ids: List[str]):
 
         for i in place_ids:
@@ -263,146 +326,86 @@ class DatabaseWriter(mp.Process):
 
     def cleanup_database(self):
 
+        """ Drops task tables once every task is done, while some are not they are kept for RESUME. """
+
+        unfinished = self.cursor.execute(COUNT_UNFINISHED).fetchone()[0]
+        if unfinished:
+            self.print(f"{self.name}: {unfinished} tasks left unfinished (e.g. no usable API keys left), "
+                       f"task tables are kept. Set RESUME = True in config to continue them")
+            return
+
         self.cursor.execute(DROP_JOBS)
         self.cursor.execute(DROP_SUCCESS)
+        self.cursor.execute(DROP_PROGRESS)
 
         self.conn.commit()
 
-    def _get_poi_and_process(self):
+    def _get_and_process(self, timeout: float):
 
-        try:
-            poi: PoiData = self.poi_q.get(timeout=0.1)
-        except Empty as e:
-            # time.sleep(0.75)   # wait for new stuff in queue (THIS queue, it is much busier)  || NOT NEEDED, wait in loop
-            raise e     # will be caught in loop in run() method
+        """ Blocks until the next message, raises Empty if nothing came within the timeout. """
 
-        if not isinstance(poi, PoiData):
+        batch: PageBatch = self.poi_q.get(timeout=timeout)
+
+        if not isinstance(batch, PageBatch):
             self.print(f"{self.name}: received poison pill via POI channel")
             self.finished = True
             raise FinishException('can finish')
 
-        self.stats.total_pois += 1      # count all including duplicates
-        if poi.place_id not in self.__place_ids:
-            self.__include_single_poi_data(data=poi)
-
-    def _get_complete_task_and_process(self):
+        # repeated ones are ignored on insert
+        for task in batch.jobs:
+            self.__include_pending_task(task=task)
 
-        try:
-            task: TaskDefinition = self.complete_tasks_q.get(timeout=0.1)
-        except Empty:
-            return   # don't do anything, this queue is not that busy
-
-        if config.DEBUG:
-            self.print(f"{self.name}: found completed task")
+        self.stats.total_pois += len(batch.pois)      # count all including duplicates
+        for poi in batch.pois:
+            if poi.place_id not in self.__place_ids:
+                self.__include_single_poi_data(data=poi)
 
-        if not isinstance(task, TaskDefinition):
-            self.print(f"{self.name}: received poison pill via complete tasks channel")
-            self.finished = True
-            raise FinishException('can finish')
+        # written in the same transaction as the POIs, after them
+        if isinstance(batch.ack, PageContinuation):
+            self.__include_page_progress(continuation=batch.ack)    # a page of a task is done
 
-        if task.task_id not in self.__success_ids:
-            self.__include_successful_task(task=task)
+        elif isinstance(batch.ack, TaskDefinition):
+            self.__include_successful_task(task=batch.ack)
             if config.DEBUG:
-                self.print(f"{self.name}: new complete task, including into the database")
-
-    def _get_pending_task_and_process(self):
-
-        try:
-            task: TaskDefinition = self.pending_tasks_q.get(timeout=0.1)
-        except Empty:
-            return   # don't do anything, this queue is not that busy
-
-        if config.DEBUG:
-            self.print(f"{self.name}: found pending task")
-
-        if not isinstance(task, TaskDefinition):
-            self.print(f"{self.name}: received poison pill via pending tasks channel")
-            self.finished = True
-            raise FinishException('can finish')
-
-        # all of these will be unique
-        self.__include_pending_task(task=task)
-        if config.DEBUG:
-            self.print(f"{self.name}: pending task inlcuded into the database")
-
+                self.print(f"{self.name}: complete task, including into the database")
 
     def run(self) -> None:
 
-        """ Main loop in thread. """
+        """ Main loop in thread. Waits on the queue, nothing is polled. """
 
         # initialize connection in a separate thread
         self.make_db_connection()
         self.cursor = self.conn.cursor()
-        self.__write_jobs_batch()
-        self.conn.commit()      # commit initial jobs
+        self.flush()      # commit initial jobs
         self.print(f"{self.name}: initial jobs written")
 
-        last_task = time.time()
-
         while not self.finished:
 
-            """     NOTE: the following order of calls guarantees 
-                    that all POIs will be recorded before acknowledging task success.       """
-
-            # check for scheduled tasks. if there are any, process them until there are none and move on
-            while not self.pending_tasks_q.empty():
-                try:
-                    self._get_pending_task_and_process()
-                    last_task = time.time()
+            """     NOTE: POIs of a page and the task or checkpoint they complete arrive in one message,
+                    so all POIs are recorded before acknowledging task success.       """
 
-                except Empty:
-                    break
+            try:
+                # collectors may be idle for long, e.g. waiting for keys, main sends a poison pill when done
+                self._get_and_process(timeout=config.MAX_WAITING_UNINTERRUPTED)
 
-                except FinishException:
-                    self.finished = True
-                    break
+            except Empty:
+                continue
 
-            # then, check for POIs - and wait if nothing found.
-            # do not write successful tasks before writing collected POIs!
-            # this
-            while not self.poi_q.empty():
-                try:
-                    self._get_poi_and_process()
-                    last_task = time.time()
-
-                except Empty:
-                    break
+            except FinishException:
+                self.finished = True
+                break
 
-                except FinishException:
-                    self.finished = True
-                    break
+            # messages that came meanwhile go in the same transaction, committed once the queue runs dry,
+            # so rows are written right away when collectors are slow and in large batches when they are fast
+            if self.poi_q.empty():
+                self.flush()
             else:
-                time.sleep(1.0)   # wait for the queue to fill
-
-            #  check for complete tasks. will only appear after any POIs have been collected
-            while not self.complete_tasks_q.empty():
-                try:
-                    self._get_complete_task_and_process()
-                    last_task = time.time()
-
-                except Empty:
-                    break
-
-                except FinishException:
-                    self.finished = True
-                    break
-
-            # exit if waiting for new task for too long
-            waiting_uninterrupted = time.time() - last_task
-            if waiting_uninterrupted >= config.MAX_WAITING_UNINTERRUPTED:
-                break
+                self.__flush_if_due()
 
         self.print(f"{self.name} ready to finish...")
 
         # make sure everything is recorded when quitting
-        if self.__poi_batch:
-            self.__write_poi_batch()
-
-        if self.__jobs_batch:
-            self.__write_jobs_batch()
-
-        if self.__success_batch:
-            self.__write_success_batch()
+        self.flush()
 
         # when done
         self.cleanup_database()
@@ -0,0 +1,98 @@
+import math
+import multiprocessing as mp
+from typing import List
+
+import config
+from geometries.local import degrees_of_latitude
+from tasks import TaskDefinition
+
+EMPTY = 0           # free slot of the hash table
+MAX_LOAD = 0.7      # share of slots used, no more tasks are registered beyond it
+
+
+class DuplicateIndex(object):
+
+    """
+    Spatial hash of the tasks queued so far, by any collector. A task is a near duplicate of a registered one
+    of the same place type if their radii and centres differ by about the tolerance times the radius (up to
+    twice that, as both are quantized): the search would return the same places, so it is dropped instead
+    of queued. Keys are (place type, radius level, quantized centre); neighbouring levels and cells are
+    looked up too, so that near duplicates across a cell boundary are found. Keys live in a shared memory
+    hash table like the coverage index.
+    """
+
+    def __init__(self, place_types: List[str], tolerance: float = config.DEDUP_TOLERANCE,
+                 capacity: int = config.DEDUP_CAPACITY):
+
+        assert 0 < tolerance < 1, f"invalid duplicate tolerance {tolerance}"
+        assert capacity > 0, f"invalid duplicate index capacity {capacity}"
+
+        self.place_types = sorted(set(place_types))
+        self.__type_index = {t: i for i, t in enumerate(self.place_types)}
+        self.__log_step = math.log(1 + tolerance)
+        self.tolerance = tolerance
+        self.capacity = capacity
+
+        self.__lock = mp.Lock()
+        self.__size = mp.Value('l', 0, lock=False)
+        self.__slots = mp.Array('q', capacity, lock=False)      # 64 bit keys, open addressing
+
+        self.merged = mp.Value('l', 0)      # tasks dropped as near duplicates
+
+    def __keys(self, t: int, task: TaskDefinition, neighbours: bool) -> List[int]:
+
+        """ Key of the task cell, or of it and all neighbouring cells. """
+
+        level = round(math.log(max(task.radius, 1)) / self.__log_step)
+        keys = []
+        for lvl in (level - 1, level, level + 1) if neighbours else (level, ):
+            cell = self.tolerance * math.exp(lvl * self.__log_step)    # meters
+            d_lat = degrees_of_latitude(cell)
+            row = math.floor(task.lat / d_lat)
+            for r in (row - 1, row, row + 1) if neighbours else (row, ):
+                d_lon = d_lat / max(0.01, math.cos(math.radians((r + 0.5) * d_lat)))
+                col = math.floor(task.lon / d_lon)
+                for c in (col - 1, col, col + 1) if neighbours else (col, ):
+                    # tuples of ints hash the same in every process, unlike strings
+                    keys.append((hash((t, lvl, r, c)) & 0x7FFFFFFFFFFFFFFF) or 1)
+        return keys
+
+    def __find(self, key: int) -> int:
+
+        """ Slot holding the key or the free slot where it goes, call holding the lock. """
+
+        i = key % self.capacity
+        while self.__slots[i] != EMPTY and self.__slots[i] != key:
+            i = (i + 1) % self.capacity
+        return i
+
+    def add(self, task: TaskDefinition) -> bool:
+
+        """
+        Registers the task, unless a near duplicate is registered already. Returns False for duplicates.
+        Tasks of unknown place types and tasks coming after the table is full are always registered.
+        """
+
+        t = self.__type_index.get(task.place_type)
+        if t is None:
+            return True
+
+        near = self.__keys(t, task, neighbours=True)
+        own = self.__keys(t, task, neighbours=False)[0]
+
+        with self.__lock:
+            if any(self.__slots[self.__find(k)] == k for k in near):
+                with self.merged.get_lock():
+                    self.merged.value += 1
+                return False
+
+            if self.__size.value < self.capacity * MAX_LOAD:
+                i = self.__find(own)
+                if self.__slots[i] == EMPTY:
+                    self.__slots[i] = own
+                    self.__size.value += 1
+
+        return True
+
+    def __len__(self):
+        return self.__size.value
@@ -0,0 +1,89 @@
+"""
+Collector process start-up per geometry backend (see geometries/backend.py): time from Process.start()
+until a densifier is ready, and the process' resident memory then and after densifying a batch of tasks.
+Processes are spawned, as on Windows, so every one pays its own imports; the "python" row is a spawned
+process that loads no backend, the cost of each backend is on top of it. Backends whose packages are not
+installed here (QGIS outside the OSGeo4W shell, usually) are reported as unavailable. Run from the project root:
+
+    $ python -m dev.backend_benchmark
+"""
+
+import multiprocessing as mp
+import time
+
+N_TASKS = 2000
+REPEAT = 3
+
+
+def rss_mb() -> float:
+
+    """ Peak resident memory of this process, MB. """
+
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 2 ** 20
+    except ImportError:
+        import resource     # not on Windows
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024     # KB on Linux
+
+
+def measure(backend: str, report_q: mp.Queue):
+
+    """ Runs in the spawned process. No backend is loaded if None. """
+
+    try:
+        started = time.perf_counter()
+        from tasks import TaskDefinition
+        if backend is not None:
+            from geometries.backend import make_densifier
+            densifier = make_densifier(backend)
+        setup = time.perf_counter() - started
+        ready_at, ready_rss = time.time(), rss_mb()
+
+        per_task = 0
+        if backend is not None:
+            tasks = [TaskDefinition(lon=27.5 + i / N_TASKS, lat=53.9, radius=650, place_type="cafe")
+                     for i in range(N_TASKS)]
+            started = time.perf_counter()
+            for t in tasks:
+                densifier.densify(t)
+            per_task = (time.perf_counter() - started) / N_TASKS
+
+        report_q.put((ready_at, setup, ready_rss, per_task, rss_mb(), None))
+    except ImportError as e:
+        report_q.put((time.time(), 0, 0, 0, 0, f"unavailable ({e.__class__.__name__}: {e})"))
+    except Exception as e:
+        report_q.put((time.time(), 0, 0, 0, 0, f"failed ({e.__class__.__name__}: {e})"))
+
+
+if __name__ == '__main__':
+
+    from geometries.backend import BACKENDS     # not at the top, spawned processes must import it themselves
+
+    ctx = mp.get_context("spawn")
+
+    print(f"{'backend':<8} {'spawn to ready':>15} {'imports+setup':>14} {'RSS ready':>10} "
+          f"{'RSS after':>10} {'densify':>12}")
+
+    for backend in (None, ) + BACKENDS:
+        name = backend if backend else "python"
+        runs = []
+        for _ in range(REPEAT):
+            q = ctx.Queue()
+            start = time.time()
+            p = ctx.Process(target=measure, args=(backend, q))
+            p.start()
+            ready, setup, ready_rss, per_task, rss, error = q.get()
+            p.join()
+            runs.append((ready - start, setup, ready_rss, per_task, rss, error))
+
+        error = runs[-1][-1]
+        if error:
+            print(f"{name:<8} {error}")
+            continue
+
+        best = min(runs)    # least disturbed run
+        densify = f"{best[3] * 1e6:>8.1f} us" if backend else f"{'-':>11}"
+        print(f"{name:<8} {best[0] * 1000:>12.0f} ms {best[1] * 1000:>11.0f} ms {best[2]:>7.1f} MB "
+              f"{best[4]:>7.1f} MB {densify}")
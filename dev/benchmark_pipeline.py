@@ -0,0 +1,188 @@
+"""
+End-to-end throughput of the collector/writer pipeline against the local mock Places API (dev/mock_places_server.py).
+No quota is spent: database, raw JSONs and tracker go to a temporary folder, keys are fake.
+Reports tasks/min, requests/min, unique POIs per request and writer lag. Run from the project root:
+
+    $ python -m dev.benchmark_pipeline --engine processes --keys 4
+    $ python -m dev.benchmark_pipeline --engine asyncio --keys 4 --latency 0.3 --error-rate 0.01
+"""
+
+import argparse
+import math
+import os
+import sqlite3
+import tempfile
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+import config
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Collector/writer pipeline benchmark against a mock Places API")
+    parser.add_argument("--engine", default=config.COLLECTOR_ENGINE, choices=["processes", "asyncio"])
+    parser.add_argument("--keys", type=int, default=4, help="fake API keys")
+    parser.add_argument("--workers", type=int, default=0, help="processes engine only, 0 - one per key")
+    parser.add_argument("--key-rate", type=float, default=10, help="requests per second per key")
+    parser.add_argument("--types", type=int, default=2, help="place types to search for")
+    parser.add_argument("--extent", type=float, default=0.03, help="half size of the searched area, degrees")
+    parser.add_argument("--lattice", default=config.GRID_LATTICE, choices=["square", "hex"], help="initial grid")
+    parser.add_argument("--strategy", default=config.CRAWL_STRATEGY, choices=["densify", "quadtree", "frontier"])
+    parser.add_argument("--root-radius", type=float, default=4000, help="quadtree roots or frontier seeds, meters")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--recorded", default=None, help="serve POIs from this session database")
+    parser.add_argument("--per-type", type=int, default=3000, help="synthetic POIs per place type")
+    parser.add_argument("--token-delay", type=float, default=2.0, help="seconds until next_page_token is valid")
+    parser.add_argument("--latency", type=float, default=0.15, help="median response time, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of HTTP 500 responses")
+    parser.add_argument("--over-limit-rate", type=float, default=0.0)
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+WORKSPACE = os.environ.setdefault("POI_BENCHMARK_WORKSPACE", tempfile.mkdtemp(prefix="poi-benchmark-"))
+
+
+def configure():
+
+    """
+    Points the pipeline to the mock and the temporary workspace. Done on import, before any other project
+    module reads config, so that spawned child processes are configured the same way.
+    """
+
+    config.PLACES_NEARBY_URL = f"http://127.0.0.1:{ARGS.port}/maps/api/place/nearbysearch/json"
+    config.DATABASE = os.path.join(WORKSPACE, "poi.sqlite3")
+    config.TRACKER_JSON = os.path.join(WORKSPACE, "tracker.json")
+    config.RAW_DATA_FOLDER = os.path.join(WORKSPACE, "data")
+    config.TB_FILE = os.path.join(WORKSPACE, "tb.txt")
+    config.RESUME = False
+    config.CACHE_MODE = "off"
+
+    config.COLLECTOR_ENGINE = ARGS.engine
+    config.CRAWL_STRATEGY = ARGS.strategy
+    config.N_WORKERS = ARGS.workers
+    config.NEXT_PAGE_DELAY = ARGS.token_delay + 0.1
+    config.MAX_WAITING_UNINTERRUPTED = 5
+
+    config.MAX_REQUESTS_PER_MIN = ARGS.key_rate * 60
+    config.MAX_REQUESTS_PER_KEY = 0
+    config.GLOBAL_MAX_REQUESTS_PER_SEC = 0
+    config.AIMD_INITIAL_RATE = ARGS.key_rate
+    config.AIMD_MAX_RATE = ARGS.key_rate * 2
+
+    os.makedirs(config.RAW_DATA_FOLDER, exist_ok=True)
+
+
+configure()
+
+import main     # noqa: E402, reads config
+from dev.mock_places_server import CENTER, SAMPLE_TYPES, EARTH_RADIUS, MockPlacesServer, synthetic_places, \
+    recorded_places    # noqa: E402
+from geometries.vectorized import PreparedPolygon, lattice_rows, lattice_spacing    # noqa: E402
+from tasks import TaskDefinition    # noqa: E402
+
+
+def searched_area(places: List[dict]) -> Tuple[Tuple[float, float], PreparedPolygon]:
+
+    """ Centre (lat, lon) and the square searched around it. """
+
+    if ARGS.recorded:
+        lats = [p["geometry"]["location"]["lat"] for p in places]
+        lons = [p["geometry"]["location"]["lng"] for p in places]
+        center = (sum(lats) / len(lats), sum(lons) / len(lons))
+    else:
+        center = CENTER
+
+    lon_extent = ARGS.extent / math.cos(math.radians(center[0]))
+    box = [(-1, -1), (1, -1), (1, 1), (-1, 1), (-1, -1)]
+    aoi = PreparedPolygon([np.array([(center[1] + x * lon_extent, center[0] + y * ARGS.extent) for x, y in box])])
+
+    return center, aoi
+
+
+def make_tasks(places: List[dict], center: Tuple[float, float], aoi: PreparedPolygon) -> List[TaskDefinition]:
+
+    """ Initial grid over the searched area, same lattice and spacing as main.make_initial_tasks(). """
+
+    if ARGS.recorded:
+        types = sorted({t for p in places for t in p["types"]})[:ARGS.types]
+    else:
+        types = SAMPLE_TYPES[:ARGS.types]
+
+    quadtree = ARGS.strategy == "quadtree"
+    radius = config.INITIAL_RADIUS if ARGS.strategy == "densify" else ARGS.root_radius
+    lattice = "square" if quadtree else ARGS.lattice
+
+    spacing = math.degrees(lattice_spacing(radius, lattice) / EARTH_RADIUS)    # degrees
+    row_spacing, odd_row_shift = lattice_rows(spacing, lattice)
+    rows, columns = math.ceil(ARGS.extent / row_spacing) + 1, math.ceil(ARGS.extent / spacing) + 1
+    lon_scale = 1 / math.cos(math.radians(center[0]))
+
+    seeds = [(center[1] + (j * spacing + (i % 2) * odd_row_shift) * lon_scale, center[0] + i * row_spacing)
+             for i in range(-rows, rows + 1) for j in range(-columns - 1, columns + 1)]
+
+    if ARGS.strategy != "densify":
+        # like main, seeds whose circle misses the AOI are dropped
+        seeds = [(lon, lat) for lon, lat in seeds if aoi.intersects_circle(lon, lat, radius)]
+    else:
+        # seeds within the same square for either lattice
+        seeds = [(lon, lat) for lon, lat in seeds
+                 if abs(lon - center[1]) <= ARGS.extent * lon_scale and abs(lat - center[0]) <= ARGS.extent]
+
+    return [TaskDefinition(lon=lon, lat=lat, radius=radius, place_type=t) for t in types for lon, lat in seeds]
+
+
+def count_unique_pois() -> int:
+    conn = sqlite3.connect(config.DATABASE)
+    n = conn.execute(f"SELECT COUNT(*) FROM {config.POI_TABLE};").fetchone()[0]
+    conn.close()
+    return n
+
+
+if __name__ == '__main__':
+
+    places = recorded_places(ARGS.recorded) if ARGS.recorded else synthetic_places(n_per_type=ARGS.per_type)
+    server = MockPlacesServer(places, port=ARGS.port, token_delay=ARGS.token_delay, latency=ARGS.latency,
+                              error_rate=ARGS.error_rate, over_limit_rate=ARGS.over_limit_rate)
+    server_process = server.start()
+    time.sleep(0.5)     # let it bind
+
+    center, aoi = searched_area(places)
+    tasks = make_tasks(places, center=center, aoi=aoi)
+    keys = [f"benchmark-key-{i}" for i in range(ARGS.keys)]
+
+    conn = sqlite3.connect(config.DATABASE)
+    main.prepare_database(cursor=conn.cursor())
+    conn.commit()
+    conn.close()
+
+    grid = ARGS.strategy if ARGS.strategy != "densify" else f"{ARGS.lattice} grid"
+    print(f"BENCHMARK: {len(tasks)} initial tasks ({grid}), {server.index.size} POIs served at {server.url}, "
+          f"workspace {WORKSPACE}")
+
+    report = main.run_session(tasks=tasks, keys=keys, aoi=aoi)
+    server_process.terminate()
+
+    # collectors idle for a while before exiting, count time until the last request only
+    collecting_min = max(1e-9, server.last_request.value - report["started"]) / 60
+    requests = server.requests.value
+    unique_pois = count_unique_pois()
+    page_rate = (requests - server.errors.value) / collecting_min / 60     # pages queued for the writer per second
+
+    print(f"\nBENCHMARK RESULTS ({ARGS.engine} engine, {ARGS.keys} keys, {ARGS.latency * 1000:.0f} ms median latency)")
+    print(f"  collecting time        {collecting_min * 60:.1f} s")
+    print(f"  tasks per min          {server.searches.value / collecting_min:.1f} ({server.searches.value} tasks "
+          f"incl. recursion)")
+    print(f"  requests per min       {requests / collecting_min:.1f} ({requests} requests, "
+          f"{server.errors.value} failed)")
+    print(f"  covered tasks skipped  {report['covered']}")
+    print(f"  pruned outside AOI     {report['pruned']}")
+    print(f"  near duplicates        {report['duplicates']}")
+    print(f"  unique POIs            {unique_pois} ({unique_pois / max(1, requests):.2f} per request)")
+    print(f"  writer backlog         {report['avg_backlog']:.0f} pages avg, {report['max_backlog']} max "
+          f"(~{report['avg_backlog'] / max(1e-9, page_rate):.2f} s behind)")
+    print(f"  writer drain time      {report['writer_drained'] - report['collectors_joined']:.2f} s "
+          f"after the collectors finished")
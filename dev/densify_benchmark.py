@@ -0,0 +1,69 @@
+"""
+Densification speed and agreement: QGIS transforms (geomworks.Densifier) against NumPy
+(vectorized.VectorDensifier), per task and batched. Without QGIS Python, the same PROJ transforms
+through pyproj (backend.ProjDensifier) are the reference. Run from the project root:
+
+    $ python -m dev.densify_benchmark
+"""
+
+import random
+import time
+from typing import Callable, List
+
+from geometries.backend import ProjDensifier
+from geometries.local import distance
+from geometries.vectorized import VectorDensifier
+from tasks import TaskDefinition
+
+N_TASKS = 20000
+CENTER = (27.5615, 53.9045)     # lon, lat
+EXTENT = 1.5                    # degrees, each side from the centre
+TOLERANCE = 0.01                # of the child radius
+
+
+def random_tasks(n: int) -> List[TaskDefinition]:
+    random.seed(0)
+    return [TaskDefinition(lon=CENTER[0] + random.uniform(-EXTENT, EXTENT),
+                           lat=CENTER[1] + random.uniform(-EXTENT, EXTENT),
+                           radius=random.choice([650, 325, 162.5, 81.25]), place_type="cafe") for _ in range(n)]
+
+
+def timed(label: str, fn: Callable, n: int):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed:7.3f} s   {elapsed / n * 1e6:8.1f} us per task")
+    return result
+
+
+if __name__ == '__main__':
+
+    try:
+        from geometries.geomworks import Densifier     # loads QGIS
+        reference, make_reference = "QGIS", Densifier
+    except ImportError as e:
+        print(f"QGIS unavailable ({e.__class__.__name__}: {e}), pyproj is the reference")
+        reference, make_reference = "pyproj", ProjDensifier
+
+    tasks = random_tasks(N_TASKS)
+    print(f"Densifying {N_TASKS} tasks around {CENTER}")
+
+    reference_densifier = timed(f"{reference} densifier setup", make_reference, 1)
+    vector_densifier = timed("NumPy densifier setup", VectorDensifier, 1)
+
+    expected = timed(f"{reference}, per task", lambda: [reference_densifier.densify(t) for t in tasks], N_TASKS)
+    timed("NumPy, per task", lambda: [vector_densifier.densify(t) for t in tasks], N_TASKS)
+    received = timed("NumPy, one batch", lambda: vector_densifier.densify_many(tasks), N_TASKS)
+
+    # both put children in the same order
+    errors = []
+    for a, b in zip(expected, received):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert abs(x.radius - y.radius) < 1e-9
+            errors.append(distance(x.lon, x.lat, y.lon, y.lat) / x.radius)
+
+    worst = max(errors)
+    print(f"Child centre offset from the {reference} result: mean {sum(errors) / len(errors):.2e}, "
+          f"max {worst:.2e} of the child radius")
+    assert worst <= TOLERANCE, f"NumPy densifier is off by {worst:.2e} of the radius, tolerance is {TOLERANCE}"
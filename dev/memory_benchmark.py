@@ -0,0 +1,95 @@
+"""
+What a collector sends to the writers and keeps in memory on a recursion heavy crawl. The crawl runs in this
+process against the mock POI index (dev/mock_places_server.py), responses are parsed from JSON like real
+ones, pages go through CollectorBase.submit_page() and child tasks through the densifier. Queues keep every
+object put in them, as mp.Queue buffers do when the writers fall behind, and count the bytes pickled.
+Reports bytes pickled per POI and per task and the growth of peak RSS. Run from the project root:
+
+    $ python -m dev.memory_benchmark --per-type 20000
+"""
+
+import argparse
+import json
+import time
+from collections import deque
+from multiprocessing.reduction import ForkingPickler
+from types import SimpleNamespace
+
+import config
+from dataclass import PoiData
+from dev.backend_benchmark import rss_mb
+from dev.mock_places_server import PlacesIndex, SAMPLE_TYPES, CENTER, EXTENT, synthetic_places
+from exceptions import SearchRecursionError
+from geometries.backend import make_densifier
+from tasks import TaskDefinition
+from workers import CollectorBase
+
+PAGE_SIZE = 20
+
+
+class BackloggedQueue(object):
+
+    """ Keeps what is put, like an mp.Queue nobody reads from, and counts bytes as pickled by mp.Queue. """
+
+    def __init__(self):
+        self.items = []
+        self.bytes = 0
+
+    def put(self, obj):
+        self.items.append(obj)
+        self.bytes += len(ForkingPickler.dumps(obj))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bytes pickled per POI and peak RSS of a collector")
+    parser.add_argument("--per-type", type=int, default=20000, help="synthetic POIs per place type")
+    parser.add_argument("--types", type=int, default=2, help="place types to search for")
+    parser.add_argument("--radius", type=float, default=config.INITIAL_RADIUS, help="initial grid radius, meters")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    types = SAMPLE_TYPES[:args.types]
+    index = PlacesIndex(synthetic_places(n_per_type=args.per_type, types=types))
+    densifier = make_densifier()
+
+    # coarse square grid over the mock city, every saturated search recurses
+    step = args.radius * 1.4 / 111320   # degrees
+    n = int(EXTENT / step)
+    pending = deque(TaskDefinition(lon=CENTER[1] + j * step * 1.7, lat=CENTER[0] + i * step, radius=args.radius,
+                                   place_type=t)
+                    for t in types for i in range(-n, n + 1) for j in range(-n, n + 1))
+
+    collector = SimpleNamespace(poi_db_q=BackloggedQueue(), rawfile_q=BackloggedQueue())
+    tasks_q = BackloggedQueue()
+    baseline = rss_mb()
+    started = time.perf_counter()
+    pois = 0
+
+    while pending:
+        task = pending.popleft()
+        tasks_q.put(task)
+        results = index.nearby(lat=task.lat, lon=task.lon, radius=task.radius, place_type=task.place_type)
+
+        for k in range(0, len(results), PAGE_SIZE):
+            body = json.dumps({"status": "OK", "results": results[k:k + PAGE_SIZE]})
+            page = PoiData.from_response(resp=json.loads(body))      # as parsed by the transport
+            CollectorBase.submit_page(collector, pois=page)
+            pois += len(page)
+
+        if len(results) >= 60:
+            try:
+                pending.extend(densifier.densify(task=task))
+            except SearchRecursionError:
+                pass
+
+    elapsed = time.perf_counter() - started
+    n_tasks = len(tasks_q.items)
+
+    print(f"{n_tasks} tasks, {pois} POIs in {elapsed:.1f} s")
+    print(f"  bytes pickled per POI   {collector.poi_db_q.bytes / pois:.0f} database + "
+          f"{collector.rawfile_q.bytes / pois:.0f} raw JSON")
+    print(f"  bytes pickled per task  {tasks_q.bytes / n_tasks:.0f}")
+    print(f"  peak RSS                {rss_mb():.1f} MB, +{rss_mb() - baseline:.1f} MB while crawling")
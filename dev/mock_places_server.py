@@ -0,0 +1,316 @@
+"""
+Local stand-in for the Nearby Search endpoint. No quota is spent.
+Serves POIs of a synthetic clustered distribution, or POIs recorded in a previous session's database,
+paged like the real API: 20 results per page, 60 at most, next_page_token only valid after a delay.
+Random latency, 5xx responses and OVER_QUERY_LIMIT statuses can be mixed in. Run from the project root:
+
+    $ python -m dev.mock_places_server --port 8765
+    $ python -m dev.mock_places_server --recorded poi.sqlite3
+
+then point config.PLACES_NEARBY_URL to the printed URL.
+"""
+
+import argparse
+import gzip
+import json
+import math
+import multiprocessing as mp
+import random
+import secrets
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import config
+
+HOST, PORT = "127.0.0.1", 8765
+PATH = "/maps/api/place/nearbysearch/json"
+
+PAGE_SIZE = 20
+MAX_RESULTS = 60
+MAX_RADIUS = 50000          # meters
+EARTH_RADIUS = 6371008.8    # meters
+
+# synthetic distribution: downtown Minsk, POIs clustered around random centres
+CENTER = (53.9045, 27.5615)     # lat, lon
+EXTENT = 0.08                   # degrees of latitude, each side from the centre
+SAMPLE_TYPES = ["cafe", "restaurant", "bar", "bank", "pharmacy", "store"]
+
+
+def distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+
+    """ Equirectangular approximation, meters. Good enough within a search radius. """
+
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS * math.hypot(x, y)
+
+
+def make_place(i: int, lat: float, lon: float, place_type: str) -> dict:
+
+    """ Result item shaped like the real one, enough for PoiData.from_response(). """
+
+    return {
+        "place_id": f"mock{i:08d}", "id": f"{i:040d}",
+        "geometry": {"location": {"lat": lat, "lng": lon}},
+        "name": f"{place_type.capitalize()} #{i}", "rating": round(random.uniform(1, 5), 1),
+        "business_status": "OPERATIONAL", "scope": "GOOGLE", "user_ratings_total": random.randint(0, 3000),
+        "vicinity": f"Mock street {i % 300}", "types": [place_type, "point_of_interest", "establishment"],
+    }
+
+
+def synthetic_places(n_per_type: int = 3000, types: List[str] = None, seed: int = 0) -> List[dict]:
+
+    """ Gaussian clusters of different size and spread, denser towards the centre like a city. """
+
+    random.seed(seed)
+    types = types if types else SAMPLE_TYPES
+    places = []
+
+    for place_type in types:
+        clusters = [(random.gauss(CENTER[0], EXTENT / 3), random.gauss(CENTER[1], EXTENT / 2),
+                     random.uniform(0.002, 0.015)) for _ in range(25)]
+        for _ in range(n_per_type):
+            lat, lon, spread = random.choice(clusters)
+            places.append(make_place(len(places), random.gauss(lat, spread), random.gauss(lon, spread * 1.7),
+                                     place_type))
+
+    return places
+
+
+def recorded_places(db_file: str) -> List[dict]:
+
+    """ POIs from the POI table of a previous session. """
+
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute(f"SELECT place_id, id, lon, lat, name, rating, scope, user_ratings_total, vicinity, "
+                        f"types, price, business_status FROM {config.POI_TABLE};").fetchall()
+    conn.close()
+
+    places = []
+    for place_id, _id, lon, lat, name, rating, scope, ratings_total, vicinity, types, price, status in rows:
+        places.append({
+            "place_id": place_id, "id": _id, "geometry": {"location": {"lat": lat, "lng": lon}}, "name": name,
+            "rating": rating, "business_status": status, "scope": scope, "user_ratings_total": ratings_total,
+            "vicinity": vicinity, "types": types.split(", ") if types else [], "price_level": price,
+        })
+    return places
+
+
+class PlacesIndex(object):
+
+    """ Places bucketed per type and ~1 km grid cell, for radius queries. """
+
+    __cell: float = 0.01    # degrees
+
+    def __init__(self, places: List[dict]):
+
+        self.__buckets: Dict[Tuple[str, int, int], List[dict]] = {}
+        for p in places:
+            loc = p["geometry"]["location"]
+            for t in p["types"]:
+                self.__buckets.setdefault((t, *self.__cell_of(loc["lat"], loc["lng"])), []).append(p)
+
+        self.size = len(places)
+
+    def __cell_of(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.__cell)), int(math.floor(lon / self.__cell))
+
+    def nearby(self, lat: float, lon: float, radius: float, place_type: str) -> List[dict]:
+
+        """ Places of the type within the radius, nearest first, at most MAX_RESULTS. """
+
+        d_lat = math.degrees(radius / EARTH_RADIUS)
+        d_lon = d_lat / max(0.01, math.cos(math.radians(lat)))
+        lat0, lon0 = self.__cell_of(lat - d_lat, lon - d_lon)
+        lat1, lon1 = self.__cell_of(lat + d_lat, lon + d_lon)
+
+        found = []
+        for i in range(lat0, lat1 + 1):
+            for j in range(lon0, lon1 + 1):
+                for p in self.__buckets.get((place_type, i, j), ()):
+                    loc = p["geometry"]["location"]
+                    d = distance(lat, lon, loc["lat"], loc["lng"])
+                    if d <= radius:
+                        found.append((d, p))
+
+        found.sort(key=lambda x: x[0])
+        return [p for _, p in found[:MAX_RESULTS]]
+
+
+class MockPlacesServer(object):
+
+    """
+    Threaded HTTP server answering Nearby Search requests from a PlacesIndex.
+    Requests and errors served are counted in shared memory, so another process can read them.
+    """
+
+    def __init__(self, places: List[dict], host: str = HOST, port: int = PORT,
+                 token_delay: float = 2.0, latency: float = 0.15, error_rate: float = 0.0,
+                 over_limit_rate: float = 0.0):
+
+        self.index = PlacesIndex(places)
+        self.host, self.port = host, port
+        self.token_delay = token_delay        # seconds until a next_page_token becomes valid
+        self.latency = latency                # seconds, median of a log-normal distribution
+        self.error_rate = error_rate          # share of HTTP 500 responses
+        self.over_limit_rate = over_limit_rate
+
+        self.requests = mp.Value('l', 0)
+        self.errors = mp.Value('l', 0)        # HTTP 500 and non-OK statuses
+        self.searches = mp.Value('l', 0)      # successful first page requests, i.e. tasks done
+        self.pois = mp.Value('l', 0)          # results served, duplicates included
+        self.last_request = mp.Value('d', 0)  # time.time()
+
+        self.__tokens: Dict[str, Tuple[float, List[dict]]] = {}     # token: (valid from, remaining results)
+        self.__tokens_lock: threading.Lock = None  # made in the serving process
+        self.__httpd: ThreadingHTTPServer = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}{PATH}"
+
+    def __page(self, results: List[dict]) -> dict:
+
+        resp = {"status": "OK", "html_attributions": [], "results": results[:PAGE_SIZE]}
+        with self.pois.get_lock():
+            self.pois.value += len(resp["results"])
+
+        if len(results) > PAGE_SIZE:
+            token = secrets.token_urlsafe(96)
+            with self.__tokens_lock:
+                self.__tokens[token] = (time.time() + self.token_delay, results[PAGE_SIZE:])
+            resp["next_page_token"] = token
+        return resp
+
+    def respond(self, query: Dict[str, str]) -> Tuple[int, dict]:
+
+        """ HTTP status and response JSON for the request parameters. """
+
+        with self.requests.get_lock():
+            self.requests.value += 1
+            self.last_request.value = time.time()
+
+        time.sleep(random.lognormvariate(math.log(self.latency), 0.5) if self.latency > 0 else 0)
+
+        if random.random() < self.error_rate:
+            return 500, {}
+        if not query.get("key"):
+            return 200, {"status": "REQUEST_DENIED", "error_message": "You must use an API key"}
+        if random.random() < self.over_limit_rate:
+            return 200, {"status": "OVER_QUERY_LIMIT", "error_message": "You have exceeded your daily request quota"}
+
+        if "pagetoken" in query:
+            with self.__tokens_lock:
+                valid_from, remaining = self.__tokens.get(query["pagetoken"], (None, None))
+                if valid_from is not None and time.time() >= valid_from:
+                    del self.__tokens[query["pagetoken"]]
+
+            if valid_from is None or time.time() < valid_from:
+                return 200, {"status": "INVALID_REQUEST", "results": [], "html_attributions": []}
+            return 200, self.__page(remaining)
+
+        try:
+            lat, lon = (float(x) for x in query["location"].split(","))
+            # distance ranked searches have no radius, but the API never looks further than 50 km
+            radius = MAX_RADIUS if query.get("rankby") == "distance" and "radius" not in query \
+                else float(query["radius"])
+            place_type = query["type"]
+        except (KeyError, ValueError):
+            return 200, {"status": "INVALID_REQUEST", "results": [], "html_attributions": []}
+
+        results = self.index.nearby(lat, lon, radius, place_type)
+        with self.searches.get_lock():
+            self.searches.value += 1
+
+        if not results:
+            return 200, {"status": "ZERO_RESULTS", "results": [], "html_attributions": []}
+        return 200, self.__page(results)
+
+    def __make_handler(self):
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"   # keep-alive
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != PATH:
+                    self.send_error(404)
+                    return
+
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                status, resp = server.respond(query)
+                if status != 200 or resp.get("status") not in ("OK", "ZERO_RESULTS"):
+                    with server.errors.get_lock():
+                        server.errors.value += 1
+
+                body = json.dumps(resp).encode("utf-8")
+                compress = "gzip" in self.headers.get("Accept-Encoding", "")
+                if compress:
+                    body = gzip.compress(body, compresslevel=1)
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=UTF-8")
+                self.send_header("Content-Length", str(len(body)))
+                if compress:
+                    self.send_header("Content-Encoding", "gzip")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass    # keep output clean
+
+        return Handler
+
+    def serve_forever(self):
+        self.__tokens_lock = threading.Lock()
+        self.__httpd = ThreadingHTTPServer((self.host, self.port), self.__make_handler())
+        self.__httpd.daemon_threads = True
+        self.__httpd.serve_forever()
+
+    def start(self) -> mp.Process:
+
+        """ Serves from a separate daemon process, so that the collectors' CPU use does not skew latency. """
+
+        p = mp.Process(target=self.serve_forever, daemon=True, name="MockPlacesServer")
+        p.start()
+        return p
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Local mock of the Places Nearby Search endpoint")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--recorded", default=None, help="serve POIs from this session database")
+    parser.add_argument("--per-type", type=int, default=3000, help="synthetic POIs per place type")
+    parser.add_argument("--token-delay", type=float, default=2.0, help="seconds until next_page_token is valid")
+    parser.add_argument("--latency", type=float, default=0.15, help="median response time, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of HTTP 500 responses")
+    parser.add_argument("--over-limit-rate", type=float, default=0.0, help="share of OVER_QUERY_LIMIT statuses")
+    return parser.parse_args()
+
+
+def make_server(args) -> MockPlacesServer:
+    places = recorded_places(args.recorded) if args.recorded else synthetic_places(n_per_type=args.per_type)
+    return MockPlacesServer(places, host=args.host, port=args.port, token_delay=args.token_delay,
+                            latency=args.latency, error_rate=args.error_rate, over_limit_rate=args.over_limit_rate)
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    server = make_server(args)
+
+    print(f"Serving {server.index.size} POIs at {server.url}. Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"{server.requests.value} requests served, {server.errors.value} errors")
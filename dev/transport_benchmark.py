@@ -0,0 +1,103 @@
+"""
+Per-request overhead of Places transports against a local mock Nearby Search endpoint.
+No quota is spent. Run from the project root:
+
+    $ python -m dev.transport_benchmark
+"""
+
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from jsonlib import json_loads
+from transport import SessionTransport
+
+N_REQUESTS = 500
+HOST, PORT = "127.0.0.1", 8765
+URL = f"http://{HOST}:{PORT}/maps/api/place/nearbysearch/json"
+
+
+def sample_response() -> bytes:
+
+    """ Page of 20 results shaped like a real Nearby Search response. """
+
+    results = []
+    for i in range(20):
+        results.append({
+            "place_id": f"ChIJ{i:06d}sample", "id": f"{i:040d}",
+            "geometry": {"location": {"lat": 53.9 + i / 1000, "lng": 27.58 + i / 1000}},
+            "name": f"Cafe #{i}", "rating": 4.5, "business_status": "OPERATIONAL", "scope": "GOOGLE",
+            "user_ratings_total": 100 + i, "vicinity": "Main street " * 3, "types": ["cafe", "food"],
+            "photos": [{"height": 1000, "width": 1000, "html_attributions": ["x" * 120]}],
+        })
+    return json.dumps({"status": "OK", "results": results, "html_attributions": []}).encode("utf-8")
+
+
+BODY = sample_response()
+BODY_GZIP = gzip.compress(BODY)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"   # keep-alive
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def do_GET(self):
+        compress = "gzip" in self.headers.get("Accept-Encoding", "")
+        body = BODY_GZIP if compress else BODY
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        if compress:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass    # keep output clean
+
+
+def bench(name: str, call) -> float:
+
+    call()      # warm up
+    started = time.perf_counter()
+    for _ in range(N_REQUESTS):
+        call()
+    per_request_ms = (time.perf_counter() - started) * 1000 / N_REQUESTS
+
+    print(f"{name:<45} {per_request_ms:.3f} ms per request")
+    return per_request_ms
+
+
+if __name__ == '__main__':
+
+    server = ThreadingHTTPServer((HOST, PORT), MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    params = {"location": "53.909804,27.580184", "radius": 650, "type": "cafe", "key": "dummy"}
+
+    print(f"Response body: {len(BODY)} bytes, {len(BODY_GZIP)} bytes gzipped. JSON decoder: {json_loads.__module__}")
+
+    # what a client without pooling does: new connection, uncompressed body, stdlib JSON
+    baseline = bench(
+        "new connection per request, stdlib json",
+        lambda: requests.get(URL, params=params, headers={"Connection": "close", "Accept-Encoding": "identity"}).json()
+    )
+
+    transport = SessionTransport(url=URL, pool_size=1)
+    pooled = bench(
+        "SessionTransport (keep-alive, gzip, fast json)",
+        lambda: transport.places_nearby(key="dummy", location=(53.909804, 27.580184), radius=650, place_type="cafe")
+    )
+
+    print(f"Overhead saved: {baseline - pooled:.3f} ms per request ({(1 - pooled / baseline) * 100:.1f}%). "
+          f"Note: mock is plain HTTP on loopback, TLS handshakes saved against the real API are not included.")
+
+    transport.close()
+    server.shutdown()
+    print("DONE")
@@ -0,0 +1,132 @@
+"""
+Database writer throughput. Pages of 20 synthetic POIs are queued with the tasks they complete as fast as
+possible, while another connection counts POIs every 50 ms like an analyst reading the database live.
+Reports rows written per second until the writer is done and how many reads found the database locked.
+With --trickle, pages are queued one at a time instead and the time until each is readable is reported.
+The database goes to a temporary folder. Run from the project root:
+
+    $ python -m dev.writer_benchmark --pages 5000
+    $ python -m dev.writer_benchmark --pages 5000 --synchronous FULL
+    $ python -m dev.writer_benchmark --pages 200 --trickle
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import config
+from dataclass import PoiData
+from db import expressions
+from dev.mock_places_server import make_place
+from tasks import TaskDefinition, PageBatch
+
+PAGE_SIZE = 20
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Database writer throughput with a live reader")
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--synchronous", default=config.DB_SYNCHRONOUS, choices=["OFF", "NORMAL", "FULL", "EXTRA"])
+    parser.add_argument("--trickle", action="store_true", help="one page at a time, time until readable")
+    return parser.parse_args()
+
+
+def trickle(poi_q: mp.Queue, db_file: str, batches: list):
+
+    """ Queues pages one by one, each once the previous one can be read. """
+
+    conn = sqlite3.connect(db_file, timeout=0)
+    latencies = []
+    for i, batch in enumerate(batches):
+        started = time.perf_counter()
+        poi_q.put(batch)
+        while True:
+            try:
+                if conn.execute(f"SELECT COUNT(*) FROM {config.POI_TABLE};").fetchone()[0] >= (i + 1) * PAGE_SIZE:
+                    break
+            except sqlite3.OperationalError:
+                pass    # locked
+            time.sleep(0.0005)
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+
+    poi_q.put(None)
+    latencies.sort()
+    print(f"\nWRITER BENCHMARK (synchronous={config.DB_SYNCHRONOUS}, one page at a time)")
+    print(f"  queued to readable     {latencies[len(latencies) // 2] * 1000:.1f} ms median, "
+          f"{latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms p95, {latencies[-1] * 1000:.1f} ms max")
+
+
+def read_live(db_file: str, stop: threading.Event, results: dict):
+
+    """ Counts POIs until stopped, without waiting on locks. """
+
+    conn = sqlite3.connect(db_file, timeout=0)
+    while not stop.is_set():
+        try:
+            results["last"] = conn.execute(f"SELECT COUNT(*) FROM {config.POI_TABLE};").fetchone()[0]
+            results["ok"] += 1
+        except sqlite3.OperationalError:
+            results["locked"] += 1
+        time.sleep(0.05)
+    conn.close()
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    config.DB_SYNCHRONOUS = args.synchronous        # before the writer is spawned
+
+    from db.writer import DatabaseWriter
+
+    db_file = os.path.join(tempfile.mkdtemp(prefix="poi-writer-benchmark-"), "poi.sqlite3")
+    conn = sqlite3.connect(db_file)
+    for expression in (expressions.CREATE_POI_TABLE, expressions.CREATE_JOBS_TABLE,
+                       expressions.CREATE_SUCCESS_TABLE, expressions.CREATE_PROGRESS_TABLE):
+        conn.execute(expression)
+    conn.commit()
+    conn.close()
+
+    # parsed before timing, like collectors do
+    batches = []
+    for i in range(args.pages):
+        results = [make_place(i * PAGE_SIZE + k, 53.9 + k / 1000, 27.5 + i / 10000, "cafe") for k in range(PAGE_SIZE)]
+        pois = PoiData.from_response(resp={"status": "OK", "results": results})
+        for p in pois:
+            p.raw = None    # sent to the raw JSON writer
+        task = TaskDefinition(lon=27.5 + i / 10000, lat=53.9, radius=650, place_type="cafe")
+        batches.append(PageBatch(pois=pois, ack=task, jobs=[task]))
+
+    poi_q = mp.Queue()
+    writer = DatabaseWriter(db_file=db_file, poi_q=poi_q, printlock=mp.Lock())
+    writer.start()
+    time.sleep(1)   # connected
+
+    if args.trickle:
+        trickle(poi_q, db_file=db_file, batches=batches)
+        writer.join()
+        raise SystemExit
+
+    reads = {"ok": 0, "locked": 0, "last": 0}
+    stop = threading.Event()
+    reader = threading.Thread(target=read_live, args=(db_file, stop, reads))
+    reader.start()
+
+    started = time.time()
+    for batch in batches:
+        poi_q.put(batch)
+    poi_q.put(None)     # poison pill, after all pages
+
+    writer.join()
+    elapsed = time.time() - started
+    stop.set()
+    reader.join()
+
+    rows = args.pages * (PAGE_SIZE + 2)     # POIs, job and success
+    print(f"\nWRITER BENCHMARK (synchronous={args.synchronous})")
+    print(f"  {rows} rows in {elapsed:.1f} s, {rows / elapsed:.0f} rows per second until the writer is done")
+    print(f"  live reads             {reads['ok']} ok, {reads['locked']} found the database locked")
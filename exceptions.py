@@ -31,10 +31,39 @@ class InvalidRequestException(Exception):
     pass
 
 
+class ExpiredPageTokenException(Exception):
+    """ Page token restored from a previous session is not accepted anymore. """
+
+
+class NoKeysLeftException(Exception):
+    """ All API keys in the pool are exhausted or denied. """
+
+
+class CacheMissException(Exception):
+    """ Response is not cached while replaying offline, nothing is known about the task. """
+
+
 class FinishException(Exception):
     pass
 
 
+class TransportError(Exception):
+
+    """ Request failed below the Places API level: connection problems, HTTP errors, broken JSON. """
+
+    def __init__(self, message: str = "", status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TransportTimeout(TransportError):
+    pass
+
+
+class UnknownStatusException(TransportError):
+    """ UNKNOWN_ERROR or a status the API is not documented to return: a server side failure, worth another try. """
+
+
 def write_traceback(e: Exception, file: str, append: bool = True):
 
     """ Writes traceback to a file in specified mode."""
@@ -0,0 +1,176 @@
+"""
+Geometry backends for the collectors. Densification only needs a few transforms, so workers use a lean
+implementation and never load QGIS, which stays with reading the AOI and making the initial grid in main.
+
+    "numpy"  - local tangent plane math, geometries.vectorized
+    "pyproj" - the same PROJ transforms QGIS uses, through pyproj
+    "qgis"   - QgsCoordinateTransform, geometries.geomworks
+    "auto"   - pyproj if installed, NumPy otherwise
+
+Quadtree and frontier crawls place children the same way whatever the backend, see QuadtreeDensifier
+and FrontierDensifier.
+"""
+
+from typing import List, Sequence
+
+import numpy as np
+
+import config
+from exceptions import SearchRecursionError
+from geometries.vectorized import VectorDensifier, make_children, project_point, \
+    utm_central_meridian
+from tasks import TaskDefinition
+
+BACKENDS = ("numpy", "pyproj", "qgis")
+
+
+class ProjDensifier(object):
+
+    """ Same children as geomworks.Densifier, through pyproj transformers in batches. """
+
+    DENSIFY_ANGLES: np.ndarray = VectorDensifier.DENSIFY_ANGLES
+
+    def __init__(self, metric_epsg: int = config.METRIC_CRS_EPSG):
+
+        from pyproj import Transformer
+
+        assert metric_epsg > 0 and isinstance(metric_epsg, int), \
+            f"invalid value {metric_epsg} for metric coordinate system EPSG code"
+
+        self.transformer_to_metric = Transformer.from_crs(4326, metric_epsg, always_xy=True)
+        self.transformer_to_wgs = Transformer.from_crs(metric_epsg, 4326, always_xy=True)
+
+    def densify_many(self, tasks: Sequence[TaskDefinition]) -> List[List[TaskDefinition]]:
+
+        if not tasks:
+            return []
+
+        radii = np.array([t.radius for t in tasks], dtype=float)
+        if radii.min() / 2 <= config.MIN_ALLOWED_RADIUS:
+            raise SearchRecursionError
+
+        x, y = self.transformer_to_metric.transform(np.array([t.lon for t in tasks], dtype=float),
+                                                    np.array([t.lat for t in tasks], dtype=float))
+
+        # cut it as 3:2 ratio, azimuths clockwise from north like QgsPointXY.project()
+        distance = radii[:, np.newaxis] * 0.6
+        azimuths = np.radians(self.DENSIFY_ANGLES)
+        ring_lons, ring_lats = self.transformer_to_wgs.transform(x[:, np.newaxis] + distance * np.sin(azimuths),
+                                                                 y[:, np.newaxis] + distance * np.cos(azimuths))
+
+        return make_children(tasks, ring_lons, ring_lats)
+
+    def densify(self, task: TaskDefinition) -> List[TaskDefinition]:
+        return self.densify_many([task])[0]
+
+
+class QuadtreeDensifier(object):
+
+    """
+    Children of the "quadtree" crawl strategy. A task stands for the square cell inscribed in its circle,
+    as seeded by a square grid, and is split into the 4 quadrants of the cell: their circumscribed circles
+    have half the radius and tile the parent cell exactly. Quadrants whose circle misses the AOI are dropped
+    by the collectors.
+    Axes follow the metric CRS grid like the seed lattice.
+    """
+
+    QUADRANT_AZIMUTHS: List[float] = [45, 135, 225, 315]     # degrees
+
+    def __init__(self, metric_epsg: int = config.METRIC_CRS_EPSG):
+
+        assert metric_epsg > 0 and isinstance(metric_epsg, int), \
+            f"invalid value {metric_epsg} for metric coordinate system EPSG code"
+
+        self.central_meridian = utm_central_meridian(metric_epsg)
+
+    def densify(self, task: TaskDefinition) -> List[TaskDefinition]:
+
+        radius = task.radius / 2
+        if radius <= config.MIN_ALLOWED_RADIUS:
+            raise SearchRecursionError
+
+        # quadrant centres are a quarter of the cell diagonal, i.e. half the radius, away
+        children = []
+        for a in self.QUADRANT_AZIMUTHS:
+            lon, lat = project_point(task.lon, task.lat, radius, a, central_meridian=self.central_meridian)
+            children.append(TaskDefinition(lon=lon, lat=lat, radius=radius, place_type=task.place_type,
+                                           parent=task.task_id))
+
+        return children
+
+    def densify_many(self, tasks: Sequence[TaskDefinition]) -> List[List[TaskDefinition]]:
+        return [self.densify(t) for t in tasks]
+
+
+class FrontierDensifier(object):
+
+    """
+    Probes of the "frontier" strategy. A distance ranked search found everything up to its farthest result,
+    the task radius is that reach. New probes go around the searched disc, 1.5 radii out and 60 degrees
+    apart, and only a small disc around each (a third of the reach) has to be unsearched for it to be
+    dispatched: the coverage index skips the rest, so probes only land on the frontier. Probes whose
+    disc misses the AOI are dropped by the collectors, that is where the crawl stops. Like other strategies,
+    recursion ends at MIN_ALLOWED_RADIUS: more than 60 places that close together keep the reach short, probes
+    around them would be re-seeded forever.
+    """
+
+    PROBE_AZIMUTHS: List[float] = [0, 60, 120, 180, 240, 300]     # degrees
+    STEP: float = 1.5       # of the reach
+    PROBE_SHARE: float = 1 / 3      # of the reach, must be left uncovered
+
+    def densify(self, task: TaskDefinition) -> List[TaskDefinition]:
+
+        radius = task.radius * self.PROBE_SHARE
+        if radius <= config.MIN_ALLOWED_RADIUS:
+            raise SearchRecursionError
+
+        probes = []
+        for a in self.PROBE_AZIMUTHS:
+            lon, lat = project_point(task.lon, task.lat, task.radius * self.STEP, a)
+            probes.append(TaskDefinition(lon=lon, lat=lat, radius=radius, place_type=task.place_type,
+                                         parent=task.task_id))
+
+        return probes
+
+    def densify_many(self, tasks: Sequence[TaskDefinition]) -> List[List[TaskDefinition]]:
+        return [self.densify(t) for t in tasks]
+
+
+def resolve_backend(backend: str = config.GEOMETRY_BACKEND) -> str:
+
+    """ Backend name with "auto" resolved. """
+
+    if backend == "auto":
+        try:
+            import pyproj   # noqa: F401
+            return "pyproj"
+        except ImportError:
+            return "numpy"
+    elif backend in BACKENDS:
+        return backend
+    else:
+        raise Exception(f"unknown geometry backend \"{backend}\", see config to fix")
+
+
+def make_densifier(backend: str = config.GEOMETRY_BACKEND, metric_epsg: int = config.METRIC_CRS_EPSG,
+                   strategy: str = config.CRAWL_STRATEGY):
+
+    """ Densifier of the crawl strategy and backend, make it in the process that uses it. """
+
+    if strategy == "quadtree":
+        return QuadtreeDensifier(metric_epsg=metric_epsg)
+    elif strategy == "frontier":
+        return FrontierDensifier()
+    elif strategy != "densify":
+        raise Exception(f"unknown crawl strategy \"{strategy}\", see config to fix")
+
+    backend = resolve_backend(backend)
+
+    if backend == "numpy":
+        return VectorDensifier(metric_epsg=metric_epsg)
+    elif backend == "pyproj":
+        return ProjDensifier(metric_epsg=metric_epsg)
+    else:
+        from geometries.geomworks import Densifier     # loads QGIS
+        assert metric_epsg == config.METRIC_CRS_EPSG, "QGIS densifier only uses config.METRIC_CRS_EPSG"
+        return Densifier()
@@ -1,11 +1,14 @@
 import itertools
 import math
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
 
+import numpy as np
 from qgis.core import *
 
 import config
 from exceptions import SearchRecursionError
+from geometries.vectorized import lattice_in_polygon, lattice_rows, lattice_spacing, covering_density
 from tasks import TaskDefinition
 
 
@@ -52,36 +55,20 @@ class Densifier(object):
         densified_wgs = [self.transformer_to_wgs.transform(pt) for pt in densified_metric]
 
         # as well, include the center point with smaller radius
-        task_for_center = TaskDefinition(task.lon, task.lat, radius * 0.75, task.place_type)
+        task_for_center = TaskDefinition(task.lon, task.lat, radius * 0.75, task.place_type, parent=task.task_id)
 
         return [
             TaskDefinition(
                 lon=pt.x(),
                 lat=pt.y(),
                 radius=radius,
-                place_type=task.place_type
+                place_type=task.place_type,
+                parent=task.task_id
             ) for pt in densified_wgs   # array of QgsPointXYs
         ] + [task_for_center]
 
-
-def __buffer_intersects(point: [QgsPoint, QgsPointXY], polygon: QgsGeometry, buffer_by: float) -> bool:
-
-    assert buffer_by > 0, f"buffer distance must be greater than zero!"
-
-    if isinstance(point, QgsPoint):
-        point_as_geom = QgsGeometry.fromPointXY(QgsPointXY(point.x(), point.y()))
-    elif isinstance(point, QgsPointXY):
-        point_as_geom = QgsGeometry.fromPointXY(point)
-    else:
-        raise Exception(f"unexpected type {type(point)}")
-
-    if point_as_geom.intersects(polygon):
-        # first, check if point itself intersects the polygon
-        return True
-    else:
-        # if not, check with buffer
-        buff = point_as_geom.buffer(distance=buffer_by, segments=36)
-        return buff.intersects(polygon) or buff.overlaps(polygon)   # return True if overlaps
+    def densify_many(self, tasks: List[TaskDefinition]) -> List[List[TaskDefinition]]:
+        return [self.densify(t) for t in tasks]
 
 
 def __assert_polygon(polygon: QgsGeometry):
@@ -93,15 +80,26 @@ def __assert_polygon(polygon: QgsGeometry):
     assert polygon.area() > 0, r"received polygon with zero area!"
 
 
-def make_grid(polygon: QgsGeometry, spacing: float, metric_epsg: int) -> List[QgsPoint]:
+def polygon_rings(polygon: QgsGeometry) -> List[np.ndarray]:
+
+    """ Exterior and interior rings of a (multi)polygon as closed (n, 2) coordinate arrays. """
+
+    parts = polygon.asMultiPolygon() if polygon.isMultipart() else [polygon.asPolygon()]
+    return [np.array([(pt.x(), pt.y()) for pt in ring]) for part in parts for ring in part]
+
+
+def make_grid(polygon: QgsGeometry, spacing: float, metric_epsg: int,
+              processes: int = config.GRID_PROCESSES, lattice: str = config.GRID_LATTICE) -> List[QgsPointXY]:
 
     """
 
     Helps create initial grid
 
     :param polygon:     Valid singlepart polygon as QgsGeometry in WGS 84 CRS.
-    :param spacing:
-    :return:
+    :param spacing:     Distance between neighbouring grid points in meters of the metric CRS.
+    :param processes:   Lattice rows are split between this many processes, worth it for country-sized AOIs.
+    :param lattice:     "square" or "hex", see geometries.vectorized.lattice_spacing() for matching spacing.
+    :return:            Grid points within 1.25 * spacing of the polygon, in WGS 84.
     """
 
     assert metric_epsg > 0, f"invalid EPSG code {metric_epsg}"
@@ -114,6 +112,7 @@ def make_grid(polygon: QgsGeometry, spacing: float, metric_epsg: int) -> List[Qg
     )
 
     __assert_polygon(polygon)
+    polygon = QgsGeometry(polygon)      # copy, the caller's polygon stays in WGS 84
     polygon.transform(transformer, QgsCoordinateTransform.ForwardTransform)   # inplace
 
     # set bounds
@@ -121,20 +120,21 @@ def make_grid(polygon: QgsGeometry, spacing: float, metric_epsg: int) -> List[Qg
     xmin, xmax, ymin, ymax = bbox.xMinimum(), bbox.xMaximum(), bbox.yMinimum(), bbox.yMaximum()
 
     # calculate grid
-    n_rows = math.ceil((xmax - xmin) // spacing)
+    row_spacing, odd_row_shift = lattice_rows(spacing, lattice)
+    n_rows = math.ceil((ymax - ymin) / row_spacing)
     n_columns = math.ceil((xmax - xmin) / spacing)
 
     if n_rows == 0 or n_columns == 0:
         raise Exception(
             f"cannot create grid with provided parameters: \n"
-            f"\t\tdelta X = {xmax - xmin:.1f}, delta Y = {xmax - xmin:.1f}, spacing = {spacing:.1f}, "
+            f"\t\tdelta X = {xmax - xmin:.1f}, delta Y = {ymax - ymin:.1f}, spacing = {spacing:.1f}, "
             f"shape {n_rows} x {n_columns}"
         )
 
     elif n_rows < MIN_DIMENSION or n_columns < MIN_DIMENSION:
         print(
             f"WARN: creating grid of potentially unwanted shape {n_rows} x {n_columns}.\n"
-            f"\t\tdelta X = {xmax - xmin:.1f}, delta Y = {xmax - xmin:.1f}, spacing = {spacing:.1f}"
+            f"\t\tdelta X = {xmax - xmin:.1f}, delta Y = {ymax - ymin:.1f}, spacing = {spacing:.1f}"
         )
 
     else:
@@ -142,27 +142,47 @@ def make_grid(polygon: QgsGeometry, spacing: float, metric_epsg: int) -> List[Qg
             f"WARN: creating grid with rows x columns = {n_rows} x {n_columns}"
         )
 
-    x_columns = [xmin + spacing * i for i in range(0, n_columns + 1)]   # make a little extra
-    y_rows = [ymin + spacing * i for i in range(0, n_rows + 1)]         # make a little extra
+    # a point is kept when within 1.25 * spacing of the polygon, i.e. inside the polygon buffered once by that
+    rings = polygon_rings(polygon.buffer(distance=spacing * 1.25, segments=36))
 
-    entire_grid = [QgsPoint(*xy) for xy in itertools.product(x_columns, y_rows)]
-    points_within = [pt for pt in entire_grid if __buffer_intersects(pt, polygon, buffer_by=spacing*1.25)]
+    n_rows, n_columns = n_rows + 1, n_columns + 1     # make a little extra
+    processes = max(1, min(processes, n_rows))
+    chunk = math.ceil(n_rows / processes)
+    chunks = [(rings, xmin, ymin, spacing, n_columns, start, min(start + chunk, n_rows), row_spacing, odd_row_shift)
+              for start in range(0, n_rows, chunk)]
 
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            selected = list(pool.map(lattice_in_polygon, *zip(*chunks)))
+    else:
+        selected = [lattice_in_polygon(*args) for args in chunks]
+
+    xs = np.concatenate([x for x, _ in selected])
+    ys = np.concatenate([y for _, y in selected])
+
+    print(
+        f"INFO: total {len(xs)} points selected out of "
+        f"the original {lattice} grid of {n_rows * n_columns} points with spacing = {spacing:.1f} m")
+
+    # circles just covering the plane with this lattice: radius is the circumradius of its cells
+    radius = spacing / lattice_spacing(1, lattice)
+    achieved = len(xs) * math.pi * radius ** 2 / polygon.area()
+    square_seeds = len(xs) * covering_density("square") / covering_density(lattice)
     print(
-        f"INFO: total {len(points_within)} points selected out of "
-        f"the original grid of {len(entire_grid)} points with spacing = {spacing:.1f} m")
+        f"INFO: covering density {achieved:.2f} over the AOI for radius {radius:.1f} m "
+        f"(lattice {covering_density(lattice):.3f}, square {covering_density('square'):.3f}), "
+        f"~{square_seeds:.0f} seeds on a square grid, {1 - len(xs) / square_seeds:.0%} fewer initial requests")
 
-    # project points back to WGS 84
-    points_within_wgs84 = []
-    for p in points_within:
-        geom = QgsGeometry(p)
-        geom.transform(transformer, QgsCoordinateTransform.ReverseTransform)
-        points_within_wgs84.append(geom.asPoint())
-        # p.transform(transformer, QgsCoordinateTransform.ReverseTransform)  # inplace
+    if len(xs) == 0:
+        return []
+
+    # project points back to WGS 84, all at once as a multipoint
+    points = QgsGeometry.fromMultiPointXY([QgsPointXY(x, y) for x, y in zip(xs.tolist(), ys.tolist())])
+    points.transform(transformer, QgsCoordinateTransform.ReverseTransform)
 
     del transformer
 
-    return points_within_wgs84
+    return points.asMultiPoint()
 
 
 def get_aoi_polygon(layer_uri: str):
@@ -182,3 +202,86 @@ def get_aoi_polygon(layer_uri: str):
     __assert_polygon(aoi)       # what about multipolygon here ?
 
     return aoi
+
+
+def get_density_points(layer_uri: str) -> List[QgsPointXY]:
+
+    """ Points of a density prior layer, centroids for lines and polygons. Layer must be in WGS 84. """
+
+    assert layer_uri, 'invalid layer uri'
+    lyr = QgsVectorLayer(layer_uri, 'density prior', 'ogr')
+
+    assert lyr.isValid(), "layer is invalid!"
+    assert lyr.crs().authid().lower() == "epsg:4326", f'layer CRS must be WGS 84 (EPSG:4326), received {lyr.crs().authid()}'
+
+    points = []
+    for ft in lyr.getFeatures():
+        geom = ft.geometry()
+        if geom.isNull() or geom.isEmpty():
+            continue
+        points.append(geom.asPoint() if geom.type() == QgsWkbTypes.PointGeometry else geom.centroid().asPoint())
+
+    print(f"INFO: {len(points)} density prior features read from {layer_uri}")
+    return points
+
+
+def seed_radii(seeds: List[QgsPointXY], polygon: QgsGeometry, radius: float, density_points: List[QgsPointXY],
+               metric_epsg: int, scale: float, target: float, min_radius: float) -> List[Tuple[QgsPointXY, float]]:
+
+    """
+    Starting radius per grid cell from a density prior. Seeds are centres of square cells with circumscribed
+    circles of the given radius (see make_grid spacing). A cell where more than target results are expected
+    (scale results per prior feature) is split into 4 quadrants of half the radius, down to min_radius,
+    so that dense areas start near leaf size and sparse ones keep large radii. Quadrants whose circle
+    does not reach the polygon are dropped. Returns WGS 84 centres and radii.
+    """
+
+    assert 0 < min_radius <= radius, f"invalid radii: min = {min_radius}, initial = {radius}"
+    assert scale > 0 and target > 0, f"invalid density parameters: scale = {scale}, target = {target}"
+
+    transformer = QgsCoordinateTransform(
+        QgsCoordinateReferenceSystem.fromEpsgId(4326),
+        QgsCoordinateReferenceSystem.fromEpsgId(metric_epsg),
+        QgsProject.instance()
+    )
+
+    polygon_metric = QgsGeometry(polygon)       # keep the input as is
+    polygon_metric.transform(transformer, QgsCoordinateTransform.ForwardTransform)
+
+    # bucket prior points on a grid of the smallest cell size
+    cell = min_radius * 2
+    buckets: Dict[Tuple[int, int], List[Tuple[float, float]]] = {}
+    for pt in density_points:
+        m = transformer.transform(pt)
+        buckets.setdefault((math.floor(m.x() / cell), math.floor(m.y() / cell)), []).append((m.x(), m.y()))
+
+    def expected_results(x: float, y: float, r: float) -> float:
+        n = 0
+        for i in range(math.floor((x - r) / cell), math.floor((x + r) / cell) + 1):
+            for j in range(math.floor((y - r) / cell), math.floor((y + r) / cell) + 1):
+                n += sum(1 for px, py in buckets.get((i, j), ()) if (px - x) ** 2 + (py - y) ** 2 <= r * r)
+        return n * scale
+
+    def split(x: float, y: float, r: float) -> List[Tuple[float, float, float]]:
+        if r / 2 < min_radius or expected_results(x, y, r) <= target:
+            return [(x, y, r)]
+
+        quarter = r * math.sqrt(2) / 4     # cell side is r * sqrt(2), quadrant centres are a quarter side away
+        children = []
+        for dx, dy in itertools.product((-quarter, quarter), (-quarter, quarter)):
+            centre = QgsGeometry.fromPointXY(QgsPointXY(x + dx, y + dy))
+            if centre.distance(polygon_metric) <= r / 2:
+                children.extend(split(x + dx, y + dy, r / 2))
+        return children
+
+    seeded = []
+    for pt in seeds:
+        m = transformer.transform(pt)
+        for x, y, r in split(m.x(), m.y(), radius):
+            seeded.append((transformer.transform(QgsPointXY(x, y), QgsCoordinateTransform.ReverseTransform), r))
+
+    radii = sorted({r for _, r in seeded}, reverse=True)
+    print(f"INFO: density prior turned {len(seeds)} seeds into {len(seeded)}. Radii: " +
+          ", ".join(f"{r:.0f} m x {sum(1 for _, x in seeded if x == r)}" for r in radii))
+
+    return seeded
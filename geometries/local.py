@@ -0,0 +1,25 @@
+import math
+from typing import Tuple
+
+EARTH_RADIUS = 6371008.8    # meters, mean radius
+
+
+def distance(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+
+    """ Meters between two WGS 84 points, equirectangular approximation. Accurate at search radius scale. """
+
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS * math.hypot(x, y)
+
+
+def offset(lon: float, lat: float, dx: float, dy: float) -> Tuple[float, float]:
+
+    """ WGS 84 point moved by dx meters east and dy meters north, local tangent plane. """
+
+    return (lon + math.degrees(dx / (EARTH_RADIUS * math.cos(math.radians(lat)))),
+            lat + math.degrees(dy / EARTH_RADIUS))
+
+
+def degrees_of_latitude(meters: float) -> float:
+    return math.degrees(meters / EARTH_RADIUS)
@@ -0,0 +1,314 @@
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import config
+from exceptions import SearchRecursionError
+from geometries.local import EARTH_RADIUS
+from tasks import TaskDefinition
+
+# WGS 84 ellipsoid
+SEMI_MAJOR_AXIS = 6378137.0     # meters
+ECCENTRICITY_SQ = 0.00669437999014
+UTM_SCALE = 0.9996      # scale factor on the central meridian
+
+
+def utm_central_meridian(epsg: int) -> Optional[float]:
+
+    """ Central meridian of a WGS 84 / UTM zone (EPSG 326zz, 327zz), None for other CRS. """
+
+    if 32601 <= epsg <= 32660 or 32701 <= epsg <= 32760:
+        return (epsg % 100) * 6 - 183
+    return None
+
+
+def radii_of_curvature(lats: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+
+    """ Meridional and prime vertical radii of curvature at latitudes in radians, meters. """
+
+    w = 1 - ECCENTRICITY_SQ * np.sin(lats) ** 2
+    return SEMI_MAJOR_AXIS * (1 - ECCENTRICITY_SQ) / w ** 1.5, SEMI_MAJOR_AXIS / np.sqrt(w)
+
+
+def project(lons: np.ndarray, lats: np.ndarray, distances: np.ndarray, azimuths: np.ndarray,
+            central_meridian: float = None) -> Tuple[np.ndarray, np.ndarray]:
+
+    """
+    WGS 84 points moved by distances at azimuths (degrees clockwise from north) on the local tangent plane.
+    Arguments are broadcast against each other. With a UTM central meridian, distances and azimuths are
+    taken in grid units and bearings like QgsPointXY.project() in that CRS: they are corrected for
+    meridian convergence and point scale, so results match a round trip through the metric CRS.
+    """
+
+    phi = np.radians(lats)
+    azimuths = np.radians(azimuths)
+
+    if central_meridian is not None:
+        d_lambda = np.radians(lons - central_meridian)
+        azimuths = azimuths + np.arctan(np.tan(d_lambda) * np.sin(phi))     # grid to true bearing
+        distances = distances * np.sqrt(1 - (np.cos(phi) * np.sin(d_lambda)) ** 2) / UTM_SCALE
+
+    dx, dy = distances * np.sin(azimuths), distances * np.cos(azimuths)
+
+    # radii of curvature at the mid latitude of the offset
+    m, _ = radii_of_curvature(phi)
+    mid = phi + dy / m / 2
+    m, n = radii_of_curvature(mid)
+
+    return lons + np.degrees(dx / (n * np.cos(mid))), lats + np.degrees(dy / m)
+
+
+def project_point(lon: float, lat: float, distance: float, azimuth: float,
+                  central_meridian: float = None) -> Tuple[float, float]:
+
+    """ Scalar project(), NumPy call overhead dominates for a single point. """
+
+    phi = math.radians(lat)
+    azimuth = math.radians(azimuth)
+
+    if central_meridian is not None:
+        d_lambda = math.radians(lon - central_meridian)
+        azimuth += math.atan(math.tan(d_lambda) * math.sin(phi))
+        distance *= math.sqrt(1 - (math.cos(phi) * math.sin(d_lambda)) ** 2) / UTM_SCALE
+
+    dx, dy = distance * math.sin(azimuth), distance * math.cos(azimuth)
+
+    w = 1 - ECCENTRICITY_SQ * math.sin(phi) ** 2
+    mid = phi + dy * w ** 1.5 / (SEMI_MAJOR_AXIS * (1 - ECCENTRICITY_SQ)) / 2
+    w = 1 - ECCENTRICITY_SQ * math.sin(mid) ** 2
+    m, n = SEMI_MAJOR_AXIS * (1 - ECCENTRICITY_SQ) / w ** 1.5, SEMI_MAJOR_AXIS / math.sqrt(w)
+
+    return lon + math.degrees(dx / (n * math.cos(mid))), lat + math.degrees(dy / m)
+
+
+def make_children(tasks: Sequence[TaskDefinition], ring_lons: np.ndarray, ring_lats: np.ndarray) \
+        -> List[List[TaskDefinition]]:
+
+    """ Child tasks from (n_tasks, n_angles) arrays of ring points: ring children first, the centre last. """
+
+    children = []
+    for task, t_lons, t_lats in zip(tasks, ring_lons.tolist(), ring_lats.tolist()):
+        radius = task.radius / 2
+        children.append(
+            [TaskDefinition(lon=lon, lat=lat, radius=radius, place_type=task.place_type, parent=task.task_id)
+             for lon, lat in zip(t_lons, t_lats)] +
+            [TaskDefinition(task.lon, task.lat, radius * 0.75, task.place_type, parent=task.task_id)]    # centre
+        )
+
+    return children
+
+
+class VectorDensifier(object):
+
+    """
+    Same children as geomworks.Densifier, without QGIS: six ring points at 0.6 of the parent radius plus
+    the centre, computed with NumPy for any number of tasks at once. Nothing to set up per process.
+    """
+
+    DENSIFY_ANGLES: np.ndarray = np.array([30, 90, 150, 210, 270, 330], dtype=float)  # degrees
+    __angles: List[float] = DENSIFY_ANGLES.tolist()
+
+    def __init__(self, metric_epsg: int = config.METRIC_CRS_EPSG):
+
+        assert metric_epsg > 0 and isinstance(metric_epsg, int), \
+            f"invalid value {metric_epsg} for metric coordinate system EPSG code"
+
+        # ring points follow grid bearings of the metric CRS like geomworks.Densifier, see project()
+        self.central_meridian = utm_central_meridian(metric_epsg)
+
+    def densify_many(self, tasks: Sequence[TaskDefinition]) -> List[List[TaskDefinition]]:
+
+        """ Children of each task, in the order of geomworks.Densifier.densify(). """
+
+        if not tasks:
+            return []
+
+        radii = np.array([t.radius for t in tasks], dtype=float)
+        if radii.min() / 2 <= config.MIN_ALLOWED_RADIUS:
+            raise SearchRecursionError
+
+        lons = np.array([t.lon for t in tasks], dtype=float)[:, np.newaxis]
+        lats = np.array([t.lat for t in tasks], dtype=float)[:, np.newaxis]
+
+        # cut it as 3:2 ratio
+        ring_lons, ring_lats = project(lons, lats, radii[:, np.newaxis] * 0.6, self.DENSIFY_ANGLES,
+                                       central_meridian=self.central_meridian)
+
+        return make_children(tasks, ring_lons, ring_lats)
+
+    def densify(self, task: TaskDefinition) -> List[TaskDefinition]:
+
+        """ Children of a single task, same as densify_many([task])[0] without NumPy overhead. """
+
+        radius = task.radius / 2
+        if radius <= config.MIN_ALLOWED_RADIUS:
+            raise SearchRecursionError
+
+        ring = [project_point(task.lon, task.lat, task.radius * 0.6, a, central_meridian=self.central_meridian)
+                for a in self.__angles]
+
+        return [TaskDefinition(lon=lon, lat=lat, radius=radius, place_type=task.place_type, parent=task.task_id)
+                for lon, lat in ring] + \
+            [TaskDefinition(task.lon, task.lat, radius * 0.75, task.place_type, parent=task.task_id)]
+
+
+LATTICES = ("square", "hex")
+
+
+def lattice_spacing(radius: float, lattice: str) -> float:
+
+    """ Distance between neighbouring seeds for search circles of the radius to cover the plane. """
+
+    if lattice == "square":
+        return radius * 2 / math.sqrt(2)
+    elif lattice == "hex":
+        return radius * math.sqrt(3)
+    else:
+        raise Exception(f"unknown grid lattice \"{lattice}\", see config to fix")
+
+
+def lattice_rows(spacing: float, lattice: str) -> Tuple[float, float]:
+
+    """ Distance between lattice rows and the shift of odd rows along them. """
+
+    if lattice == "square":
+        return spacing, 0.0
+    elif lattice == "hex":
+        return spacing * math.sqrt(3) / 2, spacing / 2
+    else:
+        raise Exception(f"unknown grid lattice \"{lattice}\", see config to fix")
+
+
+def covering_density(lattice: str) -> float:
+
+    """ Circle area per lattice cell, i.e. how many seed circles cover an average point: 1.571 square, 1.209 hex. """
+
+    spacing = lattice_spacing(1, lattice)
+    row_spacing, _ = lattice_rows(spacing, lattice)
+    return math.pi / (spacing * row_spacing)
+
+
+def lattice_in_polygon(rings: List[np.ndarray], x0: float, y0: float, spacing: float, n_columns: int,
+                       row_start: int, row_stop: int, row_spacing: float = None, odd_row_shift: float = 0.0) \
+        -> Tuple[np.ndarray, np.ndarray]:
+
+    """
+    Points (x0 + i * spacing + shift, y0 + j * row_spacing), 0 <= i < n_columns, row_start <= j < row_stop,
+    with odd rows shifted by odd_row_shift, inside the polygon given by its rings as (n, 2) coordinate
+    arrays, holes included (even-odd rule). Row spacing defaults to spacing, a square lattice.
+    Scanline: each lattice row is cut by the ring edges and the points between pairs of crossings are
+    kept, so the work grows with rows and edges crossed instead of points times vertices.
+    """
+
+    row_spacing = row_spacing or spacing
+
+    x1 = np.concatenate([r[:-1, 0] for r in rings])
+    y1 = np.concatenate([r[:-1, 1] for r in rings])
+    x2 = np.concatenate([r[1:, 0] for r in rings])
+    y2 = np.concatenate([r[1:, 1] for r in rings])
+
+    # an edge crosses row j when exactly one of its ends has ceil((y - y0) / row_spacing) <= j,
+    # so every closed ring crosses every row an even number of times
+    lo = np.ceil((np.minimum(y1, y2) - y0) / row_spacing)
+    hi = np.ceil((np.maximum(y1, y2) - y0) / row_spacing)
+    first = np.maximum(lo, row_start).astype(np.int64)
+    counts = np.clip(np.minimum(hi, row_stop) - first, 0, None).astype(np.int64)
+
+    edges = np.repeat(np.arange(len(x1)), counts)
+    rows = first[edges] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    y = y0 + rows * row_spacing
+    x = x1[edges] + (y - y1[edges]) * (x2[edges] - x1[edges]) / (y2[edges] - y1[edges])
+
+    order = np.lexsort((x, rows))
+    rows, x = rows[order][0::2], x[order]
+    x_in, x_out = x[0::2], x[1::2]
+
+    # lattice columns between each pair of crossings
+    row_x0 = x0 + (rows % 2) * odd_row_shift
+    c_first = np.clip(np.ceil((x_in - row_x0) / spacing), 0, n_columns).astype(np.int64)
+    c_counts = np.clip(np.clip(np.floor((x_out - row_x0) / spacing) + 1, 0, n_columns) - c_first, 0, None)
+    c_counts = c_counts.astype(np.int64)
+
+    spans = np.repeat(np.arange(len(c_first)), c_counts)
+    columns = c_first[spans] + np.arange(c_counts.sum()) - np.repeat(np.cumsum(c_counts) - c_counts, c_counts)
+
+    return row_x0[spans] + columns * spacing, y0 + rows[spans] * row_spacing
+
+
+class PreparedPolygon(object):
+
+    """
+    WGS 84 polygon indexed for circle tests without QGIS. Ring edges are bucketed into latitude bands for
+    point in polygon tests and into grid cells for distances to the boundary, which are measured on the
+    local tangent plane of the tested point. Plain arrays and dicts, so collectors get it pickled.
+    """
+
+    def __init__(self, rings: List[np.ndarray], cells: int = 64):
+
+        """ :param rings:   exterior and interior rings as closed (n, 2) arrays of lon, lat. """
+
+        assert rings and all(len(r) >= 4 for r in rings), "polygon rings must be closed and have 3+ vertices"
+
+        self.edges = np.concatenate([np.hstack([r[:-1], r[1:]]) for r in rings])    # lon1, lat1, lon2, lat2
+        x1, y1, x2, y2 = self.edges.T
+
+        self.x0, self.y0 = min(x1.min(), x2.min()), min(y1.min(), y2.min())
+        extent = max(max(x1.max(), x2.max()) - self.x0, max(y1.max(), y2.max()) - self.y0)
+        self.cell = max(extent / cells, 1e-4)     # degrees
+
+        i0, i1 = self.__index(np.minimum(x1, x2), self.x0), self.__index(np.maximum(x1, x2), self.x0)
+        j0, j1 = self.__index(np.minimum(y1, y2), self.y0), self.__index(np.maximum(y1, y2), self.y0)
+
+        bands: Dict[int, List[int]] = {}
+        buckets: Dict[Tuple[int, int], List[int]] = {}
+        for e, (a0, a1, b0, b1) in enumerate(zip(i0.tolist(), i1.tolist(), j0.tolist(), j1.tolist())):
+            for j in range(b0, b1 + 1):
+                bands.setdefault(j, []).append(e)
+                for i in range(a0, a1 + 1):
+                    buckets.setdefault((i, j), []).append(e)
+
+        self.bands = {j: np.array(e) for j, e in bands.items()}
+        self.buckets = {c: np.array(e) for c, e in buckets.items()}
+
+    def __index(self, values, origin: float):
+        return np.floor((values - origin) / self.cell).astype(np.int64)
+
+    def contains(self, lon: float, lat: float) -> bool:
+
+        """ Point in polygon, even-odd rule over the edges of the point's latitude band. """
+
+        edges = self.bands.get(int(math.floor((lat - self.y0) / self.cell)))
+        if edges is None:
+            return False
+
+        x1, y1, x2, y2 = self.edges[edges].T
+        crossing = (y1 <= lat) != (y2 <= lat)
+        x1, y1, x2, y2 = x1[crossing], y1[crossing], x2[crossing], y2[crossing]
+
+        return bool(np.count_nonzero(lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1)) % 2)
+
+    def boundary_distance(self, lon: float, lat: float, within: float) -> float:
+
+        """ Meters to the nearest edge, only edges in cells within that many meters are looked at. """
+
+        k_lat = math.radians(1) * EARTH_RADIUS      # meters per degree
+        k_lon = k_lat * math.cos(math.radians(lat))
+        d_lat, d_lon = within / k_lat, within / max(k_lon, 1e-9)
+
+        i0, i1 = self.__index(np.array([lon - d_lon, lon + d_lon]), self.x0).tolist()
+        j0, j1 = self.__index(np.array([lat - d_lat, lat + d_lat]), self.y0).tolist()
+        found = [self.buckets[(i, j)] for i in range(i0, i1 + 1) for j in range(j0, j1 + 1) if (i, j) in self.buckets]
+        if not found:
+            return math.inf
+
+        x1, y1, x2, y2 = self.edges[np.unique(np.concatenate(found))].T
+        ax, ay = (x1 - lon) * k_lon, (y1 - lat) * k_lat
+        bx, by = (x2 - lon) * k_lon - ax, (y2 - lat) * k_lat - ay
+
+        t = np.clip(-(ax * bx + ay * by) / np.maximum(bx ** 2 + by ** 2, 1e-12), 0, 1)
+        return float(np.hypot(ax + t * bx, ay + t * by).min())
+
+    def intersects_circle(self, lon: float, lat: float, radius: float) -> bool:
+        return self.contains(lon, lat) or self.boundary_distance(lon, lat, within=radius) <= radius
@@ -6,7 +6,6 @@ import time
 from queue import Empty
 
 import config
-from dataclass import PoiData
 
 
 class RawResponseWriter(mp.Process):
@@ -34,10 +33,10 @@ class RawResponseWriter(mp.Process):
         with self.__printlock:
             print(*args, **kwargs)
 
-    def write_poi_data(self, poi: PoiData):
+    def write_poi_data(self, place_id: str, raw: bytes):
 
-        fp = self.data_dir + os.sep + poi.place_id + self.file_extension  # ext starts with a dot
-        stringified: str = json.dumps(poi.json, indent=4)  # format JSON here
+        fp = self.data_dir + os.sep + place_id + self.file_extension  # ext starts with a dot
+        stringified: str = json.dumps(json.loads(raw), indent=4)  # format JSON here
 
         with open(fp, 'w', encoding=self.file_encoding) as f:
             f.write(stringified)
@@ -59,16 +58,17 @@ class RawResponseWriter(mp.Process):
             except Empty:
                 continue
 
-            # terminate process if poison pill found
-            if not isinstance(task, PoiData):
+            # terminate process if poison pill found, POIs of a page come as [(place_id, raw JSON bytes), ...]
+            if not isinstance(task, list):
                 self.print(f"{self.name} received poison pill")
                 done = True
                 break
 
-            self.write_poi_data(task)
+            for place_id, raw in task:
+                self.write_poi_data(place_id=place_id, raw=raw)
 
-            if self.count % self.__info_each_n == 0:
-                self.print(f"{self.name}: data for {self.count} POIs were written as JSONs.")
+                if self.count % self.__info_each_n == 0:
+                    self.print(f"{self.name}: data for {self.count} POIs were written as JSONs.")
 
             # exit if waiting for new task for too long
             waiting_uninterrupted = time.time() - last_task
@@ -0,0 +1,12 @@
+import json
+
+# use the fastest JSON decoder available
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        json_loads = ujson.loads
+    except ImportError:
+        json_loads = json.loads
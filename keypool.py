@@ -0,0 +1,135 @@
+import multiprocessing as mp
+from typing import Dict, List
+
+import config
+from exceptions import NoKeysLeftException
+from ratelimit import TokenBucketLimiter
+
+# key states
+ACTIVE = 0
+EXHAUSTED = 1       # OVER_QUERY_LIMIT received or budget used up
+DENIED = 2          # REQUEST_DENIED received
+
+STATE_NAMES = {ACTIVE: "active", EXHAUSTED: "exhausted", DENIED: "denied"}
+
+LATENCY_SMOOTHING = 0.2     # weight of the latest request in moving averages
+UNMEASURED = 0.0            # latency of a key before its first request, seeded from that request
+
+
+class KeyPool(object):
+
+    """
+    API keys leased per request to whichever collector is free. Lives in shared memory like the limiter.
+    Keys are ranked by seconds until a limiter token is available, then by requests in flight. Latency and error
+    rate only break ties, keys not used yet come before measured ones.
+    Exhausted and denied keys are rotated away from; remaining budget comes from tracker.json counts.
+    """
+
+    def __init__(self, keys: List[str], limiter: TokenBucketLimiter, previous_requests: Dict[str, int] = None,
+                 max_requests_per_key: int = config.MAX_REQUESTS_PER_KEY):
+
+        assert keys, "no keys for the pool!"
+
+        previous_requests = previous_requests if previous_requests else {}
+
+        self.keys = list(keys)
+        self.limiter = limiter
+        self.max_requests_per_key = max_requests_per_key
+
+        # all arrays are guarded by the same lock
+        self.__lock = mp.Lock()
+        self.__state = mp.Array('i', [ACTIVE] * len(keys), lock=False)
+        self.__leases = mp.Array('i', [0] * len(keys), lock=False)      # requests in flight
+        self.__leased = mp.Array('l', [0] * len(keys), lock=False)      # leases in this session
+        self.__requests = mp.Array('l', [previous_requests.get(k, 0) for k in keys], lock=False)    # overall
+        self.__latency = mp.Array('d', [UNMEASURED] * len(keys), lock=False)    # seconds, moving average
+        self.__error_rate = mp.Array('d', [0.0] * len(keys), lock=False)
+
+        for i in range(len(keys)):
+            if not self.__has_budget(i):
+                self.__state[i] = EXHAUSTED
+
+    def __has_budget(self, i: int) -> bool:
+        return self.max_requests_per_key <= 0 or self.__requests[i] < self.max_requests_per_key
+
+    def __rank(self, i: int) -> tuple:
+        seconds_per_request = self.__latency[i] / max(0.05, 1 - self.__error_rate[i])
+        return self.limiter.peek(self.keys[i]), self.__leases[i], seconds_per_request, self.__leased[i]
+
+    def lease(self, preferred: str = None) -> str:
+
+        """ Healthiest key with budget left, or the preferred one if active. Must be given back with release(). """
+
+        with self.__lock:
+            candidates = [i for i in range(len(self.keys)) if self.__state[i] == ACTIVE]
+            if not candidates:
+                raise NoKeysLeftException("all API keys are exhausted or denied")
+
+            if preferred is not None and self.keys.index(preferred) in candidates:
+                best = self.keys.index(preferred)
+            else:
+                best = min(candidates, key=self.__rank)
+            self.__leases[best] += 1
+            self.__leased[best] += 1
+
+        return self.keys[best]
+
+    def release(self, key: str, latency: float = None, error: bool = False, charged: bool = True):
+
+        """ Gives the key back and records how the request went. """
+
+        i = self.keys.index(key)
+
+        with self.__lock:
+            self.__leases[i] = max(0, self.__leases[i] - 1)
+
+            if charged:
+                self.__requests[i] += 1
+                if not self.__has_budget(i):
+                    self.__state[i] = EXHAUSTED
+
+            if latency is not None and self.__latency[i] == UNMEASURED:
+                self.__latency[i] = latency
+            elif latency is not None:
+                self.__latency[i] += LATENCY_SMOOTHING * (latency - self.__latency[i])
+            self.__error_rate[i] += LATENCY_SMOOTHING * ((1.0 if error else 0.0) - self.__error_rate[i])
+
+    def charge(self, key: str):
+
+        """ Counts an extra request (retry or hedge) made under an existing lease. """
+
+        i = self.keys.index(key)
+
+        with self.__lock:
+            self.__requests[i] += 1
+            if not self.__has_budget(i):
+                self.__state[i] = EXHAUSTED
+
+    def mark_exhausted(self, key: str):
+        with self.__lock:
+            self.__state[self.keys.index(key)] = EXHAUSTED
+
+    def mark_denied(self, key: str):
+        with self.__lock:
+            self.__state[self.keys.index(key)] = DENIED
+
+    def is_active(self, key: str) -> bool:
+        return self.__state[self.keys.index(key)] == ACTIVE
+
+    def active_count(self) -> int:
+        return len([s for s in self.__state if s == ACTIVE])
+
+    def request_counts(self) -> Dict[str, int]:
+
+        """ Overall requests per key, as stored in tracker.json. """
+
+        with self.__lock:
+            return {k: self.__requests[i] for i, k in enumerate(self.keys)}
+
+    def summary(self) -> str:
+        with self.__lock:
+            return " | ".join(
+                f"{k[-6:]}: {STATE_NAMES[self.__state[i]]}, {self.__requests[i]} req, "
+                f"{self.__latency[i] * 1000:.0f} ms, {self.__error_rate[i] * 100:.0f}% err"
+                for i, k in enumerate(self.keys)
+            )
@@ -2,18 +2,23 @@ import multiprocessing as mp
 import sqlite3
 import sys
 import time
-from typing import List
+from typing import Dict, List, Optional
 
 import config
 import resume
 import timing
-from api import get_api_keys
+from api import get_api_keys, load_tracker
+from async_workers import AsyncGoogleCollector
+from coverage import CoverageIndex
+from dedup import DuplicateIndex
 from db.connect import make_db_connection
 from db.writer import DatabaseWriter
 from db import expressions
-from geometries.geomworks import make_grid, get_aoi_polygon
+from geometries.vectorized import PreparedPolygon, lattice_spacing
 from json_writer import RawResponseWriter
 from placetypes import get_search_types, get_valid_types
+from keypool import KeyPool
+from ratelimit import TokenBucketLimiter
 from tasks import TaskDefinition
 from workers import GoogleWorker
 
@@ -26,25 +31,78 @@ def prepare_database(cursor: sqlite3.Cursor):
     # drop previous (IF EXISTS statements)
     cursor.execute(expressions.DROP_SUCCESS)
     cursor.execute(expressions.DROP_JOBS)
+    cursor.execute(expressions.DROP_PROGRESS)
 
     # create new
     cursor.execute(expressions.CREATE_POI_TABLE)
     cursor.execute(expressions.CREATE_SUCCESS_TABLE)
     cursor.execute(expressions.CREATE_JOBS_TABLE)
+    cursor.execute(expressions.CREATE_PROGRESS_TABLE)
 
 
-def make_initial_tasks() -> List[TaskDefinition]:
+def read_aoi_polygon() -> "QgsGeometry":
 
-    """ Gets AOI polygon from specified layer, makes initial grid and creates initial tasks."""
+    """ AOI polygon from the layer in config, read once for the initial grid and the collectors. """
+
+    from geometries.geomworks import get_aoi_polygon    # loads QGIS
 
     assert config.AOI_LAYER_URI and isinstance(config.AOI_LAYER_URI, str), \
         f'invalid layer URI {config.AOI_LAYER_URI}, see config to fix'
 
+    return get_aoi_polygon(config.AOI_LAYER_URI)
+
+
+def make_aoi(aoi_polygon: "QgsGeometry" = None) -> PreparedPolygon:
+
+    """ AOI polygon indexed for the collectors, which check child tasks against it without QGIS. """
+
+    from geometries.geomworks import polygon_rings      # loads QGIS
+
+    return PreparedPolygon(polygon_rings(aoi_polygon if aoi_polygon is not None else read_aoi_polygon()))
+
+
+def make_initial_tasks(aoi: PreparedPolygon = None, aoi_polygon: "QgsGeometry" = None) -> List[TaskDefinition]:
+
+    """
+    Makes initial grid over the AOI polygon (read from the layer if not given) and creates initial tasks.
+    Seeds whose circle misses the AOI are dropped if it is given.
+    """
+
+    # QGIS is loaded here only, collector processes do without it
+    from geometries.geomworks import make_grid, get_density_points, seed_radii
+
+    # with a density prior, the grid starts coarse and is refined where the prior is dense,
+    # quadtree crawls start coarse and are refined where searches saturate, frontier crawls spread from seeds
+    # (a density prior and quadtree split square cells into quadrants)
+    density_prior = config.DENSITY_LAYER_URI and config.CRAWL_STRATEGY != "frontier"
+    if config.CRAWL_STRATEGY == "frontier":
+        radius, lattice = config.FRONTIER_SEED_RADIUS, config.GRID_LATTICE
+    elif density_prior:
+        radius, lattice = config.DENSITY_MAX_RADIUS, "square"
+    elif config.CRAWL_STRATEGY == "quadtree":
+        radius, lattice = config.QUADTREE_ROOT_RADIUS, "square"
+    else:
+        radius, lattice = config.INITIAL_RADIUS, config.GRID_LATTICE
+
     # calculate spacing
-    spacing = config.INITIAL_RADIUS * 2 / (2 ** 0.5)
+    spacing = lattice_spacing(radius, lattice)
+
+    if aoi_polygon is None:
+        aoi_polygon = read_aoi_polygon()
+    initial_points = make_grid(aoi_polygon, spacing=spacing, metric_epsg=config.METRIC_CRS_EPSG, lattice=lattice)
+
+    if density_prior:
+        seeds = seed_radii(initial_points, polygon=aoi_polygon, radius=radius,
+                           density_points=get_density_points(config.DENSITY_LAYER_URI),
+                           metric_epsg=config.METRIC_CRS_EPSG, scale=config.DENSITY_PRIOR_SCALE,
+                           target=config.DENSITY_TARGET, min_radius=config.DENSITY_MIN_RADIUS)
+    else:
+        seeds = [(pt, radius) for pt in initial_points]
 
-    aoi_polygon = get_aoi_polygon(config.AOI_LAYER_URI)
-    initial_points = make_grid(aoi_polygon, spacing=spacing, metric_epsg=config.METRIC_CRS_EPSG)
+    if aoi is not None:
+        n_seeds = len(seeds)
+        seeds = [(pt, r) for pt, r in seeds if aoi.intersects_circle(pt.x(), pt.y(), r)]
+        print(f"INFO: {n_seeds - len(seeds)} seeds out of {n_seeds} dropped as their circles miss the AOI")
 
     # figure out the types
     all_types = get_valid_types()
@@ -71,12 +129,12 @@ def make_initial_tasks() -> List[TaskDefinition]:
 
     for t in validated_search_types:
         type_tasks = [
-            TaskDefinition(lon=pt.x(), lat=pt.y(), radius=config.INITIAL_RADIUS, place_type=t) for pt in initial_points
+            TaskDefinition(lon=pt.x(), lat=pt.y(), radius=r, place_type=t) for pt, r in seeds
         ]
         initial_tasks.extend(type_tasks)
 
     print(f"INFO: total {len(initial_tasks)} initial search tasks were prepared "
-          f"for {len(validated_search_types)} place types and search radius = {config.INITIAL_RADIUS:.1f} m")
+          f"for {len(validated_search_types)} place types and search radius up to {radius:.1f} m")
 
     return initial_tasks
 
@@ -98,26 +156,35 @@ def restore_tasks_and_places(cursor: sqlite3.Cursor):
         raise Exception(f"cannot restore tasks as table \"{config.POI_TABLE}\" is missing")
 
     else:
+        cursor.execute(expressions.CREATE_PROGRESS_TABLE)     # missing in databases of older versions
         unfinished_tasks = resume.restore_unfinished_tasks(cursor=cursor)
         collected_place_ids = resume.restore_collected_place_ids(cursor=cursor)
 
     return unfinished_tasks, collected_place_ids
 
 
-def main():
+def queue_size(q: mp.Queue) -> Optional[int]:
+    try:
+        return q.qsize()
+    except NotImplementedError:
+        return None     # macOS
 
-    started_prepare = time.time()
 
-    # connection to prepare stuff, either for a clean start or restore prev session data
-    # must be closed before writer thread starts
-    conn = make_db_connection(config.DATABASE)      # creates the database if not exists
-    cursor = conn.cursor()
+def run_session(tasks: List[TaskDefinition], keys: List[str], collected_place_ids: List[str] = None,
+                aoi: PreparedPolygon = None) -> Dict[str, float]:
+
+    """
+    Runs collectors and writers until all tasks are done. Place IDs collected in previous sessions
+    are only given when resuming. Child tasks whose circle misses the AOI are dropped if it is given.
+    Returns timestamps of session stages and the backlog of pages waiting for the database writer
+    while collecting.
+    """
+
+    report = {"started": time.time()}
 
     # queues
     tasks_q = mp.Queue()
-    tasks_for_record_q = mp.Queue()
-    database_q = mp.Queue()
-    complete_q = mp.Queue()
+    database_q = mp.Queue()     # pages of POIs with the tasks they complete, new tasks to record
     raw_json_q = mp.Queue()
 
     # locks
@@ -125,27 +192,11 @@ def main():
     printlock = mp.Lock()
 
     # make writers, but don't launch yet
-    db_writer = DatabaseWriter(db_file=config.DATABASE, poi_q=database_q, tasks_q=tasks_for_record_q,
-                               complete_tasks_q=complete_q, printlock=printlock)
+    db_writer = DatabaseWriter(db_file=config.DATABASE, poi_q=database_q, printlock=printlock)
     raw_writer = RawResponseWriter(poi_q=raw_json_q, printlock=printlock)
 
-    # define typing
-    tasks: List[TaskDefinition]
-    collected_place_ids: List[str]
-
-    if config.RESUME:
-        # pick up where stopped last time
-        tasks, collected_place_ids = restore_tasks_and_places(cursor=cursor)    # unfinished tasks only
+    if collected_place_ids is not None:
         db_writer.set_place_ids(place_ids=collected_place_ids)      # avoid writing duplicates, will check against these
-        db_writer.set_success_ids(["dummy", ])
-
-    else:
-        tables = resume.get_existing_tables(cursor=cursor)
-        if config.POI_TABLE in tables:
-            raise Exception(f"ERROR: table {config.POI_TABLE} already exists. "
-                            f"You must remove it manually or use a different table name")
-        tasks = make_initial_tasks()                        # initial_tasks
-        prepare_database(cursor=cursor)
 
     # fill queue
     for t in tasks:
@@ -154,26 +205,43 @@ def main():
     # also include in all jobs table
     db_writer.set_initial_jobs(jobs=tasks)
 
-    conn.commit()
-    conn.close()    # close connection in this thread
+    # shared by all collectors
+    limiter = TokenBucketLimiter(keys=keys)
+    key_pool = KeyPool(keys=keys, limiter=limiter, previous_requests=load_tracker(lock=writelock))
+    coverage = CoverageIndex(place_types=[t.place_type for t in tasks]) if config.COVERAGE_INDEX else None
+    pruned = mp.Value('l', 0)   # child tasks outside the AOI
+    duplicates = DuplicateIndex(place_types=[t.place_type for t in tasks]) if config.DEDUP_INDEX else None
+    if duplicates is not None:
+        for t in tasks:
+            duplicates.add(t)       # children repeating a queued task are dropped
 
-    # get keys
-    keys = get_api_keys()
-    assert keys, "no keys can be used!"
+    collectors = []
 
-    # print info
-    _elapsed = time.time() - started_prepare
-    print(f"MAIN: ready in {_elapsed:.1f} s. Starting {len(keys)} data collector workers, one API key per thread...")
+    if config.COLLECTOR_ENGINE == "asyncio":
+        print(f"MAIN: starting asyncio data collector for {len(keys)} API keys...")
 
-    # start worker threads
-    collectors = []
-    for n, k in enumerate(keys):
-        t = GoogleWorker(api_key=k, tasks_q=tasks_q, tasks_for_record_q=tasks_for_record_q, database_q=database_q,
-                         complete_tasks_q=complete_q, rawfile_q=raw_json_q, printlock=printlock, writelock=writelock)
+        t = AsyncGoogleCollector(key_pool=key_pool, tasks_q=tasks_q, database_q=database_q, rawfile_q=raw_json_q,
+                                 printlock=printlock, writelock=writelock, coverage=coverage, aoi=aoi,
+                                 pruned=pruned, duplicates=duplicates)
         t.start()
-        time.sleep(1)       # wait between starts
         collectors.append(t)
 
+    elif config.COLLECTOR_ENGINE == "processes":
+        n_workers = config.N_WORKERS if config.N_WORKERS > 0 else len(keys)
+        print(f"MAIN: starting {n_workers} data collector workers sharing {len(keys)} API keys...")
+
+        # start worker threads
+        for _ in range(n_workers):
+            t = GoogleWorker(key_pool=key_pool, tasks_q=tasks_q, database_q=database_q, rawfile_q=raw_json_q,
+                             printlock=printlock, writelock=writelock, coverage=coverage, aoi=aoi,
+                             pruned=pruned, duplicates=duplicates)
+            t.start()
+            time.sleep(1)       # wait between starts
+            collectors.append(t)
+
+    else:
+        raise Exception(f"unknown collector engine \"{config.COLLECTOR_ENGINE}\", see config to fix")
+
     with printlock:
         print(f"MAIN: workers started. Starting writers...")
 
@@ -184,18 +252,97 @@ def main():
     with printlock:
         print(f"MAIN: writer threads started")
 
+    # wait for collectors, keep track of POIs waiting for the database writer meanwhile
+    backlog = []
     for t in collectors:
-        t.join()
+        while t.is_alive():
+            t.join(timeout=1)
+            backlog.append(queue_size(database_q))
+
+    report["collectors_joined"] = time.time()
 
     with printlock:
-        print(f"MAIN: collector threads joined")
+        print(f"MAIN: collector threads joined. API keys: {key_pool.summary()}")
+        report["covered"] = coverage.skipped.value if coverage is not None else 0
+        if coverage is not None:
+            print(f"MAIN: {coverage.skipped.value} tasks were skipped as covered by {len(coverage)} completed "
+                  f"searches, at least as many requests saved")
+        report["pruned"] = pruned.value
+        if aoi is not None:
+            print(f"MAIN: {pruned.value} child tasks were dropped as outside the AOI")
+        report["duplicates"] = duplicates.merged.value if duplicates is not None else 0
+        if duplicates is not None:
+            print(f"MAIN: {duplicates.merged.value} child tasks were dropped as near duplicates of "
+                  f"{len(duplicates)} queued ones")
+
+    backlog = [x for x in backlog if x is not None]
+    report["max_backlog"] = max(backlog) if backlog else 0
+    report["avg_backlog"] = sum(backlog) / len(backlog) if backlog else 0
+
+    raw_json_q.put(None)    # poison pill, all POIs are queued before it
+    database_q.put(None)    # same for pages
+
+    while queue_size(database_q):
+        time.sleep(0.1)
+    report["writer_drained"] = time.time()
 
     db_writer.join()
     raw_writer.join()
+    report["writers_joined"] = time.time()
 
     with printlock:
         print(f"MAIN: writer threads joined. All jobs complete")
 
+    return report
+
+
+def main():
+
+    started_prepare = time.time()
+
+    # connection to prepare stuff, either for a clean start or restore prev session data
+    # must be closed before writer thread starts
+    conn = make_db_connection(config.DATABASE)      # creates the database if not exists
+    cursor = conn.cursor()
+
+    # define typing
+    tasks: List[TaskDefinition]
+    collected_place_ids: List[str]
+
+    if config.CRAWL_STRATEGY == "frontier":
+        assert config.COVERAGE_INDEX, "frontier crawl strategy needs COVERAGE_INDEX to find the frontier"
+
+    # the layer is read once, for the grid of a new session and for the collectors
+    clip_to_aoi = config.CLIP_TO_AOI or config.CRAWL_STRATEGY != "densify"
+    aoi_polygon = read_aoi_polygon() if clip_to_aoi or not config.RESUME else None
+    aoi = make_aoi(aoi_polygon) if clip_to_aoi else None
+
+    if config.RESUME:
+        # pick up where stopped last time
+        tasks, collected_place_ids = restore_tasks_and_places(cursor=cursor)    # unfinished tasks only
+
+    else:
+        tables = resume.get_existing_tables(cursor=cursor)
+        if config.POI_TABLE in tables:
+            raise Exception(f"ERROR: table {config.POI_TABLE} already exists. "
+                            f"You must remove it manually or use a different table name")
+        tasks = make_initial_tasks(aoi=aoi, aoi_polygon=aoi_polygon)     # initial_tasks
+        collected_place_ids = None
+        prepare_database(cursor=cursor)
+
+    conn.commit()
+    conn.close()    # close connection in this thread
+
+    # get keys
+    keys = get_api_keys()
+    assert keys, "no keys can be used!"
+
+    # print info
+    _elapsed = time.time() - started_prepare
+    print(f"MAIN: ready in {_elapsed:.1f} s")
+
+    run_session(tasks=tasks, keys=keys, collected_place_ids=collected_place_ids, aoi=aoi)
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,101 @@
+import asyncio
+import multiprocessing as mp
+import time
+from typing import List
+
+import config
+
+
+GLOBAL_BUCKET = 0   # index of the bucket shared by all keys
+
+
+class TokenBucketLimiter(object):
+
+    """
+    Token buckets in shared memory: one per API key plus a global one.
+    Created in main and passed to worker processes, all of them draw from the same buckets.
+    A request may start only when both its key bucket and the global bucket have a token.
+    """
+
+    def __init__(self,
+                 keys: List[str],
+                 key_rate: float = config.MAX_REQUESTS_PER_MIN / 60,
+                 key_burst: float = config.KEY_BURST,
+                 global_rate: float = config.GLOBAL_MAX_REQUESTS_PER_SEC,
+                 global_burst: float = config.GLOBAL_BURST):
+
+        assert key_rate > 0 and key_burst >= 1, f"invalid key bucket parameters rate={key_rate}, burst={key_burst}"
+
+        if global_rate <= 0:
+            # no global cap, make global bucket big enough to never block
+            global_rate, global_burst = float("inf"), float("inf")
+
+        assert global_burst >= 1, f"invalid global burst {global_burst}"
+
+        self.__index = {k: n + 1 for n, k in enumerate(keys)}   # 0 is reserved for the global bucket
+        n_buckets = len(keys) + 1
+
+        # all arrays are guarded by the same lock, see __refill_and_take()
+        self.__lock = mp.Lock()
+        self.__rates = mp.Array('d', [global_rate] + [key_rate] * len(keys), lock=False)       # tokens per second
+        self.__capacity = mp.Array('d', [global_burst] + [key_burst] * len(keys), lock=False)
+        self.__tokens = mp.Array('d', [global_burst] + [key_burst] * len(keys), lock=False)    # start full
+        self.__updated = mp.Array('d', [time.monotonic()] * n_buckets, lock=False)
+
+    def __refill(self, i: int, now: float):
+        elapsed = now - self.__updated[i]
+        if elapsed > 0:
+            self.__tokens[i] = min(self.__capacity[i], self.__tokens[i] + elapsed * self.__rates[i])
+            self.__updated[i] = now
+
+    def __wait_for(self, i: int) -> float:
+        missing = 1 - self.__tokens[i]
+        return missing / self.__rates[i] if missing > 0 else 0
+
+    def __refill_and_take(self, key: str, take: bool) -> float:
+
+        """ Returns 0 if a token is available in both buckets (and takes it if asked), else seconds to wait. """
+
+        i = self.__index[key]
+
+        with self.__lock:
+            now = time.monotonic()
+            self.__refill(i, now)
+            self.__refill(GLOBAL_BUCKET, now)
+
+            wait = max(self.__wait_for(i), self.__wait_for(GLOBAL_BUCKET))
+            if wait == 0 and take:
+                self.__tokens[i] -= 1
+                self.__tokens[GLOBAL_BUCKET] -= 1
+
+        return wait
+
+    def try_acquire(self, key: str) -> float:
+
+        """ Takes a token for the key if possible. Returns 0 on success, otherwise seconds until one is expected. """
+
+        return self.__refill_and_take(key=key, take=True)
+
+    def peek(self, key: str) -> float:
+
+        """ Seconds until a token for the key is expected, nothing is taken. """
+
+        return self.__refill_and_take(key=key, take=False)
+
+    def acquire(self, key: str):
+
+        """ Blocks only while a token is actually missing. """
+
+        wait = self.try_acquire(key)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire(key)
+
+    async def acquire_async(self, key: str):
+
+        """ Same as acquire(), other coroutines keep running while waiting. """
+
+        wait = self.try_acquire(key)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.try_acquire(key)
@@ -26,17 +26,21 @@ def restore_unfinished_tasks(cursor: sqlite3.Cursor) -> List[TaskDefinition]:
         return []
 
     tasks = []
-    for task_id, lon, lat, radius, place_type in rows:
+    for task_id, lon, lat, radius, place_type, page_token, got_before in rows:
         t = TaskDefinition(
             task_id=task_id,
             lon=lon,
             lat=lat,
             radius=radius,
-            place_type=place_type
+            place_type=place_type,
+            page_token=page_token,      # continue from the last recorded page, if any
+            got_before=got_before
         )
         tasks.append(t)
 
-    print(f"INFO: {len(tasks)} unfinished tasks restored from previous sessions")
+    n_paged = len([t for t in tasks if t.page_token])
+    print(f"INFO: {len(tasks)} unfinished tasks restored from previous sessions, "
+          f"{n_paged} of them will continue from the last recorded page")
 
     return tasks
 
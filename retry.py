@@ -0,0 +1,61 @@
+import random
+from collections import deque
+from typing import Optional
+
+import config
+from exceptions import TransportError, TransportTimeout
+
+
+class RetryPolicy(object):
+
+    """ Which failures are worth another try, and how long to wait before it (exponential backoff, full jitter). """
+
+    def __init__(self,
+                 max_attempts: int = config.RETRY_MAX_ATTEMPTS,
+                 base_delay: float = config.RETRY_BASE_DELAY,
+                 max_delay: float = config.RETRY_MAX_DELAY):
+
+        assert max_attempts >= 1, f"invalid number of attempts {max_attempts}"
+        assert 0 < base_delay <= max_delay, f"invalid delays: base = {base_delay}, max = {max_delay}"
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def is_transient(e: Exception) -> bool:
+
+        """ Timeouts, connection resets and 5xx responses. API statuses are never retried here. """
+
+        if isinstance(e, TransportTimeout):
+            return True
+        if isinstance(e, TransportError):
+            return e.status_code is None or e.status_code >= 500
+        return False
+
+    def delay(self, attempt: int) -> float:
+
+        """ Seconds to wait after the failed attempt number `attempt` (starting at 1). """
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class LatencyTracker(object):
+
+    """ Latencies of recent requests, for hedging thresholds. """
+
+    def __init__(self, size: int = 500):
+        self.__recent = deque(maxlen=size)
+
+    def add(self, latency: float):
+        self.__recent.append(latency)
+
+    def percentile(self, p: float, min_samples: int = config.HEDGE_MIN_SAMPLES) -> Optional[float]:
+
+        """ None until there are enough samples. """
+
+        if len(self.__recent) < max(1, min_samples):
+            return None
+
+        ordered = sorted(self.__recent)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
@@ -1,23 +1,106 @@
-import secrets
+import hashlib
+import time
+
+import config
+
+
+def make_task_id(lon: float, lat: float, radius: float, place_type: str, parent: str = None) -> str:
+
+    """
+    16 hex characters derived from what the task searches and the task it was split from. The same task
+    gets the same ID in every process and session, so recording it twice changes nothing.
+    Coordinates are quantized to about 10 cm, radius to 10 cm.
+    """
+
+    key = f"{place_type}|{lon:.6f}|{lat:.6f}|{radius:.1f}|{parent or ''}"
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
 
 
 class TaskDefinition(object):
 
     """ Super simple container for a task. """
 
+    __slots__ = ("lon", "lat", "radius", "place_type", "tries", "task_id", "page_token", "got_before")
+
     lon: float          # EPSG:4326
     lat: float          # EPSG:4326
     radius: float
     place_type: str
 
     tries: int
-    task_id: str        # initialize internally if not provided
+    task_id: str        # derived from the search and the parent task if not provided
 
-    def __init__(self, lon: float, lat: float, radius: float, place_type: str, task_id: str = None):
+    page_token: str     # set when resuming a partially paged task, see PageContinuation
+    got_before: int
+
+    def __init__(self, lon: float, lat: float, radius: float, place_type: str, task_id: str = None,
+                 page_token: str = None, got_before: int = 0, parent: str = None):
         self.lon = lon
         self.lat = lat
         self.radius = radius
         self.place_type = place_type
 
         self.tries = 0
-        self.task_id = task_id if task_id else secrets.token_hex(32)    # unique identifier
+        self.task_id = task_id if task_id else make_task_id(lon, lat, radius, place_type, parent=parent)
+
+        self.page_token = page_token
+        self.got_before = got_before if got_before else 0
+
+    def __getstate__(self):
+        return tuple(getattr(self, s) for s in self.__slots__)     # values only, pickled for every queue put
+
+    def __setstate__(self, state):
+        for s, value in zip(self.__slots__, state):
+            setattr(self, s, value)
+
+
+class PageContinuation(object):
+
+    """
+    Next results page of a started task. Can only be requested after not_before.
+    Also sent to the database writer as a checkpoint, so that RESUME can continue from this page.
+    """
+
+    task: TaskDefinition
+    page_token: str
+    got_before: int         # POIs received for the task so far
+    key: str                # API key that issued the token
+    not_before: float       # time.time() timestamp
+
+    def __init__(self, task: TaskDefinition, page_token: str, got_before: int, key: str = None,
+                 delay: float = config.NEXT_PAGE_DELAY):
+        self.task = task
+        self.page_token = page_token
+        self.got_before = got_before
+        self.key = key
+        self.not_before = time.time() + delay
+
+    def __lt__(self, other):
+        return self.not_before < other.not_before     # ordering for heapq
+
+
+class PageBatch(object):
+
+    """
+    Message from a collector to the database writer: POIs of a results page together with what they
+    acknowledge, the checkpoint of the next page or the completed task. Both arrive at once, so the task
+    is never recorded as done before its POIs. Acknowledgements without POIs have an empty list.
+    New tasks to record in the jobs table come the same way, it is the only input of the writer.
+    """
+
+    __slots__ = ("pois", "ack", "jobs")
+
+    pois: list                  # PoiData, without raw payloads
+    ack: object                 # PageContinuation, TaskDefinition or None
+    jobs: list                  # TaskDefinition
+
+    def __init__(self, pois: list, ack=None, jobs: list = None):
+        self.pois = pois
+        self.ack = ack
+        self.jobs = jobs if jobs else []
+
+    def __getstate__(self):
+        return self.pois, self.ack, self.jobs
+
+    def __setstate__(self, state):
+        self.pois, self.ack, self.jobs = state
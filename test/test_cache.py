@@ -0,0 +1,106 @@
+import queue
+import time
+
+import pytest
+
+from adaptive import AimdController
+from db.cache import ResponseCache
+from dev.mock_places_server import make_place
+from keypool import KeyPool
+from ratelimit import TokenBucketLimiter
+from tasks import TaskDefinition, PageBatch
+from workers import GoogleWorker
+
+LAT, LON, RADIUS, TYPE = 53.9, 27.56, 500, "cafe"
+
+
+def page(first: int, n: int, next_page_token: str = None) -> dict:
+    resp = {"status": "OK", "results": [make_place(first + i, LAT, LON, TYPE) for i in range(n)]}
+    if next_page_token:
+        resp["next_page_token"] = next_page_token
+    return resp
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(db_file=str(tmp_path / "cache.sqlite3"), ttl=0, max_size=0, offline=False)
+    cache.connect()
+    yield cache
+    cache.close()
+
+
+def test_pages_are_chained_through_tokens(cache):
+    cache.put(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE, resp=page(0, 20, next_page_token="token-1"))
+    cache.put(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE, resp=page(20, 5), page_token="token-1")
+
+    first = cache.get(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE)
+    assert first["next_page_token"] == "token-1"
+    second = cache.get(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE, page_token="token-1")
+    assert [r["place_id"] for r in second["results"]] == [make_place(20 + i, 0, 0, TYPE)["place_id"] for i in range(5)]
+
+    assert cache.get(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE, page_token="unknown") is None
+    assert cache.get(lat=LAT, lon=LON, radius=RADIUS + 1, place_type=TYPE) is None
+
+
+def test_errors_are_not_cached(cache):
+    cache.put(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE, resp={"status": "OVER_QUERY_LIMIT"})
+    assert cache.get(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE) is None
+
+
+def test_expired_responses_are_misses(cache):
+    cache.ttl = 0.01
+    cache.put(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE, resp=page(0, 3))
+    time.sleep(0.02)
+    assert cache.get(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE) is None
+
+
+def test_invalidate_drops_first_page(cache):
+    cache.put(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE, resp=page(0, 20, next_page_token="token-1"))
+    cache.invalidate(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE)
+    assert cache.get(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE) is None
+
+
+class FakeTransport(object):
+
+    """ Two live pages, the second one behind a fresh token. """
+
+    def __init__(self):
+        self.calls = []
+
+    def places_nearby(self, key: str, page_token: str = None, **kwargs) -> dict:
+        self.calls.append(page_token)
+        return page(100, 5) if page_token else page(0, 20, next_page_token="live-token")
+
+
+class ListQueue(list):
+    def put(self, obj):
+        self.append(obj)
+
+
+def test_broken_cached_chain_is_retried_live(cache, monkeypatch):
+    monkeypatch.setattr("config.NEXT_PAGE_DELAY", 0)
+    monkeypatch.setattr("config.TB_FILE", "/dev/null")
+
+    # page 1 is cached, page 2 it leads to is not
+    cache.put(lat=LAT, lon=LON, radius=RADIUS, place_type=TYPE, resp=page(0, 20, next_page_token="stale-token"))
+
+    keys = ["key-0"]
+    limiter = TokenBucketLimiter(keys=keys, key_rate=1000, key_burst=10, global_rate=0)
+    tasks_q, database_q = queue.Queue(), ListQueue()
+    worker = GoogleWorker(key_pool=KeyPool(keys=keys, limiter=limiter), tasks_q=tasks_q, database_q=database_q,
+                          rawfile_q=ListQueue(), printlock=None, writelock=None)
+    worker.cache, worker.transport = cache, FakeTransport()
+    worker.controller = AimdController(initial_rate=1000, max_rate=1000)
+
+    task = TaskDefinition(lon=LON, lat=LAT, radius=RADIUS, place_type=TYPE)
+    worker.do_page(task=task)
+    worker._do_continuation()       # stale token, the task goes back to the queue
+    assert worker.transport.calls == []
+
+    retried = tasks_q.get_nowait()
+    worker.do_page(task=retried, page_token=retried.page_token, got_before=retried.got_before)
+    worker._do_continuation()
+
+    assert worker.transport.calls == [None, "live-token"]
+    completed = [b for b in database_q if isinstance(b, PageBatch) and b.ack is retried]
+    assert len(completed) == 1 and len(completed[0].pois) == 5
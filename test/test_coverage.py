@@ -0,0 +1,50 @@
+import multiprocessing as mp
+
+from coverage import CoverageIndex
+from geometries.local import offset
+from tasks import TaskDefinition
+
+LON, LAT = 27.56, 53.9
+
+
+def task(dx: float = 0, dy: float = 0, radius: float = 100, place_type: str = "cafe") -> TaskDefinition:
+    lon, lat = offset(LON, LAT, dx, dy)
+    return TaskDefinition(lon=lon, lat=lat, radius=radius, place_type=place_type)
+
+
+def add_from_child(index: CoverageIndex, t: TaskDefinition):
+    index.add(t)
+
+
+def test_inside_a_single_circle():
+    index = CoverageIndex(place_types=["cafe", "bar"])
+    index.add(task(radius=500))
+    assert index.is_covered(task(dx=200, radius=100))
+    assert not index.is_covered(task(dx=450, radius=100))     # sticks out
+    assert not index.is_covered(task(dx=200, radius=100, place_type="bar"))
+    assert not index.is_covered(task(dx=200, radius=100, place_type="unknown"))
+
+
+def test_inside_the_union_of_circles():
+    index = CoverageIndex(place_types=["cafe"])
+    index.add(task(dx=-150, radius=300))
+    index.add(task(dx=150, radius=300))
+    assert index.is_covered(task(radius=200))
+    assert not index.is_covered(task(dy=250, radius=200))
+
+
+def test_capacity():
+    index = CoverageIndex(place_types=["cafe"], capacity=1)
+    index.add(task(dx=-1000, radius=500))
+    index.add(task(radius=500))
+    assert len(index) == 1
+    assert not index.is_covered(task(radius=100))
+
+
+def test_circles_added_by_other_processes_are_seen():
+    index = CoverageIndex(place_types=["cafe"])
+    assert not index.is_covered(task(radius=100))
+    p = mp.Process(target=add_from_child, args=(index, task(radius=500)))
+    p.start()
+    p.join()
+    assert index.is_covered(task(radius=100))
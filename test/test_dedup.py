@@ -0,0 +1,59 @@
+import multiprocessing as mp
+
+from dedup import DuplicateIndex
+from geometries.local import offset
+from tasks import TaskDefinition
+
+LON, LAT = 27.56, 53.9
+
+
+def task(dx: float = 0, dy: float = 0, radius: float = 100, place_type: str = "cafe") -> TaskDefinition:
+    lon, lat = offset(LON, LAT, dx, dy)
+    return TaskDefinition(lon=lon, lat=lat, radius=radius, place_type=place_type)
+
+
+def add_from_child(index: DuplicateIndex, t: TaskDefinition):
+    index.add(t)
+
+
+def test_near_duplicates_are_dropped():
+    index = DuplicateIndex(place_types=["cafe", "bar"], tolerance=0.05, capacity=1024)
+    assert index.add(task())
+    assert not index.add(task(dx=2, dy=-2, radius=101))
+    assert index.merged.value == 1
+    assert len(index) == 1
+
+
+def test_distinct_searches_are_kept():
+    index = DuplicateIndex(place_types=["cafe", "bar"], tolerance=0.05, capacity=1024)
+    assert index.add(task())
+    assert index.add(task(dx=50))               # centre half the radius away
+    assert index.add(task(radius=150))          # another radius
+    assert index.add(task(place_type="bar"))    # another type
+    assert index.add(task(place_type="unknown"))
+    assert index.add(task(place_type="unknown"))    # unknown types are never deduplicated
+    assert index.merged.value == 0
+
+
+def test_duplicates_across_a_cell_boundary():
+    index = DuplicateIndex(place_types=["cafe"], tolerance=0.05, capacity=1024)
+    for i in range(20):
+        # pairs 1 m apart, some of them straddle a cell boundary
+        assert index.add(task(dx=i * 100))
+        assert not index.add(task(dx=i * 100 + 1))
+
+
+def test_full_table_registers_nothing_more():
+    index = DuplicateIndex(place_types=["cafe"], tolerance=0.05, capacity=4)
+    for i in range(10):
+        index.add(task(dx=i * 100))
+    assert len(index) <= 4
+    assert index.add(task(dx=5000)) and index.add(task(dx=5000))
+
+
+def test_tasks_added_by_other_processes_are_seen():
+    index = DuplicateIndex(place_types=["cafe"], tolerance=0.05, capacity=1024)
+    p = mp.Process(target=add_from_child, args=(index, task()))
+    p.start()
+    p.join()
+    assert not index.add(task(dx=1))
@@ -0,0 +1,74 @@
+import time
+from collections import Counter
+
+import pytest
+
+from exceptions import NoKeysLeftException
+from keypool import KeyPool
+from ratelimit import TokenBucketLimiter
+
+KEYS = ["key-0", "key-1", "key-2"]
+
+
+def make_pool(key_rate: float = 1000, key_burst: float = 1, **kwargs) -> KeyPool:
+    limiter = TokenBucketLimiter(keys=KEYS, key_rate=key_rate, key_burst=key_burst, global_rate=0)
+    return KeyPool(keys=KEYS, limiter=limiter, **kwargs)
+
+
+def test_unused_keys_are_tried_after_a_measured_one():
+    pool = make_pool()
+    used = set()
+    for _ in KEYS:
+        key = pool.lease()
+        used.add(key)
+        pool.release(key, latency=0.02)
+    assert used == set(KEYS)
+
+
+def test_keys_share_leases_under_load():
+    pool = make_pool(key_rate=100)
+    latency = {"key-0": 0.02, "key-1": 0.025, "key-2": 0.03}
+    leases = Counter()
+
+    started = time.monotonic()
+    while time.monotonic() - started < 1.0:
+        key = pool.lease()
+        pool.limiter.acquire(key)
+        leases[key] += 1
+        pool.release(key, latency=latency[key])
+
+    total = sum(leases.values())
+    for key in KEYS:
+        assert leases[key] == pytest.approx(total / len(KEYS), rel=0.15)
+
+
+def test_busy_key_is_avoided():
+    pool = make_pool()
+    first = pool.lease()
+    assert pool.lease() != first     # still in flight
+
+
+def test_preferred_key_is_kept_while_active():
+    pool = make_pool()
+    assert pool.lease(preferred="key-2") == "key-2"
+    pool.mark_exhausted("key-2")
+    assert pool.lease(preferred="key-2") != "key-2"
+
+
+def test_budget_and_denied_keys():
+    pool = make_pool(previous_requests={"key-0": 5}, max_requests_per_key=5)
+    assert not pool.is_active("key-0")
+
+    pool.mark_denied("key-1")
+    key = pool.lease()
+    assert key == "key-2"
+    pool.release(key)
+    pool.charge(key)
+    pool.charge(key)
+    pool.charge(key)
+    pool.charge(key)
+    assert pool.active_count() == 0
+
+    with pytest.raises(NoKeysLeftException):
+        pool.lease()
+    assert pool.request_counts() == {"key-0": 5, "key-1": 0, "key-2": 5}
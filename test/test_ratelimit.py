@@ -0,0 +1,53 @@
+import multiprocessing as mp
+import time
+
+import pytest
+
+from ratelimit import TokenBucketLimiter
+
+KEYS = ["key-0", "key-1"]
+
+
+def take_all(limiter: TokenBucketLimiter, key: str, taken: mp.Value):
+    while limiter.try_acquire(key) == 0:
+        taken.value += 1
+
+
+def test_burst_then_wait():
+    limiter = TokenBucketLimiter(keys=KEYS, key_rate=10, key_burst=3, global_rate=0)
+    assert [limiter.try_acquire("key-0") for _ in range(3)] == [0, 0, 0]
+    assert limiter.try_acquire("key-0") == pytest.approx(0.1, abs=0.02)
+    assert limiter.try_acquire("key-1") == 0    # buckets of other keys are not touched
+
+
+def test_peek_takes_nothing():
+    limiter = TokenBucketLimiter(keys=KEYS, key_rate=10, key_burst=1, global_rate=0)
+    assert limiter.peek("key-0") == 0
+    assert limiter.peek("key-0") == 0
+    assert limiter.try_acquire("key-0") == 0
+    assert limiter.peek("key-0") > 0
+
+
+def test_refill_rate():
+    limiter = TokenBucketLimiter(keys=KEYS, key_rate=50, key_burst=1, global_rate=0)
+    started = time.monotonic()
+    for _ in range(11):
+        limiter.acquire("key-0")
+    assert time.monotonic() - started == pytest.approx(0.2, abs=0.05)
+
+
+def test_global_bucket_caps_all_keys():
+    limiter = TokenBucketLimiter(keys=KEYS, key_rate=100, key_burst=5, global_rate=1, global_burst=2)
+    assert limiter.try_acquire("key-0") == 0
+    assert limiter.try_acquire("key-1") == 0
+    assert limiter.try_acquire("key-1") > 0.5
+
+
+def test_buckets_are_shared_between_processes():
+    limiter = TokenBucketLimiter(keys=KEYS, key_rate=0.01, key_burst=4, global_rate=0)
+    taken = mp.Value('i', 0)
+    p = mp.Process(target=take_all, args=(limiter, "key-0", taken))
+    p.start()
+    p.join()
+    assert taken.value == 4
+    assert limiter.try_acquire("key-0") > 0
@@ -0,0 +1,41 @@
+import os
+import pickle
+import subprocess
+import sys
+
+from tasks import TaskDefinition, make_task_id
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_same_search_same_id():
+    assert make_task_id(27.5, 53.9, 650, "cafe") == make_task_id(27.5, 53.9, 650.0, "cafe")
+    assert make_task_id(27.5, 53.9, 650, "cafe") == make_task_id(27.50000001, 53.9, 650.01, "cafe")
+    assert len(make_task_id(27.5, 53.9, 650, "cafe")) == 16
+
+
+def test_different_search_or_parent_different_id():
+    ids = {
+        make_task_id(27.5, 53.9, 650, "cafe"),
+        make_task_id(27.5001, 53.9, 650, "cafe"),
+        make_task_id(27.5, 53.9, 325, "cafe"),
+        make_task_id(27.5, 53.9, 650, "bar"),
+        make_task_id(27.5, 53.9, 650, "cafe", parent="0123456789abcdef"),
+    }
+    assert len(ids) == 5
+
+
+def test_id_is_stable_across_interpreters():
+    code = "from tasks import make_task_id; print(make_task_id(27.5, 53.9, 650, 'cafe', parent='p'))"
+    ids = {subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                          env={"PYTHONHASHSEED": str(seed), "PYTHONPATH": ROOT}).stdout.strip()
+           for seed in (1, 2)}
+    assert ids == {make_task_id(27.5, 53.9, 650, "cafe", parent="p")}
+
+
+def test_task_keeps_its_id_when_pickled():
+    task = TaskDefinition(lon=27.5, lat=53.9, radius=650, place_type="cafe", parent="0123456789abcdef")
+    task.tries, task.page_token = 2, "token"
+    restored = pickle.loads(pickle.dumps(task))
+    assert (restored.task_id, restored.tries, restored.page_token) == (task.task_id, 2, "token")
+    assert restored.task_id == TaskDefinition(27.5, 53.9, 650, "cafe", parent="0123456789abcdef").task_id
@@ -0,0 +1,88 @@
+import multiprocessing as mp
+import queue
+
+import pytest
+
+from adaptive import AimdController
+from dev.mock_places_server import make_place
+from exceptions import TransportError
+from keypool import KeyPool
+from ratelimit import TokenBucketLimiter
+from tasks import TaskDefinition, PageBatch
+from workers import GoogleWorker
+
+LAT, LON, RADIUS, TYPE = 53.9, 27.56, 500, "cafe"
+
+
+def page(first: int, n: int, next_page_token: str = None) -> dict:
+    resp = {"status": "OK", "results": [make_place(first + i, LAT, LON, TYPE) for i in range(n)]}
+    if next_page_token:
+        resp["next_page_token"] = next_page_token
+    return resp
+
+
+class ListQueue(list):
+    def put(self, obj):
+        self.append(obj)
+
+
+class ScriptedTransport(object):
+
+    """ Returns or raises the scripted responses in turn. """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+        self.closed = False
+
+    def places_nearby(self, key: str, page_token: str = None, **kwargs) -> dict:
+        self.calls.append(page_token)
+        resp = self.responses.pop(0)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    monkeypatch.setattr("config.NEXT_PAGE_DELAY", 0)
+    monkeypatch.setattr("config.TB_FILE", "/dev/null")
+
+    keys = ["key-0"]
+    limiter = TokenBucketLimiter(keys=keys, key_rate=1000, key_burst=10, global_rate=0)
+    worker = GoogleWorker(key_pool=KeyPool(keys=keys, limiter=limiter), tasks_q=queue.Queue(),
+                          database_q=ListQueue(), rawfile_q=ListQueue(), printlock=mp.Lock(), writelock=mp.Lock())
+    worker.controller = AimdController(initial_rate=1000, max_rate=1000)
+    return worker
+
+
+def completed(worker: GoogleWorker, task: TaskDefinition) -> list:
+    return [b for b in worker.poi_db_q if isinstance(b, PageBatch) and b.ack is task]
+
+
+def test_tasks_put_back_while_draining_are_retried_by_the_worker(worker):
+    worker.transport = ScriptedTransport(page(0, 20, next_page_token="token"), TransportError("reset"),
+                                         page(0, 20, next_page_token="token-2"), page(20, 5))
+    task = TaskDefinition(lon=LON, lat=LAT, radius=RADIUS, place_type=TYPE)
+    worker.do_page(task=task)
+
+    worker._drain_continuations()
+
+    assert worker.tasks_q.empty()
+    assert worker.transport.calls == [None, "token", None, "token-2"]
+    assert len(completed(worker, task)) == 1
+
+
+@pytest.mark.parametrize("status", ["UNKNOWN_ERROR", "NOT_A_STATUS"])
+def test_unknown_status_puts_the_task_back(worker, status):
+    worker.transport = ScriptedTransport({"status": status})
+    task = TaskDefinition(lon=LON, lat=LAT, radius=RADIUS, place_type=TYPE)
+
+    worker.do_page(task=task)
+
+    assert worker.tasks_q.get_nowait() is task
+    assert worker.stats.request_errors == 1
+    assert not completed(worker, task)
@@ -0,0 +1,287 @@
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Tuple
+
+import googlemaps
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from exceptions import TransportError, TransportTimeout
+from jsonlib import json_loads
+from ratelimit import TokenBucketLimiter
+from retry import LatencyTracker, RetryPolicy
+
+
+def make_session(pool_size: int = config.HTTP_POOL_SIZE) -> requests.Session:
+
+    """ Session that keeps up to pool_size keep-alive connections and asks for compressed responses. """
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+    return session
+
+
+class PlacesTransport(ABC):
+
+    """
+    How Nearby Search calls reach the API. Implementations return the response JSON as dict
+    and leave status validation to PoiData.from_response(). Failures below the API level
+    are raised as TransportError (TransportTimeout for timeouts). With rank_by="distance"
+    results are ordered by distance and no radius is sent, the API rejects both at once.
+    """
+
+    timeout: Tuple[float, float]    # connect, read
+
+    def __init__(self, connect_timeout: float = config.CONNECT_TIMEOUT, read_timeout: float = config.READ_TIMEOUT):
+
+        assert connect_timeout > 0 and read_timeout > 0, \
+            f"invalid timeouts: connect = {connect_timeout}, read = {read_timeout}"
+
+        self.timeout = (connect_timeout, read_timeout)
+
+    @abstractmethod
+    def places_nearby(self, key: str, location: Tuple[float, float] = None, radius: float = None,
+                      place_type: str = None, page_token: str = None, rank_by: str = None) -> dict:
+        pass
+
+    def close(self):
+        pass
+
+
+class SessionTransport(PlacesTransport):
+
+    """ Plain HTTP GETs through a pooled keep-alive session, decoded with the fastest JSON library found. """
+
+    def __init__(self, url: str = config.PLACES_NEARBY_URL, pool_size: int = config.HTTP_POOL_SIZE, **kwargs):
+
+        self.url = url
+        self.session = make_session(pool_size=pool_size)
+
+        super().__init__(**kwargs)
+
+    def places_nearby(self, key: str, location: Tuple[float, float] = None, radius: float = None,
+                      place_type: str = None, page_token: str = None, rank_by: str = None) -> dict:
+
+        if page_token:
+            params = {"pagetoken": page_token, "key": key}
+        else:
+            params = {
+                "location": f"{location[0]},{location[1]}",
+                "radius": radius,
+                "type": place_type,
+                "language": config.LANGUAGE,
+                "key": key
+            }
+            if rank_by:
+                params["rankby"] = rank_by
+                del params["radius"]
+
+        try:
+            resp = self.session.get(self.url, params=params, timeout=self.timeout)
+        except requests.exceptions.Timeout as e:
+            raise TransportTimeout(f"request timed out: {e}")
+        except requests.exceptions.RequestException as e:
+            raise TransportError(f"request failed: {e}")
+
+        if resp.status_code != 200:
+            raise TransportError(f"HTTP {resp.status_code} received", status_code=resp.status_code)
+
+        try:
+            return json_loads(resp.content)     # gzip is decoded by urllib3 at this point
+        except ValueError as e:
+            raise TransportError(f"failed to decode response JSON: {e}", status_code=resp.status_code)
+
+    def close(self):
+        self.session.close()
+
+
+class SingleAttemptClient(googlemaps.Client):
+
+    """
+    googlemaps.Client without its own retry loop for 5xx and UNKNOWN_ERROR responses: a retry would be sent
+    without a limiter token and without being charged. RetryingTransport retries them instead.
+    """
+
+    def _request(self, url, params, first_request_time=None, retry_counter=0, *args, **kwargs):
+        if retry_counter > 0:
+            raise googlemaps.exceptions.TransportError("retriable response received")
+        return super()._request(url, params, first_request_time, retry_counter, *args, **kwargs)
+
+
+class GoogleMapsTransport(PlacesTransport):
+
+    """ googlemaps.Client per API key, all clients share one pooled session. """
+
+    def __init__(self, url: str = config.PLACES_NEARBY_URL, pool_size: int = config.HTTP_POOL_SIZE, **kwargs):
+
+        super().__init__(**kwargs)
+
+        # googlemaps wants scheme and host only, path is added by the client
+        scheme, _, host = url.split("/", 3)[:3]
+        self.base_url = f"{scheme}//{host}"
+
+        self.session = make_session(pool_size=pool_size)
+        self.__clients = {}
+
+    def __get_client(self, key: str):
+
+        if key not in self.__clients:
+            self.__clients[key] = SingleAttemptClient(key=key,
+                                                      queries_per_second=1000,    # rate is controlled by the limiter
+                                                      queries_per_minute=60000,
+                                                      retry_over_query_limit=False,
+                                                      connect_timeout=self.timeout[0],
+                                                      read_timeout=self.timeout[1],
+                                                      requests_session=self.session,
+                                                      base_url=self.base_url)
+        return self.__clients[key]
+
+    def places_nearby(self, key: str, location: Tuple[float, float] = None, radius: float = None,
+                      place_type: str = None, page_token: str = None, rank_by: str = None) -> dict:
+
+        client = self.__get_client(key)
+
+        try:
+            if page_token:
+                return client.places_nearby(page_token=page_token)
+            else:
+                return client.places_nearby(location=location,
+                                            radius=None if rank_by else radius,
+                                            open_now=False,
+                                            language=config.LANGUAGE,
+                                            rank_by=rank_by,
+                                            type=place_type)
+
+        except googlemaps.exceptions.ApiError as e:
+            # let PoiData.from_response() deal with API statuses, same as for other transports
+            return {"status": e.status, "error_message": e.message}
+        except googlemaps.exceptions.Timeout as e:
+            raise TransportTimeout(f"request timed out: {e}")
+        except googlemaps.exceptions.HTTPError as e:
+            raise TransportError(f"HTTP {e.status_code} received", status_code=e.status_code)
+        except googlemaps.exceptions.TransportError as e:
+            raise TransportError(f"request failed: {e}")
+
+    def close(self):
+        self.session.close()
+
+
+class RetryingTransport(PlacesTransport):
+
+    """
+    Wraps another transport. Transient failures are retried with jittered exponential backoff;
+    with hedging on, a duplicate request is sent when the first one runs past the latency percentile
+    and whichever answers first is used. Every extra request takes a limiter token and is reported
+    through on_extra_request(key, kind) with kind "retry" or "hedge", so it is charged like any other.
+    """
+
+    def __init__(self, transport: PlacesTransport, policy: RetryPolicy = None,
+                 limiter: TokenBucketLimiter = None,
+                 on_extra_request: Callable[[str, str], None] = None,
+                 hedge_percentile: float = config.HEDGE_PERCENTILE,
+                 pool_size: int = config.HTTP_POOL_SIZE):
+
+        assert 0 <= hedge_percentile < 100, f"invalid hedge percentile {hedge_percentile}"
+
+        self.transport = transport
+        self.policy = policy if policy else RetryPolicy()
+        self.limiter = limiter
+        self.on_extra_request = on_extra_request
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker()
+
+        self.timeout = transport.timeout
+        self.__executor = ThreadPoolExecutor(max_workers=2 * pool_size) if hedge_percentile > 0 else None
+
+    def __extra_request(self, key: str, kind: str):
+        if self.on_extra_request is not None:
+            self.on_extra_request(key, kind)
+
+    def __timed_call(self, key: str, **kwargs) -> dict:
+        started = time.time()
+        response = self.transport.places_nearby(key, **kwargs)
+        self.latencies.add(time.time() - started)
+        return response
+
+    def __hedged_call(self, key: str, **kwargs) -> dict:
+
+        threshold = self.latencies.percentile(self.hedge_percentile)
+        first = self.__executor.submit(self.__timed_call, key, **kwargs)
+        if threshold is None:
+            return first.result()
+
+        done, _ = wait([first], timeout=threshold)
+        # no spare token - don't push the key past its rate for a hedge
+        if done or (self.limiter is not None and self.limiter.try_acquire(key) > 0):
+            return first.result()
+
+        self.__extra_request(key, "hedge")
+        pending = {first, self.__executor.submit(self.__timed_call, key, **kwargs)}
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()      # the other request is left to finish on its own
+                error = future.exception()
+
+        raise error
+
+    def places_nearby(self, key: str, location: Tuple[float, float] = None, radius: float = None,
+                      place_type: str = None, page_token: str = None, rank_by: str = None) -> dict:
+
+        kwargs = dict(location=location, radius=radius, place_type=place_type, page_token=page_token, rank_by=rank_by)
+        attempt = 1
+
+        while True:
+            try:
+                if self.__executor is not None:
+                    return self.__hedged_call(key, **kwargs)
+                return self.__timed_call(key, **kwargs)
+
+            except TransportError as e:
+                if attempt >= self.policy.max_attempts or not self.policy.is_transient(e):
+                    raise e
+
+                time.sleep(self.policy.delay(attempt))
+                if self.limiter is not None:
+                    self.limiter.acquire(key)
+                self.__extra_request(key, "retry")
+                attempt += 1
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+        self.transport.close()
+
+
+def make_transport(pool_size: int = config.HTTP_POOL_SIZE, limiter: TokenBucketLimiter = None,
+                   on_extra_request: Callable[[str, str], None] = None) -> PlacesTransport:
+
+    """
+    Transport selected in config, wrapped with retries and hedging unless both are disabled.
+    Must be created in the process that will use it.
+    """
+
+    if config.TRANSPORT == "session":
+        transport = SessionTransport(pool_size=pool_size)
+    elif config.TRANSPORT == "googlemaps":
+        transport = GoogleMapsTransport(pool_size=pool_size)
+    else:
+        raise Exception(f"unknown transport \"{config.TRANSPORT}\", see config to fix")
+
+    if config.RETRY_MAX_ATTEMPTS <= 1 and config.HEDGE_PERCENTILE <= 0:
+        return transport
+
+    return RetryingTransport(transport,
+                             limiter=limiter,
+                             on_extra_request=on_extra_request,
+                             pool_size=pool_size)
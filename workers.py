@@ -1,20 +1,25 @@
-import json
+import heapq
 import multiprocessing as mp
-import os
 import time
 from queue import Empty
-from typing import List
-
-import googlemaps
+from typing import List, Optional, Tuple, Union
 
 import config
+from adaptive import AimdController
+from api import update_tracker
+from coverage import CoverageIndex
+from dedup import DuplicateIndex
 from dataclass import PoiData
+from db.cache import ResponseCache, make_cache
 from exceptions import *
-from geometries.geomworks import Densifier
-from tasks import TaskDefinition
-
-
-MIN_REQUEST_INTERVAL = 60 / config.MAX_REQUESTS_PER_MIN  # seconds
+from geometries.backend import make_densifier
+from geometries.local import distance
+from geometries.vectorized import PreparedPolygon
+from keypool import KeyPool
+from ratelimit import TokenBucketLimiter
+from retry import RetryPolicy
+from tasks import TaskDefinition, PageContinuation, PageBatch
+from transport import PlacesTransport, make_transport
 
 
 class StatsClass(object):
@@ -23,14 +28,23 @@ class StatsClass(object):
     requests: int
     pois: int
     tasks: int
+    jobs: int       # page requests done by the main loop, new tasks or continuations
     critical_errors: int
 
     zero_results: int
     request_errors: int
     recursions: int
+    retries: int    # extra requests sent by the transport, counted in requests too
+    hedges: int
+    cache_hits: int
+    cache_misses: int
+    covered: int    # tasks skipped as covered by completed searches, a request saved each
+    pruned: int     # child tasks dropped as outside the AOI
+    duplicates: int     # child tasks dropped as near duplicates of queued ones
 
     avg_request_time: float
-    avg_task_time: float
+    avg_job_time: float
+    total_request_time: float
 
     def __init__(self):
 
@@ -38,262 +52,488 @@ class StatsClass(object):
         self.requests = 0
         self.pois = 0
         self.tasks = 0
+        self.jobs = 0
         self.critical_errors = 0
         self.zero_results = 0
         self.request_errors = 0
         self.recursions = 0
+        self.retries = 0
+        self.hedges = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.covered = 0
+        self.pruned = 0
+        self.duplicates = 0
 
         self.avg_request_time = 0
-        self.avg_task_time = 0
+        self.avg_job_time = 0
+        self.total_request_time = 0
 
 
-class GoogleWorker(mp.Process):
+class CollectorBase(mp.Process):
 
-    """ One API key per collector worker. """
+    """ Shared plumbing of collector processes: output queues, recursion and console output. """
 
-    key: str
     finished: bool = None
     tasks_q: mp.Queue
     poi_db_q: mp.Queue
     critical_errors_threshold: int = 10
 
-    __writelock: mp.Lock
-    __printlock: mp.Lock
-
-    __info_each: int = 5
+    _writelock: mp.Lock
+    _printlock: mp.Lock
 
     def __init__(self,
-                 api_key: str,
+                 key_pool: KeyPool,
                  tasks_q: mp.Queue,
-                 tasks_for_record_q: mp.Queue,
                  database_q: mp.Queue,
-                 complete_tasks_q: mp.Queue,
                  rawfile_q: mp.Queue,
                  printlock: mp.Lock,
-                 writelock: mp.Lock
+                 writelock: mp.Lock,
+                 coverage: CoverageIndex = None,
+                 aoi: PreparedPolygon = None,
+                 pruned: mp.Value = None,
+                 duplicates: DuplicateIndex = None,
+                 **kwargs
                  ):
 
-        self.key = api_key
+        self.key_pool = key_pool
+        self.coverage = coverage
+        self.aoi = aoi      # child tasks outside it are dropped
+        self.pruned = pruned    # shared count of dropped child tasks
+        self.duplicates = duplicates
+        self.rank_by = "distance" if config.CRAWL_STRATEGY == "frontier" else None
+        self.limiter: TokenBucketLimiter = key_pool.limiter
         self.tasks_q: mp.Queue = tasks_q
-        self.tasks_database_q = tasks_for_record_q
         self.poi_db_q: mp.Queue = database_q
         self.rawfile_q: mp.Queue = rawfile_q
-        self.complete_tasks_q: mp.Queue = complete_tasks_q
 
-        self.__writelock = writelock
-        self.__printlock = printlock
+        self._writelock = writelock
+        self._printlock = printlock
 
         self.finished = False
-        self.densifier: Densifier = None   # initialize in a separate thread
+        self.densifier = None   # initialize in a separate process
+        self.controller: AimdController = None
+        self.cache: ResponseCache = None
 
         self.stats = StatsClass()
-        self.maps = googlemaps.Client(key=api_key,
-                                      queries_per_second=3,
-                                      retry_over_query_limit=False,
-                                      timeout=5)
-        self.__ignore_taks = set()
 
-        super().__init__(daemon=True)
+        super().__init__(daemon=True, **kwargs)
 
     def print(self, *args, **kwargs):
-        with self.__printlock:
+        with self._printlock:
             print(*args, **kwargs)
 
-    def print_info(self):
+    def write_traceback(self, e: Exception):
+        with self._printlock:
+            write_traceback(e=e, file=config.TB_FILE)
 
-        avg_request_ms = int(self.stats.avg_request_time * 1000)
-        avg_task_ms = int(self.stats.avg_task_time * 1000)
-        errors_cnt = self.stats.critical_errors + self.stats.request_errors
-        avg_pois = self.stats.pois / self.stats.tasks
-        requests_per_minute = 60 / self.stats.avg_task_time
+    def _update_tracker(self):
+        update_tracker(counts=self.key_pool.request_counts(), lock=self._writelock)
 
-        with self.__printlock:
-            print(f"{self.name}: {self.stats.tasks} tasks | {self.stats.requests} requests | "
-                  f"{self.stats.pois} POIs | {avg_pois:.1f} POIs per task avg | "
-                  f"{errors_cnt} errors | {requests_per_minute:.1f} req per min | "
-                  f"{avg_request_ms} ms per request | {avg_task_ms} ms per task")
+    def _open_cache(self):
+        self.cache = make_cache()
+        if self.cache is not None:
+            self.cache.connect()
 
-    def write_traceback(self, e: Exception):
-        with self.__printlock:
-            write_traceback(e=e, file=config.TB_FILE)
+    def _from_cache(self, task: TaskDefinition, page_token: str = None) -> Optional[dict]:
 
-    def _prepare(self):
+        """ Cached response of the request, None on a miss or if the cache is off. """
 
-        self.densifier = Densifier()
-        self._check_api_key()
-        self._load_tracker()
-        self._update_tracker()
+        if self.cache is None:
+            return None
 
-        self.print(f'{self.name} ready. {self.stats.previous_requests} requests made in previous runs | Using API key {self.maps.key}')
+        resp = self.cache.get(lat=task.lat, lon=task.lon, radius=self.__cache_radius(task),
+                              place_type=task.place_type, page_token=page_token)
+        if resp is None:
+            self.stats.cache_misses += 1
+        else:
+            self.stats.cache_hits += 1
+        return resp
 
-    def _load_tracker(self):
+    def _to_cache(self, task: TaskDefinition, resp: dict, page_token: str = None):
+        if self.cache is not None:
+            self.cache.put(lat=task.lat, lon=task.lon, radius=self.__cache_radius(task), place_type=task.place_type,
+                           resp=resp, page_token=page_token)
 
-        """ Loads requests count from previous sessions. """
+    def _drop_cached_chain(self, task: TaskDefinition):
 
-        if os.path.isfile(config.TRACKER_JSON):
-            with self.__writelock, open(config.TRACKER_JSON, encoding='utf-8-sig') as f:
-                d = json.loads(f.read())
-            try:
-                self.stats.previous_requests = d[self.maps.key]
-            except KeyError:
-                self.stats.previous_requests = 0
+        """ Call when a cached page leads to one that is not cached: the task is retried live, not from the cache. """
+
+        if self.cache is not None:
+            self.cache.invalidate(lat=task.lat, lon=task.lon, radius=self.__cache_radius(task),
+                                  place_type=task.place_type)
+
+    def __cache_radius(self, task: TaskDefinition) -> float:
+        return 0 if self.rank_by else task.radius     # distance ranked searches have no radius
+
+    def _on_extra_request(self, key: str, kind: str):
+
+        """
+        Charges retries and hedges made by the transport, they are billed like any other request. A retry is not
+        a throttling signal by itself: the controller backs off once retries run out or on OVER_QUERY_LIMIT.
+        """
+
+        self.stats.requests += 1
+        if kind == "retry":
+            self.stats.retries += 1
         else:
-            self.stats.previous_requests = 0
+            self.stats.hedges += 1
+        self.key_pool.charge(key)
 
-    def _update_tracker(self):
-        with self.__writelock, open(config.TRACKER_JSON, 'r+', encoding='utf-8-sig') as f:
-            trackerdict = json.loads(f.read())
-            f.seek(0)  # return pointer to the beginning of file before writing'
+    def skip_if_covered(self, task: TaskDefinition) -> bool:
 
-            trackerdict[self.maps.key] = self.stats.previous_requests + self.stats.requests
-            json.dump(trackerdict, f)
+        """ Completes the task without a request if its circle was already searched through. """
 
-    def _check_api_key(self):
+        if self.coverage is None or task.page_token or not self.coverage.is_covered(task):
+            return False
+
+        self.coverage.mark_skipped()
+        self.stats.covered += 1
+        self.submit_complete(task=task)
+        return True
+
+    def record_coverage(self, task: TaskDefinition):
+
+        """ Call for tasks completed with less than 60 results, or with the reach of a distance ranked search. """
+
+        if self.coverage is not None:
+            self.coverage.add(task)
+
+    def complete_search(self, task: TaskDefinition, got: int, last_page: List[PoiData]):
+
+        """ Once all pages of a task are in: recursion if the search saturated, coverage otherwise. """
+
+        if self.rank_by:
+            # results are ranked by distance, so everything up to the farthest one was found
+            if got >= 60:
+                reach = max([distance(task.lon, task.lat, p.lon, p.lat) for p in last_page], default=0)
+            else:
+                reach = config.FRONTIER_MAX_REACH
+            reached = TaskDefinition(task.lon, task.lat, max(reach, config.MIN_ALLOWED_RADIUS), task.place_type,
+                                     task_id=task.task_id)
+            self.record_coverage(task=reached)
+            if got >= 60:
+                self.submit_for_recursion(task=reached)
+
+        elif got >= 60:
+            # produce tasks for recursion if needed
+            if config.DEBUG:
+                self.print(f"{self.name}: submitting task for recursion")
+            self.submit_for_recursion(task=task)
+
+        else:
+            self.record_coverage(task=task)
+
+    def submit_for_recursion(self, task: TaskDefinition):
+
+        """ Makes new tasks for a parent search task that needs recursion. """
 
-        """ Make a sample request that is known to be valid. """
         try:
-            self.maps.places_nearby(
-                location=(53.909804, 27.580184),
-                radius=650,
-                open_now=False,
-                language=config.LANGUAGE,
-                type='cafe',
-                # rank_by='distance',        # IMPORTANT: cannot use rank_by and radius options together
-                page_token=None,
-            )
-        except Exception as e:
+            densified_tasks = self.densifier.densify(task=task)
+        except SearchRecursionError:
+            return  # skip if no recursion is possible due to radius being too small (can be changed in config)
+
+        pruned, queued = 0, []
+        for t in densified_tasks:
+            if self.aoi is not None and not self.aoi.intersects_circle(t.lon, t.lat, t.radius):
+                pruned += 1     # never queued nor recorded
+                continue
+            if self.duplicates is not None and not self.duplicates.add(t):
+                self.stats.duplicates += 1      # the same search is queued already
+                continue
+            self.tasks_q.put(t)     # for processing
+            queued.append(t)
+
+        if queued:
+            # for record in the database, ahead of the parent's success on the same queue
+            self.poi_db_q.put(PageBatch(pois=[], jobs=queued))
+
+        if pruned:
+            self.stats.pruned += pruned
+            if self.pruned is not None:
+                with self.pruned.get_lock():
+                    self.pruned.value += pruned
+
+    def submit_page(self, pois: List[PoiData], ack: Union[PageContinuation, TaskDefinition, None] = None):
+
+        """
+        Sends POIs of a results page to the writers in one message each, the database writer gets them
+        with the checkpoint of the next page or with the completed task.
+        """
+
+        raws = []
+        for i in pois:
+            assert isinstance(i, PoiData), "must be a PoiData instance!"
+            # only the raw JSON writer needs the payload. queues pickle later, don't touch i after put()
+            raws.append((i.place_id, i.raw))
+            i.raw = None
+
+        self.poi_db_q.put(PageBatch(pois=pois, ack=ack))
+        if raws:
+            self.rawfile_q.put(raws)
+
+    def submit_complete(self, task: TaskDefinition):
+
+        """ Acknowledges a task that has no POIs left to send. """
+
+        self.poi_db_q.put(PageBatch(pois=[], ack=task))
+
+
+class GoogleWorker(CollectorBase):
+
+    """ Collector worker process. API keys are leased from the shared pool for every request. """
+
+    __info_each: int = 5
+
+    def __init__(self,
+                 key_pool: KeyPool,
+                 tasks_q: mp.Queue,
+                 database_q: mp.Queue,
+                 rawfile_q: mp.Queue,
+                 printlock: mp.Lock,
+                 writelock: mp.Lock,
+                 coverage: CoverageIndex = None,
+                 aoi: PreparedPolygon = None,
+                 pruned: mp.Value = None,
+                 duplicates: DuplicateIndex = None
+                 ):
 
-            with self.__writelock:
-                self.print(f'ERROR: bad API key "{self.maps.key}" (tracker={self.stats.previous_requests})\n')
-                raise e
+        self.transport: PlacesTransport = None     # initialize in a separate process
+        self.__ignore_taks = set()
+        self.__continuations: List[PageContinuation] = []     # heap, earliest not_before first
+        self.__retry_here: List[TaskDefinition] = None      # tasks put back while draining, see _drain_continuations
+
+        super().__init__(key_pool=key_pool, tasks_q=tasks_q,
+                         database_q=database_q, rawfile_q=rawfile_q,
+                         printlock=printlock, writelock=writelock, coverage=coverage, aoi=aoi,
+                         pruned=pruned, duplicates=duplicates)
 
-    def search_task(self, task: TaskDefinition, page_token: str = None, got_before: int = 0):
+        self.controller = AimdController()
+
+    def print_info(self):
+
+        avg_request_ms = int(self.stats.avg_request_time * 1000)
+        avg_job_ms = int(self.stats.avg_job_time * 1000)
+        errors_cnt = self.stats.critical_errors + self.stats.request_errors
+        avg_pois = self.stats.pois / self.stats.tasks if self.stats.tasks else 0
+        requests_per_minute = 60 / self.stats.avg_job_time if self.stats.avg_job_time else 0
+
+        with self._printlock:
+            print(f"{self.name}: {self.stats.tasks} tasks | {self.stats.requests} requests | "
+                  f"{self.stats.pois} POIs | {avg_pois:.1f} POIs per task avg | "
+                  f"{errors_cnt} errors | {self.stats.retries} retries | {self.stats.hedges} hedges | "
+                  f"{self.stats.cache_hits} cache hits, {self.stats.cache_misses} misses | "
+                  f"{self.stats.covered} covered tasks skipped | {self.stats.pruned} outside AOI | "
+                  f"{self.stats.duplicates} duplicates | "
+                  f"{requests_per_minute:.1f} req per min "
+                  f"(target {self.controller.rate * 60:.1f}) | "
+                  f"{avg_request_ms} ms per request | {avg_job_ms} ms per page incl. waiting | "
+                  f"{len(self.__continuations)} pages scheduled | {self.key_pool.active_count()} keys active")
+
+    def _prepare(self):
+
+        self.densifier = make_densifier()
+        self.transport = make_transport(limiter=self.limiter, on_extra_request=self._on_extra_request)
+        self._open_cache()
+
+        self.print(f'{self.name} ready. {self.key_pool.active_count()} out of {len(self.key_pool.keys)} '
+                   f'API keys can be used')
+
+    def search_task(self, task: TaskDefinition, page_token: str = None, got_before: int = 0, key: str = None) \
+            -> Tuple[List[PoiData], Optional[str], str]:
+
+        """
+        Requests a single results page. Returns POIs of the page, the token of the next one (if any)
+        and the API key used - next pages must be requested with the same key.
+        Pages found in the response cache are returned with no key and cost no quota.
+        """
 
         # if config.DEBUG:
         #     self.print(f"{self.name}: got task")
-        task.tries += 1
+        if not page_token:
+            task.tries += 1
 
         got_before = got_before if got_before else 0
 
+        cached = self._from_cache(task=task, page_token=page_token)
+        if cached is not None:
+            try:
+                pois: List[PoiData] = PoiData.from_response(resp=cached)
+            except ZeroResultsException:
+                return [], None, None
+            self.stats.pois += len(pois)
+            return pois, cached.get("next_page_token"), None
+
+        if self.cache is not None and self.cache.offline:
+            raise CacheMissException(f"task {task.task_id} is not cached")     # replaying offline
+
+        if page_token and key is None and page_token != task.page_token:
+            # token came from the cache, but its page did not
+            self._drop_cached_chain(task=task)
+            raise ExpiredPageTokenException(f"page token of a cached response cannot be requested")
+
+        if page_token and key and not self.key_pool.is_active(key):
+            raise ExpiredPageTokenException(f"API key that issued the page token is not usable anymore")
+
+        time.sleep(self.controller.reserve())      # adaptive rate
+        key = self.key_pool.lease(preferred=key)
         location = (task.lat, task.lon)
+        self.limiter.acquire(key)     # only blocks if no token is available
         _started = time.time()
         self.stats.requests += 1
+        failed = False
 
         # parse here
         try:
             if not page_token:
-                resp = self.maps.places_nearby(location=location,
-                                               radius=task.radius,
-                                               open_now=False,
-                                               language=config.LANGUAGE,
-                                               type=task.place_type)
+                resp = self.transport.places_nearby(key=key,
+                                                    location=location,
+                                                    radius=task.radius,
+                                                    place_type=task.place_type,
+                                                    rank_by=self.rank_by)
             else:
-                resp = self.maps.places_nearby(page_token=page_token)
+                resp = self.transport.places_nearby(key=key, page_token=page_token)
 
             # info timing
             _elapsed = time.time() - _started
             self.stats.avg_request_time = (_elapsed + self.stats.avg_request_time * self.stats.requests) / (
                         self.stats.requests + 1)
+            self.stats.total_request_time += _elapsed
 
+            self._to_cache(task=task, resp=resp, page_token=page_token)
             pois: List[PoiData] = PoiData.from_response(resp=resp)
 
-            # ensure gaps between requests
-            if _elapsed < MIN_REQUEST_INTERVAL:
-                time.sleep(MIN_REQUEST_INTERVAL - _elapsed)  # wait the rest of time
-            time.sleep(0.15)   # as well, sleep for another 150 ms
-
         except ZeroResultsException:
-            return []
+            return [], None, key
 
-        except (googlemaps.exceptions._OverQueryLimit, WastedQuotaException) as e:
+        except WastedQuotaException as e:
+            failed = True
+            self.controller.backoff()
             self.write_traceback(e)
-            self.finished = True
-            raise WastedQuotaException(
-                f'{self.name} reached maximum allowed quota. For details, check your Google Developers Account\n'
-                f'{self.stats.previous_requests} requests made overall\n'
-                f'API key used: {self.maps.key}'
-                'Terminating thread...'
-            )
+            self.key_pool.mark_exhausted(key)
+            self.print(f'{self.name}: API key {key} reached maximum allowed quota and will not be used anymore. '
+                       f'For details, check your Google Developers Account')
+            raise e
 
         except InvalidRequestException as e:
+            failed = True
+            if page_token and page_token == task.page_token:
+                raise ExpiredPageTokenException(f"page token of task {task.task_id} restored from previous session")
+
             self.write_traceback(e)
             self.stats.critical_errors += 1
             self.print(
-                    f"ERROR: invalid request exception in {self.name}. API key: {self.maps.key}\n"
+                    f"ERROR: invalid request exception in {self.name}. API key: {key}\n"
                     f"Params: location = {location}, radius={task.radius}, type={task.place_type}, "
                     f"page_token={page_token}, got_before = {got_before} "
             )
-            return []
+            raise e
 
         except RequestDeniedException as e:
+            failed = True
             self.write_traceback(e)
-            self.stats.critical_errors += 1
-            self.print(
-                f"ERROR: request denied exception in {self.name}\n"
-                f"Params: location = {location}, radius={task.radius}, type={task.place_type}, "
-                f"page_token={page_token}, got_before = {got_before} "
-                       )
-            return []
+            self.key_pool.mark_denied(key)
+            self.print(f"ERROR: request denied for API key {key} in {self.name}, the key will not be used anymore")
+            raise e
 
-        except googlemaps.exceptions.ApiError as e:
+        except TransportError as e:
+            failed = True
             self.write_traceback(e)
-            self.stats.critical_errors += 1
-            self.print(
-                f"ERROR: API error occurred in {self.name}\n"
-                f"Params: location = {location}, radius={task.radius}, type={task.place_type}, "
-                f"page_token={page_token}, got_before = {got_before} "
-            )
-            raise e         # TODO fix
-            return []
+            if RetryPolicy.is_transient(e):
+                # retries ran out or UNKNOWN_ERROR, the task will be tried again later
+                self.controller.backoff()
+                self.stats.request_errors += 1
+            else:
+                self.stats.critical_errors += 1
+                self.print(
+                    f"ERROR: transport error occurred in {self.name}\n"
+                    f"Params: location = {location}, radius={task.radius}, type={task.place_type}, "
+                    f"page_token={page_token}, got_before = {got_before} "
+                )
+            raise e
 
-        next_page_token = resp.get("next_page_token")
-        got_for_the_task = len(pois) + got_before
+        finally:
+            self.key_pool.release(key, latency=time.time() - _started, error=failed)
+            self.controller.update(self.stats)
 
         # if config.DEBUG:
-        #     self.print(f"{self.name}: {got_for_the_task} POIs retrieved (next page = {not not next_page_token})")
+        #     self.print(f"{self.name}: {len(pois) + got_before} POIs retrieved")
 
         self.stats.pois += len(pois)
 
-        if next_page_token is None:
+        return pois, resp.get("next_page_token"), key
 
-            # no need to make more requests for this task
-            if got_before >= 60:
-                # produce tasks for recursion if needed
-                if config.DEBUG:
-                    self.print(f"{self.name}: submitting task for recursion")
-                self.submit_for_recursion(task=task)
+    def do_page(self, task: TaskDefinition, page_token: str = None, got_before: int = 0, key: str = None):
 
-            # if config.DEBUG:
-            #     self.print(f"{self.name}: task complete")
+        """ Requests a page and streams its POIs, then either schedules the next page or completes the task. """
 
-            return pois
-        else:
-            # at some point it reaches a state where next_page_token is None and returns all the results
-            return pois + self.search_task(
-                task=task,
-                page_token=next_page_token,
-                got_before=got_for_the_task
-            )
+        try:
+            pois, next_page_token, key = self.search_task(task=task, page_token=page_token, got_before=got_before,
+                                                          key=key)
+
+        except (ExpiredPageTokenException, WastedQuotaException, RequestDeniedException, TransportError):
+            # key rotated away, token not accepted or transport gave up: start over from the first page,
+            # POIs recorded before will not be duplicated by the writer
+            task.page_token, task.got_before = None, 0
+            if self.__retry_here is not None:
+                self.__retry_here.append(task)      # this worker does not read the queue anymore
+            else:
+                self.tasks_q.put(task)
+            return
 
-    def submit_for_recursion(self, task: TaskDefinition):
+        except NoKeysLeftException as e:
+            self.tasks_q.put(task)      # recorded as a job, the writer keeps it for RESUME if nobody completes it
+            raise e
 
-        """ Makes new tasks for a parent search task that needs recursion. """
+        except (InvalidRequestException, CacheMissException):
+            # nothing to learn about the area, complete without recursion or coverage
+            self.submit_complete(task=task)
+            self.stats.tasks += 1
+            return
 
-        try:
-            densified_tasks = self.densifier.densify(task=task)
-            for t in densified_tasks:
-                self.tasks_q.put(t)     # for processing
-                self.tasks_database_q.put(t)    # for record in the database
-        except SearchRecursionError:
-            pass    # skip if no recursion is possible due to radius being too small (can be changed in config)
+        got_for_the_task = got_before + len(pois)
+
+        if next_page_token:
+            # next page token is not valid right away, other tasks are processed meanwhile
+            # (tokens of cached pages are only looked up in the cache)
+            continuation = PageContinuation(task=task, page_token=next_page_token, got_before=got_for_the_task,
+                                            key=key, delay=config.NEXT_PAGE_DELAY if key else 0)
+            self.submit_page(pois=pois, ack=continuation)
+            heapq.heappush(self.__continuations, continuation)
+            return
+
+        # no need to make more requests for this task
+        self.complete_search(task=task, got=got_for_the_task, last_page=pois)
+        self.submit_page(pois=pois, ack=task)
+        self.stats.tasks += 1
+
+    def _next_continuation_in(self) -> Optional[float]:
+
+        """ Seconds until the earliest scheduled page can be requested, None if nothing is scheduled. """
+
+        if not self.__continuations:
+            return None
+        return max(0.0, self.__continuations[0].not_before - time.time())
+
+    def _do_continuation(self):
+        cont: PageContinuation = heapq.heappop(self.__continuations)
+        self.do_page(task=cont.task, page_token=cont.page_token, got_before=cont.got_before, key=cont.key)
 
     def _get_from_queue_and_do_job(self):
 
+        # pages whose tokens matured go first
+        wait = self._next_continuation_in()
+        if wait == 0:
+            self._do_continuation()
+            return
+
         try:
             #   will wait for N sec and throw Empty exception if nothing found
-            task: TaskDefinition = self.tasks_q.get(timeout=1)  # is an instance of TaskDefinition
+            #   never longer than until the next scheduled page is due
+            task: TaskDefinition = self.tasks_q.get(timeout=min(1, wait) if wait else 1)
         except Empty as e:
-            time.sleep(1)   # wait for new tasks a bit
+            if wait is None:
+                time.sleep(1)   # wait for new tasks a bit
             raise e         # will repeat the main loop
 
         if not isinstance(task, TaskDefinition):
@@ -304,55 +544,94 @@ class GoogleWorker(mp.Process):
         elif task.tries >= config.MAX_TRIES_WITH_TASK:
             return    # discard
 
-        else:
-            results = self.search_task(task=task)
-            for i in results:
-                assert isinstance(i, PoiData), "must be a PoiData instance!"
-                self.poi_db_q.put(i)
-                self.rawfile_q.put(i)
-            self.complete_tasks_q.put(task)
+        elif self.skip_if_covered(task=task):
+            return
 
-    def run(self):
-
-        self.print(f"{self.name} started")
-        self._prepare()
-        last_task = time.time()   # time waiting for a new task, will exit if waiting for too long
-
-        while not self.finished:
-
-            if self.stats.critical_errors > self.critical_errors_threshold:
-                raise Exception(
-                    f"Too many critical errors encountered ({self.stats.critical_errors}). Terminating..."
-                )
-
-            try:
-                _started = time.time()
-                self._get_from_queue_and_do_job()
-                _elapsed = time.time() - _started
-                self.stats.avg_task_time = (_elapsed + self.stats.tasks * self.stats.avg_task_time) / (self.stats.tasks + 1)
-                self.stats.tasks += 1
+        else:
+            # restored tasks may continue from the last recorded page
+            self.do_page(task=task, page_token=task.page_token, got_before=task.got_before)
 
-                last_task = time.time()
+    def _drain_continuations(self):
 
-                if self.stats.tasks % self.__info_each == 0:
-                    self.print_info()
+        """
+        Finishes already started tasks before exiting. The queue is not read anymore, so tasks put back meanwhile
+        are tried again here.
+        """
 
-            except Empty:
+        self.__retry_here = []
+        while self.__continuations or self.__retry_here:
+            if self.__continuations:
+                time.sleep(self._next_continuation_in())
+                self._do_continuation()
                 continue
 
-            except FinishException:
-                self.finished = True
-                break
+            task = self.__retry_here.pop()
+            if task.tries < config.MAX_TRIES_WITH_TASK and not self.skip_if_covered(task=task):
+                self.do_page(task=task)
 
-            if self.stats.requests % 4 == 0:    # update tracker every N
-                self._update_tracker()
+    def run(self):
 
-            # exit if waiting for new task for too long
-            waiting_uninterrupted = time.time() - last_task
-            if waiting_uninterrupted >= config.MAX_WAITING_UNINTERRUPTED:
-                break
+        self.print(f"{self.name} started")
+        self._prepare()
+        last_task = time.time()   # time waiting for a new task, will exit if waiting for too long
 
-        # after the loop and before thread can be joined
-        self._update_tracker()
+        try:
+            while not self.finished:
+
+                if self.stats.critical_errors > self.critical_errors_threshold:
+                    raise Exception(
+                        f"Too many critical errors encountered ({self.stats.critical_errors}). Terminating..."
+                    )
+
+                try:
+                    _started = time.perf_counter()     # jobs may take less than time.time() resolution on Windows
+                    self._get_from_queue_and_do_job()
+                    _elapsed = time.perf_counter() - _started
+                    self.stats.avg_job_time = \
+                        (_elapsed + self.stats.jobs * self.stats.avg_job_time) / (self.stats.jobs + 1)
+                    self.stats.jobs += 1
+
+                    last_task = time.time()
+
+                    if self.stats.jobs % self.__info_each == 0:
+                        self.print_info()
+
+                except Empty:
+                    # scheduled pages are still work to do, otherwise exit if waiting for too long
+                    if self.__continuations:
+                        last_task = time.time()
+                    elif time.time() - last_task >= config.MAX_WAITING_UNINTERRUPTED:
+                        break
+                    continue
+
+                except FinishException:
+                    self.finished = True
+                    break
+
+                except NoKeysLeftException:
+                    self.print(f"{self.name}: no usable API keys left. Terminating...")
+                    self.finished = True
+                    break
+
+                if self.stats.requests % 4 == 0:    # update tracker every N
+                    self._update_tracker()
+
+                # exit if waiting for new task for too long
+                waiting_uninterrupted = time.time() - last_task
+                if waiting_uninterrupted >= config.MAX_WAITING_UNINTERRUPTED:
+                    break
+
+            # after the loop, started tasks are finished before the thread can be joined
+            if self.key_pool.active_count() > 0:
+                self._drain_continuations()
+
+        except NoKeysLeftException:
+            self.print(f"{self.name}: no usable API keys left while finishing started tasks")
+
+        finally:
+            self._update_tracker()
+            self.transport.close()
+            if self.cache is not None:
+                self.cache.close()
 
         # join thread in main